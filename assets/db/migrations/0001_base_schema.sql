@@ -0,0 +1,5 @@
+-- Base tables of the SmartCoil DB, as found in the original SmartCoilDB template.
+CREATE TABLE IF NOT EXISTS YR_WEATHER_API_DATA (timestamp datetime, latitude decimal(3,5), longitude decimal(3,5), temperature decimal(3,2), humidity decimal(3,2), pressure decimal(5,2), condition varchar(20), condition_code integer, wind_speed decimal(2,2), wind_direction_name varchar(3), wind_direction_degrees decimal(3,2), precipitation decimal(3,2));
+CREATE TABLE IF NOT EXISTS APP_STATUS (timestamp datetime, status varchar(3));
+CREATE TABLE IF NOT EXISTS USER_DATA (timestamp datetime, temperature decimal(3,2), speed int);
+CREATE TABLE IF NOT EXISTS SENSOR_BME680_DATA (timestamp datetime, temperature decimal(3,2), humidity decimal(3,2), pressure decimal(4,2), gas_resistance decimal(6,2), air_quality decimal(3,2), fancoil_running int);
@@ -0,0 +1,5 @@
+-- Timestamp indexes so latest-row lookups and time range queries don't scan whole tables.
+CREATE INDEX IF NOT EXISTS IDX_YR_WEATHER_API_DATA_TIMESTAMP ON YR_WEATHER_API_DATA (timestamp);
+CREATE INDEX IF NOT EXISTS IDX_APP_STATUS_TIMESTAMP ON APP_STATUS (timestamp);
+CREATE INDEX IF NOT EXISTS IDX_USER_DATA_TIMESTAMP ON USER_DATA (timestamp);
+CREATE INDEX IF NOT EXISTS IDX_SENSOR_BME680_DATA_TIMESTAMP ON SENSOR_BME680_DATA (timestamp);
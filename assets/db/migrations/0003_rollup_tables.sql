@@ -0,0 +1,8 @@
+-- Minute, hour and day rollups of sensor and weather readings, updated as rows are written.
+-- Means are {column}_sum / {column}_count, the fancoil duty fraction is fan_on_secs / covered_secs.
+CREATE TABLE IF NOT EXISTS SENSOR_ROLLUP_MINUTE (bucket datetime PRIMARY KEY, samples int, temperature_min real, temperature_max real, temperature_sum real, temperature_count int, humidity_min real, humidity_max real, humidity_sum real, humidity_count int, pressure_min real, pressure_max real, pressure_sum real, pressure_count int, gas_resistance_min real, gas_resistance_max real, gas_resistance_sum real, gas_resistance_count int, air_quality_min real, air_quality_max real, air_quality_sum real, air_quality_count int, fan_on_secs real, covered_secs real);
+CREATE TABLE IF NOT EXISTS SENSOR_ROLLUP_HOUR (bucket datetime PRIMARY KEY, samples int, temperature_min real, temperature_max real, temperature_sum real, temperature_count int, humidity_min real, humidity_max real, humidity_sum real, humidity_count int, pressure_min real, pressure_max real, pressure_sum real, pressure_count int, gas_resistance_min real, gas_resistance_max real, gas_resistance_sum real, gas_resistance_count int, air_quality_min real, air_quality_max real, air_quality_sum real, air_quality_count int, fan_on_secs real, covered_secs real);
+CREATE TABLE IF NOT EXISTS SENSOR_ROLLUP_DAY (bucket datetime PRIMARY KEY, samples int, temperature_min real, temperature_max real, temperature_sum real, temperature_count int, humidity_min real, humidity_max real, humidity_sum real, humidity_count int, pressure_min real, pressure_max real, pressure_sum real, pressure_count int, gas_resistance_min real, gas_resistance_max real, gas_resistance_sum real, gas_resistance_count int, air_quality_min real, air_quality_max real, air_quality_sum real, air_quality_count int, fan_on_secs real, covered_secs real);
+CREATE TABLE IF NOT EXISTS WEATHER_ROLLUP_MINUTE (bucket datetime PRIMARY KEY, samples int, temperature_min real, temperature_max real, temperature_sum real, temperature_count int, humidity_min real, humidity_max real, humidity_sum real, humidity_count int, pressure_min real, pressure_max real, pressure_sum real, pressure_count int, wind_speed_min real, wind_speed_max real, wind_speed_sum real, wind_speed_count int, precipitation_min real, precipitation_max real, precipitation_sum real, precipitation_count int);
+CREATE TABLE IF NOT EXISTS WEATHER_ROLLUP_HOUR (bucket datetime PRIMARY KEY, samples int, temperature_min real, temperature_max real, temperature_sum real, temperature_count int, humidity_min real, humidity_max real, humidity_sum real, humidity_count int, pressure_min real, pressure_max real, pressure_sum real, pressure_count int, wind_speed_min real, wind_speed_max real, wind_speed_sum real, wind_speed_count int, precipitation_min real, precipitation_max real, precipitation_sum real, precipitation_count int);
+CREATE TABLE IF NOT EXISTS WEATHER_ROLLUP_DAY (bucket datetime PRIMARY KEY, samples int, temperature_min real, temperature_max real, temperature_sum real, temperature_count int, humidity_min real, humidity_max real, humidity_sum real, humidity_count int, pressure_min real, pressure_max real, pressure_sum real, pressure_count int, wind_speed_min real, wind_speed_max real, wind_speed_sum real, wind_speed_count int, precipitation_min real, precipitation_max real, precipitation_sum real, precipitation_count int);
@@ -0,0 +1,4 @@
+-- Storage format of the raw tables ('v1' or 'v2') and the v2 code table for weather strings.
+CREATE TABLE IF NOT EXISTS DB_META (key varchar(32) PRIMARY KEY, value varchar(64));
+INSERT OR IGNORE INTO DB_META VALUES ('storage_format', 'v1');
+CREATE TABLE IF NOT EXISTS WEATHER_CODES (id integer PRIMARY KEY, kind varchar(20), name varchar(20), UNIQUE (kind, name));
@@ -0,0 +1,3 @@
+-- Fancoil runs as intervals, one row per stretch at a constant speed. end_time is NULL while the
+-- run is open, continued is 1 when the run follows a speed change of the same cycle.
+CREATE TABLE IF NOT EXISTS FANCOIL_RUNS (start_time datetime PRIMARY KEY, end_time datetime, speed int, mode varchar(4), continued int DEFAULT 0);
@@ -0,0 +1,3 @@
+-- One row per finished day: indoor vs outdoor temperature, fancoil seconds per speed (fan_secs_unknown for
+-- runs derived from sensor rows), setpoint changes and app uptime.
+CREATE TABLE IF NOT EXISTS DAILY_SUMMARY (day date PRIMARY KEY, indoor_min real, indoor_max real, indoor_avg real, outdoor_min real, outdoor_max real, outdoor_avg real, fan_secs_lo real, fan_secs_mi real, fan_secs_hi real, fan_secs_unknown real, setpoint_changes int, uptime_secs real, finalized_at datetime);
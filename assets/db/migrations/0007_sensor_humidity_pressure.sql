@@ -0,0 +1,5 @@
+-- Sensor rows written before the insert order fix hold the pressure in the humidity column and the other way
+-- around. Relative humidity never goes over 100 % while pressure stays around 1000 hPa, so rows with a humidity
+-- above the pressure are the pre-fix ones. Rollups, archives and daily summaries came along with the fix and never
+-- saw swapped rows; the swap is the same for v1 and v2 rows, both columns share the same scale.
+UPDATE SENSOR_BME680_DATA SET humidity = pressure, pressure = humidity WHERE humidity > pressure;
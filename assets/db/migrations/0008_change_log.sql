@@ -0,0 +1,3 @@
+-- Keys of the rows inserted or updated since the last backup, filled by triggers the backup manager adds with its
+-- first full backup. Incremental backups ship the rows logged here, whatever their timestamps, and prune it.
+CREATE TABLE IF NOT EXISTS CHANGE_LOG (seq integer PRIMARY KEY AUTOINCREMENT, tbl varchar(32), key);
@@ -0,0 +1,181 @@
+import asyncio
+import traceback
+from datetime import datetime
+from concurrent.futures import ThreadPoolExecutor
+from queue import Empty
+from threading import Thread
+from .utils.eventBus import MsgType
+
+class AsyncRuntime():
+    '''Serves as the optional asyncio runtime of the SmartCoil class. The sensor loop, weather
+    updates, message handling and GUI initialization run as coroutines of a single event loop
+    instead of one polling thread each: the sensor ticks on absolute deadlines, the weather loop
+    sleeps straight to its next 5 minutes slot, and the message loop wakes up only when something
+    is put on the bus. Blocking work (I2C, weather API, handlers touching SQLite and the GUI) goes
+    to executors, so the loop itself never blocks. The sensor has an executor of its own, so a
+    slow weather API can never hold up a sensor tick.'''
+
+    def __init__(self, coil, io_workers = 2):
+        '''Args:
+            coil (:obj:`SmartCoil`): The app, already initialized.
+            io_workers (int, optional): Threads of the executor running weather and DB I/O.
+                Defaults to 2.
+        '''
+        self.coil = coil
+        self.io = ThreadPoolExecutor(io_workers, thread_name_prefix='asyncio')
+        self.sensor_io = ThreadPoolExecutor(1, thread_name_prefix='sensor')
+        # a single thread, so handlers still run one at a time and in order.
+        self.handlers = ThreadPoolExecutor(1, thread_name_prefix='msghandler')
+        self.loop = None
+        self.stopping = None
+
+    def stop(self):
+        '''Wakes up every sleeping coroutine so they can see the app is exiting. Safe to call
+        from any thread.
+        '''
+        if self.loop is not None and not self.loop.is_closed():
+            self.loop.call_soon_threadsafe(self.stopping.set)
+
+    async def sleep(self, seconds):
+        '''Helper coroutine to sleep, returning early if the app is exiting.
+
+        Args:
+            seconds (float): Seconds to sleep.
+        '''
+        try:
+            await asyncio.wait_for(self.stopping.wait(), max(seconds, 0))
+        except asyncio.TimeoutError:
+            pass
+
+    async def run_sensor(self):
+        '''Coroutine polling the BME680 sensor every second. Ticks are scheduled on absolute
+        deadlines, so the time spent reading the sensor doesn't make them drift.
+        '''
+        next_tick = self.loop.time()
+        while not self.coil.exit.is_set():
+            try:
+                await self.loop.run_in_executor(self.sensor_io, self.coil.snsr.poll)
+            except Exception as e:
+                print('Exception at AsyncRuntime.run_sensor')
+                print(type(e))
+                print(e)
+                traceback.print_tb(e.__traceback__)
+
+            next_tick += 1
+            # ticks missed while the sensor was slow are skipped, not caught up.
+            if next_tick < self.loop.time():
+                next_tick = self.loop.time()
+            await self.sleep(next_tick - self.loop.time())
+
+        self.coil.snsr.stopped()
+
+    async def run_weather(self):
+        '''Coroutine fetching the weather API on periods of multiples of 5 minutes, sleeping
+        until the next one in between.
+        '''
+        while not self.coil.exit.is_set():
+            await self.sleep(self.coil.wthr.seconds_to_next_update())
+            if self.coil.exit.is_set():
+                break
+            try:
+                retried = await self.update_weather()
+                if not self.coil.exit.is_set():
+                    self.coil.wthr.updated(retried)
+            except Exception as e:
+                print('Exception at AsyncRuntime.run_weather')
+                print(type(e))
+                print(e)
+                traceback.print_tb(e.__traceback__)
+
+    async def update_weather(self):
+        '''Coroutine fetching the weather API until it succeeds or the app exits. Only the fetch
+        itself takes an executor thread, retries wait on the loop.
+
+        Returns:
+            bool: Whether it had to try more than once.
+        '''
+        retried = False
+        while not self.coil.exit.is_set():
+            try:
+                await self.loop.run_in_executor(self.io, self.coil.wthr.update_values)
+                break
+            except Exception as e:
+                retried = True
+                ex_time = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+                print('[{}] EXCEPTION: ({}: {}) raised while fetching weather data, retrying...'
+                      .format(ex_time, type(e).__name__, e))
+                await self.sleep(3)
+        return retried
+
+    async def run_msg_handler(self):
+        '''Coroutine dispatching the messages put on the bus until an exit message is handled.
+        It's woken up by the bus itself, it never polls.
+        '''
+        bus = self.coil.bus
+        ready = asyncio.Event()
+        bus.wakeup = lambda: self.loop.call_soon_threadsafe(ready.set)
+        # messages put before the loop started are waiting already.
+        ready.set()
+        if bus.handlers is None:
+            bus.resolve()
+
+        try:
+            while True:
+                await ready.wait()
+                ready.clear()
+                while True:
+                    try:
+                        msg = bus.get(block=False)
+                    except Empty:
+                        break
+                    await self.loop.run_in_executor(self.handlers, bus.dispatch, msg)
+                    if msg.type == MsgType.EXIT:
+                        return
+        finally:
+            bus.wakeup = None
+
+    async def fetch_gui_data_init(self):
+        '''Coroutine restoring the user configuration and the weather values on the state store.
+        '''
+        await self.loop.run_in_executor(self.io, self.coil.fetch_gui_data_init, False)
+        try:
+            await self.update_weather()
+            if not self.coil.exit.is_set():
+                await self.loop.run_in_executor(self.io, self.coil.process_new_weather_data)
+        except Exception as e:
+            print('Exception at AsyncRuntime.fetch_gui_data_init')
+            print(type(e))
+            print(e)
+            traceback.print_tb(e.__traceback__)
+
+    async def main(self, with_gui = False):
+        '''Coroutine running every task of the runtime.
+
+        Args:
+            with_gui (bool, optional): Whether the Kivy app runs on this same loop too.
+                Defaults to False.
+        '''
+        self.loop = asyncio.get_running_loop()
+        self.stopping = asyncio.Event()
+
+        tasks = [self.run_msg_handler(), self.run_sensor(), self.run_weather(),
+                 self.fetch_gui_data_init()]
+        if with_gui:
+            tasks.append(self.coil.gui.async_run(async_lib='asyncio'))
+
+        await asyncio.gather(*tasks)
+        self.io.shutdown(wait=False)
+        self.sensor_io.shutdown(wait=False)
+        self.handlers.shutdown(wait=False)
+
+    def run(self):
+        '''Runs the event loop. Kivy versions with async support run the GUI on the loop, in the
+        main thread; older ones keep the GUI in the main thread and the loop in a second one.
+        '''
+        if hasattr(self.coil.gui, 'async_run'):
+            asyncio.run(self.main(with_gui=True))
+            return
+
+        th = Thread(target=asyncio.run, args=(self.main(),), name='asyncio')
+        th.start()
+        self.coil.run_gui()
@@ -0,0 +1,243 @@
+import re
+import time
+import traceback
+from collections import deque
+from datetime import datetime
+from queue import Queue
+from threading import Thread
+from .SmartCoil import SmartCoil, COOLING
+from .externals.weatherData import WeatherData
+from .database.dbWriter import DBWriter
+from .database.migrations import SchemaMigrator
+from .database.compression import SwingingDoorCompressor
+from .database.runs import FancoilRuns
+from .database.storage import TABLES
+from .utils import utils
+from .utils.eventBus import EventBus, Message, MsgType, RequestBroker
+from .utils.messageJournal import read_journal
+from .utils.stateStore import StateStore
+
+# Table written by an INSERT or UPDATE statement.
+TABLE = re.compile(r'(?:INTO|UPDATE)\s+(\w+)')
+
+class FakeSensor():
+    '''Stands for the BME680 sensor during a replay, reporting the journaled readings.'''
+
+    def __init__(self):
+        self.readings = (0, 0, 0, 0, 0)
+
+    def get_most_recent_readings(self, temp_in_f = True):
+        return self.readings
+
+    def sensor_ready(self):
+        return True
+
+class FakeRelays():
+    '''Stands for the relay module during a replay, recording every switch.'''
+
+    def __init__(self, clock):
+        '''Args:
+            clock (callable): Function returning the replay time.
+        '''
+        self.clock = clock
+        self.speed = 0
+        self.switches = []
+
+    def start_coil_at(self, speed):
+        self.speed = speed
+        self.switches.append((self.clock(), speed))
+
+    def restore(self, speed):
+        '''Puts the relays at the journaled speed, without counting it as a switch.'''
+        self.speed = speed
+
+    def fancoil_is_on(self):
+        return self.speed > 0
+
+    def all_off(self):
+        self.start_coil_at(0)
+
+    def cleanup(self):
+        pass
+
+class FakeSnapshot():
+    '''Stands for the state snapshot file during a replay, keeping the state in memory.'''
+
+    def __init__(self):
+        self.state = {}
+
+    def update(self, urgent = True, **fields):
+        self.state.update(fields)
+
+    def flush(self):
+        pass
+
+class FakeWriter():
+    '''Stands for the DB writer during a replay when no DB is given, counting rows per table.'''
+
+    def __init__(self):
+        self.rows = {}
+
+    def submit(self, sql, params):
+        table = TABLE.search(sql).group(1)
+        self.rows[table] = self.rows.get(table, 0) + 1
+
+    def observe(self, table, params):
+        pass
+
+    def close(self):
+        pass
+
+    def get_stats(self):
+        return dict(self.rows)
+
+class JournalReplay():
+    '''Serves as the driver that feeds journaled messages back through SmartCoil.run_msg_handler,
+    against fake sensor, relays and weather, and a state store, holding the journaled state.
+    Messages go through a plain FIFO queue and each one is handled against the state it was
+    journaled with, at the journaled time, so the relay decisions of a replay are deterministic.'''
+
+    def __init__(self, paths, speed = 0, dbase_path = None):
+        '''Args:
+            paths (:obj:`list`): Journal files, replayed in the given order.
+            speed (float, optional): Replay speed, i.e. 1000 to replay at 1000x the journaled
+                pace. Defaults to 0, as fast as possible.
+            dbase_path (:obj:`str`, optional): SQLite DB the replayed rows are written to.
+                Defaults to None, only counting them.
+        '''
+        self.paths = paths
+        self.speed = speed
+        self.dbase_path = dbase_path
+        self.states = deque()
+        self.clock = datetime.now()
+        self.fed = 0
+        self.skipped = 0
+        self.coil = self.build_coil()
+
+    def build_coil(self):
+        '''Helper method to build a SmartCoil instance around the fake peripherals, without
+        running its constructor.
+
+        Returns:
+            :obj:`SmartCoil`: The app to replay the journal against.
+        '''
+        coil = SmartCoil.__new__(SmartCoil)
+        coil.now = lambda: self.clock
+        coil.bus = EventBus(queue=Queue())
+        coil.requests = RequestBroker(coil.bus)
+        coil.snsr = FakeSensor()
+        coil.wthr = WeatherData.__new__(WeatherData)
+        coil.wthr.restore_values({})
+        coil.rc = FakeRelays(lambda: self.clock)
+        coil.snapshot = FakeSnapshot()
+        coil.mode = COOLING
+        coil.target_reached = False
+        coil.fancoil_speed = 0
+        coil.store = StateStore(mode=COOLING)
+        coil.snsr_compressor = SwingingDoorCompressor(TABLES['SENSOR_BME680_DATA'],
+                                                      **utils.load_config('compression'))
+
+        if self.dbase_path is None:
+            coil.dbw = FakeWriter()
+        else:
+            SchemaMigrator(self.dbase_path).migrate()
+            coil.dbw = DBWriter(self.dbase_path, **utils.load_config('db_writer'))
+        coil.runs = FancoilRuns(self.dbase_path, coil.commit_to_db)
+
+        # the journaled state is applied right before the app handlers run.
+        coil.bus.subscribe_all(self.apply_state)
+        coil.register_handlers()
+        return coil
+
+    def apply_state(self, msg):
+        '''Restores the journaled state of the next message on the fake peripherals.
+
+        Args:
+            msg (:obj:`Message`): The message about to be handled.
+        '''
+        entry = self.states.popleft()
+        if entry is None:
+            return
+
+        tstamp, state = entry
+        self.clock = datetime.fromtimestamp(tstamp)
+        self.coil.mode = state.get('mode', self.coil.mode)
+        self.coil.store.update(mode=self.coil.mode)
+        if state.get('sensor'):
+            self.coil.snsr.readings = tuple(state['sensor'])
+        if state.get('user'):
+            setpoint, speed, last_speed = state['user']
+            self.coil.store.update(setpoint=setpoint, speed=speed, last_speed=last_speed)
+        if state.get('control'):
+            # relays included, so only switches made by the replayed handlers are recorded.
+            target_reached, fancoil_speed, running = state['control']
+            self.coil.target_reached = target_reached
+            self.coil.fancoil_speed = fancoil_speed
+            self.coil.rc.restore(fancoil_speed)
+            self.coil.store.update(fancoil_running=running)
+        if state.get('weather'):
+            self.coil.wthr.restore_values(state['weather'])
+
+    def feed(self):
+        '''Puts the journaled messages on the bus, paced by the replay speed, followed by an exit
+        message. Journaled exit messages are left out, they would stop the replay early.
+        '''
+        try:
+            started = time.monotonic()
+            first = None
+            for path in self.paths:
+                for tstamp, msg_type, action, params, state in read_journal(path):
+                    if msg_type == MsgType.EXIT:
+                        self.skipped += 1
+                        continue
+
+                    if first is None:
+                        first = tstamp
+                    if self.speed:
+                        delay = (tstamp - first) / self.speed - (time.monotonic() - started)
+                        if delay > 0:
+                            time.sleep(delay)
+
+                    self.states.append((tstamp, state))
+                    self.coil.bus.put(Message(msg_type, action, params))
+                    self.fed += 1
+        except Exception as e:
+            print('Exception at JournalReplay.feed')
+            print(type(e))
+            print(e)
+            traceback.print_tb(e.__traceback__)
+        finally:
+            self.states.append(None)
+            self.coil.bus.put(Message(MsgType.EXIT))
+
+    def run(self):
+        '''Replays the journal.
+
+        Returns:
+            :obj:`dict`: Messages replayed and skipped, duration, messages/s, relay switches as
+            (time, speed) tuples and the rows written (or counted) per table.
+        '''
+        start = time.time()
+        db_thread = None
+        if self.dbase_path is not None:
+            db_thread = Thread(target=self.coil.dbw.run, name='dbwriter')
+            db_thread.start()
+
+        feeder = Thread(target=self.feed, name='replayfeeder')
+        feeder.start()
+        self.coil.run_msg_handler()
+        feeder.join()
+
+        self.coil.dbw.close()
+        if db_thread is not None:
+            db_thread.join()
+
+        duration = time.time() - start
+        return {
+            'messages': self.fed,
+            'skipped': self.skipped,
+            'duration': round(duration, 2),
+            'msgs_per_sec': round(self.fed / max(duration, 1e-6)),
+            'relay_switches': self.coil.rc.switches,
+            'rows': self.coil.dbw.get_stats(),
+        }
@@ -1,17 +1,31 @@
 from .peripherals.sensorData import SensorData
 from .peripherals.relayController import RelayController
 from .externals.weatherData import WeatherData
-from .gui.KivySmartCoilGUI import SmartCoilGUIApp
+from .gui.GUIProcess import RemoteGUIApp
 from .server.Manager import ServerManager
-from time import sleep
+from .database.dbWriter import DBWriter
+from .database.migrations import SchemaMigrator
+from .database.rollups import RollupManager
+from .database.retention import RetentionManager
+from .database.backup import BackupManager
+from .database.runs import FancoilRuns
+from .database.columnar import ColumnarArchive
+from .database.summary import DailySummary
+from .database.storage import get_storage_format, convert_to_v2, V2, TABLES
+from .database.compression import SwingingDoorCompressor
+from .database.query import HistoryQuery
+from .AsyncRuntime import AsyncRuntime
 from threading import Thread, Event
-from queue import Queue
 from .utils import utils
+from .utils.stateSnapshot import StateSnapshot
+from .utils.eventBus import EventBus, MsgType, RequestBroker
+from .utils.busMetrics import BusMetrics
+from .utils.messageJournal import MessageJournal
+from .utils.stateStore import StateStore
 import signal
 import sqlite3
 from datetime import datetime
 import os
-from shutil import copyfile
 import traceback
 
 HEATING = 'HEAT'
@@ -26,18 +40,29 @@ class SmartCoil():
         '''This constructor initializes weather, sensor, relay, gui and server
         classes.
         Take in account that this classes looks for the SQLite DB "/assets/db/SmartCoilDB"
-        if not found, a template is used instead, which holds all valid tables but no data included.
+        if not found, it is created. Either way, any pending migration script from
+        "/assets/db/migrations" is applied to bring the DB schema up to date.
         '''
         try:
-            # preparation of queues that will manage messages between threads.
-            self.inbound_queue = Queue()
-            self.outbound_queue = Queue()
-
-            self.wthr = WeatherData(self.inbound_queue)
-            self.snsr = SensorData(self.inbound_queue, 1)
+            # preparation of the bus that will manage messages between threads, and of the broker
+            # matching the server requests with their answers.
+            self.bus_metrics = BusMetrics(**utils.load_config('bus_metrics'))
+            self.bus = EventBus(metrics=self.bus_metrics if self.bus_metrics.enabled else None,
+                                **utils.load_config('event_bus'))
+            self.requests = RequestBroker(self.bus, **utils.load_config('requests'))
+
+            # Last known state of the app, restored before reaching the DB or the weather API.
+            self.snapshot = StateSnapshot(**utils.load_config('snapshot'))
+            self.restored_state = self.snapshot.load()
+
+            # Both keep their most recent readings in fixed size in-memory buffers.
+            hot_tier = utils.load_config('hot_tier')
+            self.wthr = WeatherData(self.bus, snapshot=self.restored_state.get('weather'),
+                                    **hot_tier)
+            self.snsr = SensorData(self.bus, 1, **hot_tier)
+            print('recent readings buffers use {} KB'.format(
+                (self.snsr.recent.nbytes() + self.wthr.recent.nbytes()) // 1024))
             self.rc = RelayController()
-            self.gui  = SmartCoilGUIApp(self.inbound_queue)
-            self.srv = ServerManager(self.inbound_queue, self.outbound_queue)
 
             dirname = os.path.dirname(__file__)
             self.dbase_path = os.path.join(dirname, '../assets/db/SmartCoilDB')
@@ -51,13 +76,99 @@ class SmartCoil():
             # Flag to check if target temperature was reached.
             self.target_reached = False
 
-            # Flag to state if the fancoil is working right now.
-            self.fancoil_running = False
+            # Speed the relays were last started at, 0 while they're off.
+            self.fancoil_speed = 0
+
+            # Authoritative app state, read by the control logic, the GUI and the server alike.
+            self.store = StateStore(mode=self.mode)
 
-            # Verify the database schema exists. If not, copy the template.
-            if not os.path.exists(self.dbase_path):
-                print('initializing DB from template...')
-                copyfile(self.dbase_path + '_template', self.dbase_path)
+            # The GUI runs in a process of its own if enabled, sharing a state block with this one.
+            gui_process = utils.load_config('gui_process')
+            self.remote_gui = gui_process.pop('enabled')
+            if self.remote_gui:
+                self.gui = RemoteGUIApp(self.bus, self.store, **gui_process)
+            else:
+                # Kivy opens its window on import, so it's only imported if it runs in here.
+                from .gui.KivySmartCoilGUI import SmartCoilGUIApp
+                self.gui = SmartCoilGUIApp(self.bus, self.store)
+            self.srv = ServerManager(self.bus, self.requests, self.store)
+
+            # Create the database if needed and bring its schema up to the latest version.
+            SchemaMigrator(self.dbase_path).migrate()
+
+            # Move the raw tables to the compact v2 format if it was requested. This is done only
+            # once, consider running "smartcoil convert-v2" beforehand for large databases.
+            if utils.load_config('storage')['format'] == V2:
+                with sqlite3.connect(self.dbase_path) as conn:
+                    needs_conversion = get_storage_format(conn) != V2
+                if needs_conversion:
+                    print('converting DB to the v2 storage format...')
+                    convert_to_v2(self.dbase_path)
+
+            # All DB writes go through a single writer that commits them in batches.
+            self.dbw = DBWriter(self.dbase_path, **utils.load_config('db_writer'))
+
+            # Keep minute, hour and day rollups updated as sensor and weather rows are written.
+            # Sensor rollups see every reading, including those the compressor doesn't store.
+            self.rollups = RollupManager(**utils.load_config('rollups'))
+            self.dbw.add_observer('SENSOR_BME680_DATA',
+                                  self.rollups.hook_for('SENSOR_BME680_DATA'))
+            self.dbw.add_hook('YR_WEATHER_API_DATA', self.rollups.hook_for('YR_WEATHER_API_DATA'))
+            self.dbw.add_transaction_hook(self.rollups.commit, self.rollups.rollback)
+
+            # Sensor rows that can be rebuilt by interpolation within tolerance are not stored.
+            compression = utils.load_config('compression')
+            max_gap = self.rollups.max_gap.total_seconds()
+            if compression.get('max_interval', 600) > max_gap:
+                # longer gaps between stored rows would be taken for downtime by a rollup rebuild.
+                print('compression max_interval is longer than the rollups max_gap, '
+                      + 'using {} seconds.'.format(max_gap))
+                compression['max_interval'] = max_gap
+            self.snsr_compressor = SwingingDoorCompressor(TABLES['SENSOR_BME680_DATA'],
+                                                          **compression)
+
+            # Raw rows older than the retention period are moved to compressed archive files.
+            self.retention = RetentionManager(self.dbase_path, **utils.load_config('retention'))
+
+            # Online full and incremental backups of the DB, if enabled.
+            self.backup = BackupManager(self.dbase_path, **utils.load_config('backup'))
+
+            # Columnar copy of the sensor and weather history for analytics, if enabled.
+            self.columnar = ColumnarArchive(self.dbase_path, retention=self.retention,
+                                            **utils.load_config('columnar'))
+
+            # Fancoil runs as intervals, opened and closed as the relays change.
+            self.runs = FancoilRuns(self.dbase_path, self.commit_to_db)
+            self.runs.recover()
+
+            # User settings and last readings first, so the relays come back under them.
+            self.snapshot_restored = self.restore_gui_snapshot(self.restored_state)
+
+            # Put the relays back as they were, the first sensor reading will then confirm it.
+            if self.restored_state.get('fancoil_running') and self.restored_state.get('speed'):
+                self.fancoil_speed = self.restored_state['speed']
+                self.store.update(fancoil_running=True)
+                self.rc.start_coil_at(self.restored_state['speed'])
+                self.runs.started(self.restored_state['speed'], self.mode)
+
+            # Comfort and energy summary of every finished day.
+            self.summary = DailySummary(self.dbase_path, **utils.load_config('summary'))
+
+            # Read path for the DB history, including archived rows.
+            self.history = HistoryQuery(self.dbase_path, self.retention,
+                                        compressor=self.snsr_compressor,
+                                        max_gap=max_gap)
+
+            # Every handled message is journaled first, if enabled, along with the app state.
+            self.journal = MessageJournal(**utils.load_config('journal'))
+            if self.journal.enabled:
+                self.bus.subscribe_all(self.journal_message)
+            self.register_handlers()
+
+            # Optional asyncio runtime, replacing the sensor, weather and message handling threads.
+            runtime = utils.load_config('runtime')
+            mode = runtime.pop('mode')
+            self.async_runtime = AsyncRuntime(self, **runtime) if mode == 'asyncio' else None
 
             # Once initialized, report the app is up and running to the DB
             self.report_app_status_to_db('ON')
@@ -67,6 +178,51 @@ class SmartCoil():
             print(e)
             traceback.print_tb(e.__traceback__)
 
+    def register_handlers(self):
+        '''Subscribes the message handlers of the app to the bus, and builds the Alexa action
+        table. Both are resolved once instead of on every message.
+        '''
+        self.alexa_actions = {
+            'SCOIL_SWTCH': self.alexa_switch_smartcoil,
+            'SCOIL_TEMP': self.alexa_chg_smartcoil_temperature,
+            'SCOIL_SPEED': self.alexa_chg_smartcoil_speed,
+            'SCOIL_STATE': lambda value: self.alexa_get_smartcoil_state(),
+            }
+        self.bus.subscribe(MsgType.SNSMSG, lambda msg: self.process_new_sensor_data())
+        self.bus.subscribe(MsgType.GUIMSG, lambda msg: self.process_new_gui_data())
+        self.bus.subscribe(MsgType.WTHMSG, lambda msg: self.process_new_weather_data())
+        self.bus.subscribe(MsgType.SRVMSG, lambda msg: self.process_new_alexa_data(
+                                                        msg.action, msg.params, msg.corr_id))
+        self.bus.subscribe(MsgType.EXIT, lambda msg: print('stopped awaiting messages..'))
+
+    def get_journal_state(self, msg):
+        '''Gets the state a message is about to be handled against, as journaled: mode, user
+        settings, fancoil control (target reached, speed the relays run at and whether it's
+        running), indoor readings and, for weather messages, the new weather values.
+
+        Args:
+            msg (:obj:`Message`): The message.
+
+        Returns:
+            :obj:`dict`: The state.
+        '''
+        readings = self.snsr.get_most_recent_readings()
+        app = self.store.get()
+        state = {'mode': self.mode, 'sensor': None if readings is None else list(readings),
+                 'user': [app.setpoint, app.speed, app.last_speed],
+                 'control': [self.target_reached, self.fancoil_speed, app.fancoil_running]}
+        if msg.type == MsgType.WTHMSG:
+            state['weather'] = self.wthr.get_snapshot()
+        return state
+
+    def journal_message(self, msg):
+        '''Appends a message to the journal, before any other handler runs.
+
+        Args:
+            msg (:obj:`Message`): The message.
+        '''
+        self.journal.record(msg, self.get_journal_state(msg))
+
     def run_sensor_fetcher(self):
         '''Method used by the thread that will handle the BME680 sensor.
         '''
@@ -122,23 +278,128 @@ class SmartCoil():
         th.daemon = True
         th.start()
 
+    def run_db_writer_thread(self):
+        '''Method that starts the thread that will commit queued statements to the SQLite DB.
+        '''
+        th = Thread(target=self.dbw.run, name='dbwriter')
+        th.daemon = True
+        th.start()
+
+    def run_retention(self):
+        '''Method used by the thread that will archive raw rows older than the retention period.
+        '''
+        try:
+            self.retention.run(exit_evt = self.exit)
+        except Exception as e:
+            print('Exception at SmartCoil.run_retention')
+            print(type(e))
+            print(e)
+            traceback.print_tb(e.__traceback__)
+
+    def run_retention_thread(self):
+        '''Method that starts the thread that will archive raw rows older than the retention
+        period.
+        '''
+        th = Thread(target=self.run_retention, name='dbretention')
+        th.daemon = True
+        th.start()
+
+    def run_backup(self):
+        '''Method used by the thread that will periodically back up the DB.
+        '''
+        try:
+            self.backup.run(exit_evt = self.exit)
+        except Exception as e:
+            print('Exception at SmartCoil.run_backup')
+            print(type(e))
+            print(e)
+            traceback.print_tb(e.__traceback__)
+
+    def run_backup_thread(self):
+        '''Method that starts the thread that will periodically back up the DB.
+        '''
+        th = Thread(target=self.run_backup, name='dbbackup')
+        th.daemon = True
+        th.start()
+
+    def run_columnar(self):
+        '''Method used by the thread that will append new rows to the columnar archive.
+        '''
+        try:
+            self.columnar.run(exit_evt = self.exit)
+        except Exception as e:
+            print('Exception at SmartCoil.run_columnar')
+            print(type(e))
+            print(e)
+            traceback.print_tb(e.__traceback__)
+
+    def run_columnar_thread(self):
+        '''Method that starts the thread that will append new rows to the columnar archive.
+        '''
+        th = Thread(target=self.run_columnar, name='dbcolumnar')
+        th.daemon = True
+        th.start()
+
+    def run_summary(self):
+        '''Method used by the thread that will finalize the summary of every finished day.
+        '''
+        try:
+            self.summary.run(exit_evt = self.exit)
+        except Exception as e:
+            print('Exception at SmartCoil.run_summary')
+            print(type(e))
+            print(e)
+            traceback.print_tb(e.__traceback__)
+
+    def run_summary_thread(self):
+        '''Method that starts the thread that will finalize the summary of every finished day.
+        '''
+        th = Thread(target=self.run_summary, name='dbsummary')
+        th.daemon = True
+        th.start()
+
+    def run_bus_metrics(self):
+        '''Method used by the thread that will periodically print the message bus metrics.
+        '''
+        try:
+            self.bus_metrics.run(exit_evt = self.exit)
+        except Exception as e:
+            print('Exception at SmartCoil.run_bus_metrics')
+            print(type(e))
+            print(e)
+            traceback.print_tb(e.__traceback__)
+
+    def run_bus_metrics_thread(self):
+        '''Method that starts the thread that will periodically print the message bus metrics.
+        '''
+        th = Thread(target=self.run_bus_metrics, name='busmetrics')
+        th.daemon = True
+        th.start()
+
     def run_gui(self):
         '''Method that starts the GUI. Run in the main thread of the app.
         '''
         self.gui.run()
 
+    def now(self):
+        '''Gets the current time, used to timestamp rows and fancoil runs. The journal replay
+        replaces it with the time of the message being replayed.
+
+        Returns:
+            :obj:`datetime`: The current time.
+        '''
+        return datetime.now()
+
     def commit_to_db(self, sql, params):
-        '''Commits a given sql query to the SQLite databse.
+        '''Queues a given sql query to be committed to the SQLite databse by the DB writer thread,
+        which groups queued queries into a single transaction.
 
         Args:
             sql (:obj:`str`): The SQL string to be executed.
             params (:obj:`list`): A list of parameters to be included in the
                 query.
         '''
-        with sqlite3.connect(self.dbase_path) as conn:
-            crsr = conn.cursor()
-            crsr.execute(sql, params)
-            conn.commit()
+        self.dbw.submit(sql, params)
 
     def report_app_status_to_db(self, status):
         '''Reports the status of the SmartCoil app to the database. This method
@@ -148,7 +409,7 @@ class SmartCoil():
             status (:obj:`str`): The string status which could be 'ON' or 'OFF'
         '''
         sql = 'INSERT INTO APP_STATUS VALUES (?, ?)'
-        tstamp = datetime.now()
+        tstamp = self.now()
         data = [tstamp, status]
         self.commit_to_db(sql, data)
 
@@ -159,7 +420,7 @@ class SmartCoil():
             tstamp (int, optional): Timestamp of the entry. If not passed, current time is used.
         '''
         if tstamp is None:
-            tstamp = datetime.now()
+            tstamp = self.now()
 
         data = [tstamp] + self.wthr.get_conditions_data()
         sql = "INSERT INTO YR_WEATHER_API_DATA VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)"
@@ -174,16 +435,27 @@ class SmartCoil():
         - gas resistance
         - air quality
         - whether the smartcoil is running at moment of commit
+        Rows go through the swinging door compressor first, so a row is only committed when it's
+        needed to rebuild the sensor series within the configured tolerances.
 
         Args:
             tstamp (int, optional): Timestamp of the entry. If not passed, current time is used.
         '''
         if tstamp is None:
-            tstamp = datetime.now()
+            tstamp = self.now()
 
-        data = [tstamp] + self.snsr.get_most_recent_readings() + [int(self.fancoil_running)]
+        # readings come as temperature, pressure, humidity... but the table stores humidity first.
+        # Rows written before this order was fixed are swapped back by DB migration 0007.
+        t, p, h, g, a = self.snsr.get_most_recent_readings()
+        data = [tstamp, t, h, p, g, a, int(self.store.get().fancoil_running)]
         sql = "INSERT INTO SENSOR_BME680_DATA VALUES (?, ?, ?, ?, ?, ?, ?)"
-        self.commit_to_db(sql, data)
+        # rollups see every reading, only the rows the compressor decides to keep are committed.
+        self.dbw.observe('SENSOR_BME680_DATA', data)
+        for row in self.snsr_compressor.add(data):
+            self.commit_to_db(sql, row)
+        self.snapshot.update(urgent=False, sensor={'timestamp': tstamp.isoformat(),
+                                                   'temperature': t, 'humidity': h,
+                                                   'air_quality': a})
 
     def commit_user_data(self, tstamp = None):
         '''Commits user GUI information to the database, specifically:
@@ -194,13 +466,14 @@ class SmartCoil():
             tstamp (int, optional): Timestamp of the entry. If not passed, current time is used.
         '''
         if tstamp is None:
-            tstamp = datetime.now()
+            tstamp = self.now()
 
-        u_temp = self.gui.root.get_user_temp()
-        u_speed = self.gui.root.get_user_speed()
+        state = self.store.get()
+        u_temp, u_speed = state.setpoint, state.speed
         data = [tstamp, u_temp, u_speed]
         sql = "INSERT INTO USER_DATA VALUES (?, ?, ?)"
         self.commit_to_db(sql, data)
+        self.snapshot.update(setpoint=u_temp, speed=u_speed, mode=self.mode)
 
     def sensor_ready(self):
         '''Checks if the BME680 sensor completed its prime period.
@@ -220,27 +493,6 @@ class SmartCoil():
         t, *_ = self.snsr.get_most_recent_readings()
         return t
 
-    def get_user_screen_data(self):
-        '''Gets the current information from the BME680 sensor that applies for the GUI screen.
-
-        Returns:
-            :obj:`tuple`: Tuple with indoor temperature, humidity and air quality values.
-        '''
-        t, p, h, g, a = self.snsr.get_most_recent_readings()
-        return (
-        '{} °F'.format(round(t))
-        ,round(h)
-        ,round(a)
-        )
-
-    def get_weather_screen_data(self):
-        '''Gets the current information from the weather API sensor that applies for the GUI screen.
-
-        Returns:
-            :obj:`tuple`: Tuple with outdoor temperatureand weather forecast icon.
-        '''
-        return (self.wthr.temperature, self.wthr.weather_icon)
-
     def monitor_temperature(self, offset = 0):
         '''This method monitors the indoor status and take actions such as cooling/heating the room
         until it reaches the target temperature.
@@ -257,62 +509,62 @@ class SmartCoil():
             # until the room temperature is 2 degrees before the initial target again (disregarding the offset).
             dynamic_offset = 2 if self.target_reached else -abs(offset)
 
+            state = self.store.get()
             mult  = 1 if self.mode == COOLING else -1
-            trigger_fancoil = mult * self.get_current_temp() - mult * self.gui.root.get_user_temp() > dynamic_offset
+            trigger_fancoil = mult * self.get_current_temp() - mult * state.setpoint > dynamic_offset
 
-            if not self.gui.root.user_turned_off_fancoil() and trigger_fancoil:
-                if not self.rc.fancoil_is_on() or self.gui.root.get_speed_changed_flag():
+            if state.speed != 0 and trigger_fancoil:
+                if not self.rc.fancoil_is_on() or state.speed != self.fancoil_speed:
                     self.target_reached = False
-                    self.fancoil_running = True
-                    self.rc.start_coil_at(self.gui.root.get_user_speed())
-                    self.gui.root.clear_speed_changed_flag()
+                    self.fancoil_speed = state.speed
+                    self.rc.start_coil_at(state.speed)
+                    self.runs.started(state.speed, self.mode, self.now())
+                    self.store.update(fancoil_running=True)
+                    self.snapshot.update(fancoil_running=True)
             else:
                 if self.rc.fancoil_is_on():
                     self.target_reached = True
-                    self.fancoil_running = False
+                    self.fancoil_speed = 0
                     self.rc.all_off()
+                    self.runs.stopped(self.now())
+                    self.store.update(fancoil_running=False)
+                    self.snapshot.update(fancoil_running=False)
         except Exception as e:
             print('Exception at SmartCoil.monitor_temperature')
             print(type(e))
             print(e)
             traceback.print_tb(e.__traceback__)
 
-    def update_gui_user_values(self):
-        '''Updates the current indoor temperature, humidity and air quality values in the graphic
-        user interface by getting the information from the sensor object and passing them into the
-        GUI object.
+    def update_user_values(self):
+        '''Updates the current indoor temperature, humidity and air quality values in the state
+        store, out of the sensor object. The GUI shows them from there.
         '''
-        tmp, hum, airq = self.get_user_screen_data()
-        self.gui.root.updateCurrentTemp(tmp)
-        self.gui.root.updateHumidity(hum)
-        self.gui.root.updateAirQuality(airq)
+        t, p, h, g, a = self.snsr.get_most_recent_readings()
+        self.store.update(temperature=t, humidity=h, air_quality=a)
 
-    def update_gui_weather_values(self):
-        '''Updates the current outdoor temperature and weather forecast icon in the graphic user
-        interface by getting the information from the weather API object and passing them into the
-        GUI object.
+    def update_weather_values(self):
+        '''Updates the current outdoor temperature and weather forecast icon in the state store,
+        out of the weather API object. The GUI shows them from there.
         '''
-        tmp, icon = self.get_weather_screen_data()
-        tmp_txt = '{} °F'.format(int(tmp))
-        self.gui.root.updateTodayTemp(tmp_txt)
-        self.gui.root.updateTodayIcon(icon)
+        self.store.update(outdoor_temp=self.wthr.temperature, weather_icon=self.wthr.weather_icon)
 
     def process_new_sensor_data(self):
         '''Method used to process indoor readings when the sensor object notifies the main thread
         new information is available. The specific actions inside the method are to monitor the
-        temperature, update GUI user values, and commit sensor data to the DB.
+        temperature, update the readings on the state store, and commit sensor data to the DB.
         '''
         self.monitor_temperature(offset=2)
-        self.update_gui_user_values()
+        self.update_user_values()
         self.commit_sensor_data()
 
     def process_new_weather_data(self):
         '''Method used to process weather readings when the weather API object notifies the main
         thread new information is available. The specific actions inside the method are to update
-        GUI weather values and commit weather data to the DB.
+        the weather values on the state store and commit weather data to the DB.
         '''
         self.commit_weather_data()
-        self.update_gui_weather_values()
+        self.update_weather_values()
+        self.snapshot.update(weather=self.wthr.get_snapshot())
 
     def process_new_gui_data(self):
         '''Method used to process GUI input when the GUI object notifies the main thread the user
@@ -320,9 +572,9 @@ class SmartCoil():
         given any new input values and commit new GUI data (target temperature and fan speed) to the
         DB.
         '''
-        prev_state = self.fancoil_running
+        prev_state = self.store.get().fancoil_running
         self.monitor_temperature(offset=2)
-        curr_state = self.fancoil_running
+        curr_state = self.store.get().fancoil_running
 
         self.commit_user_data()
 
@@ -334,8 +586,8 @@ class SmartCoil():
 
     def alexa_switch_smartcoil(self, switch):
         '''Method used to perform the "switch" Amazon Alexa command. The action comes from the Flask
-        server object and is processed by this thread, updating both the GUI and the relay module
-        configuration.
+        server object and is processed by this thread, updating both the state store (and so the
+        GUI) and the relay module configuration.
 
         Params:
             switch (:obj:`str`): Either 'on' or 'off'. If 'on', the app will look for the last fan
@@ -343,33 +595,33 @@ class SmartCoil():
         '''
         speed = 0
         if switch == 'on':
-            speed = self.gui.root.get_last_speed_seen()
+            speed = self.store.get().last_speed
 
-        self.gui.root.set_user_speed(speed)
+        self.store.set_user_speed(speed)
         # take advantage of the GUI processing method, since this case is similar.
         self.process_new_gui_data()
 
     def alexa_chg_smartcoil_temperature(self, temperature):
         '''Method used to perform the "change temperature" Amazon Alexa command. The action comes
-        from the Flask server object and is processed by this thread, updating both the GUI and the
-        relay module configuration.
+        from the Flask server object and is processed by this thread, updating both the state store
+        (and so the GUI) and the relay module configuration.
 
         Params:
             temperature (int): The new target temperature to set.
         '''
-        self.gui.root.set_user_temp(temperature)
+        self.store.update(setpoint=int(temperature))
         # take advantage of the GUI processing method, since this case is similar.
         self.process_new_gui_data()
 
     def alexa_chg_smartcoil_speed(self, speed):
         '''Method used to perform the "change fan speed" Amazon Alexa command. The action comes
-        from the Flask server object and is processed by this thread, updating both the GUI and the
-        relay module configuration.
+        from the Flask server object and is processed by this thread, updating both the state store
+        (and so the GUI) and the relay module configuration.
 
         Params:
             speed (int): The new fan speed to set.
         '''
-        self.gui.root.set_user_speed(speed)
+        self.store.set_user_speed(speed)
         # take advantage of the GUI processing method, since this case is similar.
         self.process_new_gui_data()
 
@@ -377,19 +629,17 @@ class SmartCoil():
         '''Method used to perform the "get state" Amazon Alexa command. The action comes
         from the Flask server object and is processed by this thread, sending back the state of
         the app regarding target temperature, current temperature, weather the SmartCoil is turned
-        on or off, and the fan speed.
-        '''
-        state = 'OFF' if self.gui.root.user_turned_off_fancoil() else self.mode
-        speed = self.gui.root.get_last_speed_seen()
-        cur_temp = round(self.get_current_temp())
-        usr_temp = self.gui.root.get_user_temp()
-        info = {'state': state, 'speed': speed, 'cur_temp': cur_temp, 'usr_temp': usr_temp}
-        self.outbound_queue.put(utils.Message('APPMSG', 'SCOIL_STATE-R', info))
+        on or off, and the fan speed. The server reads it from the state store itself, this is
+        only used by clients without access to it.
 
+        Returns:
+            :obj:`dict`: The state, answered to the server request.
+        '''
+        return self.store.get().report()
 
-    def process_new_alexa_data(self, action, params):
+    def process_new_alexa_data(self, action, params, corr_id = None):
         '''Helper method that acts as a swtch case clause. It determines which method to run based
-        on a given action.
+        on a given action, out of the action table built at startup.
 
         Params:
             action (:obj:`str`): A string specifying the action to run:
@@ -399,16 +649,16 @@ class SmartCoil():
                 - 'SCOIL_STATE' for self.alexa_get_smartcoil_state
             params (:obj:`dict`): Dictionary of parameters to be used by the method of the
                 corresponding action.
+            corr_id (int, optional): Id of the server request waiting for the result of the
+                action, if any. Defaults to None.
         '''
-        switcher = {
-                    'SCOIL_SWTCH': lambda switch: self.alexa_switch_smartcoil(switch),
-                    'SCOIL_TEMP': lambda temp: self.alexa_chg_smartcoil_temperature(temp),
-                    'SCOIL_SPEED': lambda speed: self.alexa_chg_smartcoil_speed(speed),
-                    'SCOIL_STATE': lambda x: self.alexa_get_smartcoil_state(),
-                    }
-
-        method = switcher.get(action, lambda: print('unrecognized Alexa action.'))
-        method(params.get('value', None))
+        method = self.alexa_actions.get(action)
+        if method is None:
+            print('unrecognized Alexa action.')
+            return
+        result = method(params.get('value', None))
+        if corr_id is not None:
+            self.requests.resolve(corr_id, result)
 
     def quit(self, signo, _frame):
         '''Cleanup method used when interrupting the app.
@@ -420,35 +670,37 @@ class SmartCoil():
 
         print('cleaning up before exiting app...')
         self.exit.set()
+        if self.async_runtime is not None:
+            self.async_runtime.stop()
         self.rc.cleanup()
+        self.runs.stopped()
         self.srv.close_logs()
-        # Once terminated, report the app is down to the DB
+        # Once terminated, report the app is down to the DB, along with the last sensor row.
+        sql = "INSERT INTO SENSOR_BME680_DATA VALUES (?, ?, ?, ?, ?, ?, ?)"
+        for row in self.snsr_compressor.flush():
+            self.commit_to_db(sql, row)
+        print('sensor compression stats: {}'.format(self.snsr_compressor.get_stats()))
         self.report_app_status_to_db('OFF')
+        self.snapshot.flush()
+        self.journal.close()
+        if self.remote_gui:
+            self.gui.close()
+        # commit any pending rows before leaving.
+        self.dbw.close()
+        print('db writer stats: {}'.format(self.dbw.get_stats()))
+        print('message lanes stats: {}'.format(self.bus.get_stats()))
+        print('server requests stats: {}'.format(self.requests.get_stats()))
+        if self.bus_metrics.enabled:
+            print('bus metrics: {}'.format(self.bus_metrics.dump()))
         exit(0)
 
     def run_msg_handler(self):
         '''Method used by the thread that will handle incoming messages from other objects such as
-        the BME680 sensor, GUI, weather API, or the Flask server.
+        the BME680 sensor, GUI, weather API, or the Flask server. Messages are dispatched to the
+        handlers subscribed to the bus in the constructor, until an exit message is received.
         '''
         try:
-            switcher = {
-                        'SNSMSG': lambda x, y: self.process_new_sensor_data(),
-                        'GUIMSG': lambda x, y: self.process_new_gui_data(),
-                        'WTHMSG': lambda x, y: self.process_new_weather_data(),
-                        'SRVMSG': lambda action, params: self.process_new_alexa_data(action, params),
-                        'EXIT': lambda x, y: print('stopped awaiting messages..'),
-                        }
-
-            type = ''
-            # wait for messages until an exit message (0) is received
-            while type != 'EXIT':
-                msg = self.inbound_queue.get()
-                type = msg.type
-                action = msg.action
-                params = msg.params
-                method = switcher.get(type, lambda: print('unrecognized message.'))
-
-                method(action, params)
+            self.bus.run()
         except Exception as e:
             print('Exception at SmartCoil.run_msg_handler')
             print(type(e))
@@ -462,31 +714,37 @@ class SmartCoil():
         th = Thread(target=self.run_msg_handler, name='msghandler')
         th.start()
 
-    def fetch_gui_data_init(self):
+    def fetch_gui_data_init(self, fetch_weather = True):
         '''This method checks for a previous configuration made by the user to restore such state.
-        It's run as a thread and waits for the GUI to be initialized before making adjustments.
+        It's run as a thread and restores it on the state store, which the GUI shows once it's up.
+
+        Args:
+            fetch_weather (bool, optional): Whether to fetch the weather API too, retrying until
+                it succeeds or the app exits. Defaults to True.
         '''
         try:
-            while self.gui.root is None:
-                sleep(0.05)
-
-            config_found = False
-            with sqlite3.connect(self.dbase_path) as conn:
-                cur = conn.cursor()
-                cur.execute("SELECT * FROM USER_DATA ORDER BY timestamp DESC LIMIT 1")
-                data = cur.fetchone()
-                if data is not None:
-                    self.gui.root.set_user_temp(data[1])
-                    self.gui.root.set_user_speed(data[2])
-                    config_found = True
+            # The snapshot was restored at startup, the DB and the weather API come after.
+            config_found = self.snapshot_restored
+
+            data = self.history.latest('USER_DATA')
+            if not config_found and data is not None:
+                self.store.update(setpoint=data[1])
+                self.store.set_user_speed(data[2])
+                config_found = True
+            elif config_found and (data is None or data[1:] != [self.store.get().setpoint,
+                                                                 self.store.get().speed]):
+                # the snapshot is ahead of the DB, i.e. the app stopped before its last commit.
+                config_found = False
 
             # If no configuration was found, add the default one as the first one in the DB
             if not config_found:
                 self.commit_user_data()
 
             # fetch most recent weather data and feed it to the GUI.
-            self.wthr.retry_update_values()
-            self.process_new_weather_data()
+            if fetch_weather:
+                self.wthr.retry_update_values(exit_evt=self.exit)
+                if not self.exit.is_set():
+                    self.process_new_weather_data()
         except Exception as e:
             print('Exception at SmartCoil.fetch_gui_data_init')
             print(type(e))
@@ -494,6 +752,31 @@ class SmartCoil():
             traceback.print_tb(e.__traceback__)
 
 
+    def restore_gui_snapshot(self, state):
+        '''Helper method to restore the state snapshot read at startup on the state store, and so
+        on the GUI: user settings, last indoor readings and last weather values.
+
+        Args:
+            state (:obj:`dict`): The state snapshot.
+
+        Returns:
+            bool: Whether user settings were restored.
+        '''
+        sensor = state.get('sensor')
+        if sensor is not None:
+            self.store.update(temperature=sensor['temperature'], humidity=sensor['humidity'],
+                              air_quality=sensor['air_quality'])
+
+        if state.get('weather') is not None:
+            self.update_weather_values()
+
+        if 'setpoint' not in state:
+            return False
+
+        self.store.update(setpoint=state['setpoint'])
+        self.store.set_user_speed(state['speed'])
+        return True
+
     def run_fetch_gui_data_init_thread(self):
         '''Method that starts the thread that will handle GUI state initialization.
         '''
@@ -508,6 +791,32 @@ class SmartCoil():
             for sig in ('TERM', 'HUP', 'INT'):
                 signal.signal(getattr(signal, 'SIG'+sig), self.quit)
 
+            # DATABASE THREAD:
+            # spawn thread in charge of committing queued rows to the DB.
+            self.run_db_writer_thread()
+            # spawn thread in charge of archiving old rows, if enabled.
+            if self.retention.enabled:
+                self.run_retention_thread()
+            # spawn thread in charge of backing up the DB, if enabled.
+            if self.backup.enabled:
+                self.run_backup_thread()
+            # spawn thread in charge of the daily summaries, if enabled.
+            if self.summary.enabled:
+                self.run_summary_thread()
+            # spawn thread in charge of the columnar archive, if enabled.
+            if self.columnar.enabled:
+                self.run_columnar_thread()
+
+            # spawn thread in charge of dumping the message bus metrics, if enabled.
+            if self.bus_metrics.enabled:
+                self.run_bus_metrics_thread()
+
+            if self.async_runtime is not None:
+                # SERVER THREAD, the rest of the app runs on the asyncio loop.
+                self.run_server_thread()
+                self.async_runtime.run()
+                return
+
             # ENVIRONMENT RELATED THREADS:
             # spawn thread in charge of fetching BME680 sensor readings.
             self.run_sensor_fetcher_thread()
@@ -0,0 +1,369 @@
+import os
+import csv
+import gzip
+import json
+import time
+import sqlite3
+import traceback
+from datetime import datetime
+from .storage import StorageCodec, TABLES
+from .retention import parse_value
+
+MANIFEST = 'manifest.json'
+
+# Tables shipped by incremental backups and the column identifying their rows: raw tables and
+# the tables derived from them, which are filled or updated later than their raw rows.
+LOGGED_TABLES = dict({t: 'timestamp' for t in TABLES}, FANCOIL_RUNS='start_time',
+                     DAILY_SUMMARY='day')
+
+class BackupManager():
+    '''Serves as the class that backs up the SmartCoil DB while the app keeps writing to it. Full
+    backups are consistent copies taken with the SQLite online backup API, in a single step.
+    Incremental backups only ship the rows inserted or updated since the last backup, as
+    gzip'd CSV files next to the full backup they extend: triggers log the key of every such row
+    in the CHANGE_LOG table, so rows loaded late (imports, runs backfills) are shipped too. A
+    manifest file in the backup directory keeps track of the current full backup, its increments
+    and the change log position they reach.'''
+
+    def __init__(self, dbase_path, backup_dir = None, full_interval = 86400,
+                 incremental_interval = 3600, keep = 3, enabled = False):
+        '''The module is intented to be a secondary thread of the base class SmartCoil.
+
+        Args:
+            dbase_path (:obj:`str`): Path to the SQLite database.
+            backup_dir (:obj:`str`, optional): Directory for the backup files. Defaults to
+                '/assets/db/backups'.
+            full_interval (int, optional): Seconds between full backups. Defaults to 1 day.
+            incremental_interval (int, optional): Seconds between incremental backups. Defaults
+                to 1 hour.
+            keep (int, optional): Number of full backups kept. Defaults to 3.
+            enabled (bool, optional): Whether the backup thread should run. Defaults to False.
+        '''
+        if backup_dir is None:
+            dirname = os.path.dirname(__file__)
+            backup_dir = os.path.join(dirname, '../../assets/db/backups')
+
+        self.dbase_path = dbase_path
+        self.backup_dir = backup_dir
+        self.full_interval = full_interval
+        self.incremental_interval = incremental_interval
+        self.keep = keep
+        self.enabled = enabled
+
+        self.last_full = None
+        self.last_incremental = None
+
+    def read_manifest(self):
+        '''Gets the manifest of the backup directory.
+
+        Returns:
+            :obj:`dict`: The manifest, or None if no full backup was taken yet.
+        '''
+        path = os.path.join(self.backup_dir, MANIFEST)
+        if not os.path.exists(path):
+            return None
+        with open(path) as f:
+            return json.load(f)
+
+    def write_manifest(self, manifest):
+        '''Helper method to replace the manifest atomically, so an interrupted backup never leaves
+        it half written.
+
+        Args:
+            manifest (:obj:`dict`): The new manifest.
+        '''
+        path = os.path.join(self.backup_dir, MANIFEST)
+        with open(path + '.tmp', 'w') as f:
+            json.dump(manifest, f, indent=4)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(path + '.tmp', path)
+
+    def copy_db(self, src_path, dest_path):
+        '''Helper method to copy a live DB with the online backup API. The copy is written to a
+        temporary file first, so dest_path is either complete or untouched.
+
+        The whole DB is copied in a single step: SQLite restarts a stepped backup from scratch
+        whenever another connection writes to the source, so a DB written every few seconds
+        would never finish. In WAL mode the single step only holds a read snapshot, the DB
+        writer keeps committing meanwhile.
+
+        Args:
+            src_path (:obj:`str`): Path to the database to copy.
+            dest_path (:obj:`str`): Path to the copy.
+
+        Returns:
+            int: The number of pages copied.
+        '''
+        tmp_path = dest_path + '.tmp'
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+
+        src = sqlite3.connect(src_path, timeout=30)
+        dest = sqlite3.connect(tmp_path)
+        try:
+            src.backup(dest, pages=-1)
+            pages, = dest.execute('PRAGMA page_count').fetchone()
+        finally:
+            dest.close()
+            src.close()
+
+        os.replace(tmp_path, dest_path)
+        return pages
+
+    def full_backup(self):
+        '''Takes a full backup of the DB and starts a new manifest with it. Increments of the
+        previous full backup and full backups beyond the ones to keep are removed. Changes start
+        being logged for the increments with the first one.
+
+        Returns:
+            :obj:`dict`: Metrics of the backup: file, pages, bytes, duration and MB/s.
+        '''
+        os.makedirs(self.backup_dir, exist_ok=True)
+        start = time.time()
+        fname = 'SmartCoilDB_{}.db'.format(datetime.now().strftime('%Y%m%d_%H%M%S'))
+        dest_path = os.path.join(self.backup_dir, fname)
+        self.track_changes()
+        pages = self.copy_db(self.dbase_path, dest_path)
+
+        # changes logged up to here are in the copy.
+        conn = sqlite3.connect(dest_path)
+        try:
+            seq, = conn.execute('SELECT coalesce(max(seq), 0) FROM CHANGE_LOG').fetchone()
+        finally:
+            conn.close()
+
+        old = self.read_manifest()
+        self.write_manifest({'full': fname, 'created': start, 'seq': seq, 'increments': []})
+        self.prune_log(seq)
+        if old is not None:
+            for incr in old['increments']:
+                self.remove(incr['file'])
+
+        fulls = sorted(f for f in os.listdir(self.backup_dir)
+                       if f.startswith('SmartCoilDB_') and f.endswith('.db'))
+        for f in fulls[:-self.keep] if self.keep > 0 else []:
+            self.remove(f)
+
+        duration = time.time() - start
+        size = os.path.getsize(dest_path)
+        self.last_full = {
+            'file': fname,
+            'pages': pages,
+            'bytes': size,
+            'duration': round(duration, 2),
+            'mb_per_sec': round(size / 1048576 / max(duration, 1e-6), 2),
+        }
+        return self.last_full
+
+    def remove(self, fname):
+        '''Helper method to delete a file of the backup directory, if it exists.
+
+        Args:
+            fname (:obj:`str`): File name.
+        '''
+        path = os.path.join(self.backup_dir, fname)
+        if os.path.exists(path):
+            os.remove(path)
+
+    def incremental_backup(self):
+        '''Ships the rows inserted or updated since the last backup, one gzip'd CSV file per
+        table, and moves the manifest change log position forward. A full backup is taken instead
+        if there is none yet, or if changes are not being logged (i.e. after a v2 conversion).
+
+        Returns:
+            :obj:`dict`: Metrics of the backup: rows per table, duration and rows/s.
+        '''
+        manifest = self.read_manifest()
+        with sqlite3.connect(self.dbase_path, timeout=30) as conn:
+            tracking = self.is_tracking(conn)
+        if manifest is None or 'seq' not in manifest or not tracking:
+            self.full_backup()
+            return {'rows': {}, 'duration': 0, 'rows_per_sec': 0}
+
+        start = time.time()
+        shipped = {}
+
+        with sqlite3.connect(self.dbase_path, timeout=30) as conn:
+            codec = StorageCodec.load(conn)
+            top, = conn.execute('SELECT max(seq) FROM CHANGE_LOG').fetchone()
+            if top is not None and top > manifest['seq']:
+                for table in LOGGED_TABLES:
+                    # named after the change log position, unique and in order.
+                    fname = 'incr_{:010d}_{}.csv.gz'.format(top, table)
+                    shipped[table] = self.ship_rows(conn, codec, table, manifest['seq'], top,
+                                                    fname)
+                    if shipped[table]:
+                        manifest['increments'].append({'file': fname, 'table': table})
+                manifest['seq'] = top
+
+        self.write_manifest(manifest)
+        self.prune_log(manifest['seq'])
+
+        duration = time.time() - start
+        total = sum(shipped.values())
+        self.last_incremental = {
+            'rows': shipped,
+            'duration': round(duration, 2),
+            'rows_per_sec': round(total / max(duration, 1e-6)),
+        }
+        return self.last_incremental
+
+    def ship_rows(self, conn, codec, table, after, until, fname):
+        '''Helper method to write the rows of a table logged between two change log positions to
+        an increment file, streaming them with fetchmany. No file is written when there are no
+        such rows.
+
+        Args:
+            conn (:obj:`Connection`): Open connection to the database.
+            codec (:obj:`StorageCodec`): Codec of the DB storage format.
+            table (:obj:`str`): Table name, out of LOGGED_TABLES.
+            after (int): Change log position of the last backup.
+            until (int): Last change log position to ship.
+            fname (:obj:`str`): Increment file name.
+
+        Returns:
+            int: Number of rows shipped.
+        '''
+        key = LOGGED_TABLES[table]
+        crsr = conn.execute('SELECT * FROM {0} WHERE {1} IN (SELECT key FROM CHANGE_LOG '
+                            'WHERE tbl = ? AND seq > ? AND seq <= ?) ORDER BY {1}'
+                            .format(table, key), [table, after, until])
+        header = [d[0] for d in crsr.description]
+        rows = crsr.fetchmany(500)
+        if not rows:
+            return 0
+
+        count = 0
+        path = os.path.join(self.backup_dir, fname)
+        # raw rows are written in v1 format, whatever the DB storage format is.
+        with gzip.open(path + '.tmp', 'wt', newline='') as f:
+            writer = csv.writer(f)
+            writer.writerow(header)
+            while rows:
+                if table in TABLES:
+                    rows = [codec.decode_row(conn, table, r) for r in rows]
+                writer.writerows(rows)
+                count += len(rows)
+                rows = crsr.fetchmany(500)
+        os.replace(path + '.tmp', path)
+
+        return count
+
+    def is_tracking(self, conn):
+        '''Helper method to check if the triggers filling the change log are in place. They are
+        lost when a table is recreated, as the v2 conversion does.
+
+        Args:
+            conn (:obj:`Connection`): Open connection to the database.
+
+        Returns:
+            bool: Whether every logged table has its triggers.
+        '''
+        count, = conn.execute("SELECT count(*) FROM sqlite_master WHERE type = 'trigger' "
+                              "AND name LIKE 'LOG_CHANGES_%'").fetchone()
+        return count == 2 * len(LOGGED_TABLES)
+
+    def track_changes(self):
+        '''Adds the triggers logging the key of every row inserted or updated, if missing.
+        '''
+        with sqlite3.connect(self.dbase_path, timeout=30) as conn:
+            for table, key in LOGGED_TABLES.items():
+                for event in ('INSERT', 'UPDATE'):
+                    conn.execute('CREATE TRIGGER IF NOT EXISTS LOG_CHANGES_{1}_{0} AFTER {1} ON {0} '
+                                 'BEGIN INSERT INTO CHANGE_LOG (tbl, key) VALUES (\'{0}\', NEW.{2}); '
+                                 'END'.format(table, event, key))
+
+    def prune_log(self, seq):
+        '''Helper method to remove the change log entries already in a backup.
+
+        Args:
+            seq (int): Change log position of the last backup.
+        '''
+        with sqlite3.connect(self.dbase_path, timeout=30) as conn:
+            conn.execute('DELETE FROM CHANGE_LOG WHERE seq <= ?', [seq])
+
+    def restore(self, target_path):
+        '''Rebuilds the DB from the current full backup and its increments. Run it while the app
+        is stopped. Rollup tables are restored as of the full backup, rebuild them afterwards if
+        increments were applied.
+
+        Args:
+            target_path (:obj:`str`): Path of the DB to restore, replaced once complete.
+
+        Returns:
+            :obj:`dict`: Rows restored from increments per table.
+        '''
+        manifest = self.read_manifest()
+        if manifest is None:
+            raise FileNotFoundError('no backup found in {}'.format(self.backup_dir))
+
+        tmp_path = target_path + '.restore'
+        self.copy_db(os.path.join(self.backup_dir, manifest['full']), tmp_path)
+
+        restored = {}
+        conn = sqlite3.connect(tmp_path)
+        crsr = conn.cursor()
+        # new weather codes are added through their own cursor while rows are inserted.
+        codes = conn.cursor()
+        try:
+            codec = StorageCodec.load(conn)
+            for incr in manifest['increments']:
+                table = incr['table']
+                with gzip.open(os.path.join(self.backup_dir, incr['file']), 'rt',
+                               newline='') as f:
+                    reader = csv.reader(f)
+                    header = next(reader)
+                    # rows updated since the full backup (i.e. closed fancoil runs) replace the
+                    # old ones.
+                    insert = 'INSERT OR REPLACE INTO {} ({}) VALUES ({})'.format(
+                        table, ', '.join(header), ', '.join('?' * len(header)))
+                    if table in TABLES:
+                        rows = ([datetime.fromisoformat(r[0])] + [parse_value(v) for v in r[1:]]
+                                for r in reader)
+                        rows = (codec.encode_row(codes, table, r) for r in rows)
+                    else:
+                        rows = ([parse_value(v) for v in r] for r in reader)
+                    crsr.executemany(insert, rows)
+                    restored[table] = restored.get(table, 0) + crsr.rowcount
+            # the rows restored are already in the backup.
+            crsr.execute('DELETE FROM CHANGE_LOG')
+            conn.commit()
+        finally:
+            # closing the last connection (with no statement left open) also checkpoints the WAL
+            # into the restored file.
+            codes.close()
+            crsr.close()
+            conn.close()
+
+        # a stale WAL of the old DB must not be replayed over the restored one.
+        for suffix in ('-wal', '-shm'):
+            if os.path.exists(target_path + suffix):
+                os.remove(target_path + suffix)
+        os.replace(tmp_path, target_path)
+
+        return restored
+
+    def run(self, exit_evt = None):
+        '''The main loop that periodically takes full and incremental backups.
+
+        Args:
+            exit_evt (:obj:`Event`, optional): Event flag to manage thread cleaning before exiting
+                the full app.
+        '''
+        sleep_func = time.sleep if exit_evt == None else exit_evt.wait
+
+        while True if exit_evt == None else not exit_evt.is_set():
+            try:
+                manifest = self.read_manifest()
+                if manifest is None or time.time() - manifest['created'] >= self.full_interval:
+                    print('DB full backup: {}'.format(self.full_backup()))
+                else:
+                    print('DB incremental backup: {}'.format(self.incremental_backup()))
+            except Exception as e:
+                print('Exception at BackupManager.run')
+                print(type(e))
+                print(e)
+                traceback.print_tb(e.__traceback__)
+
+            sleep_func(self.incremental_interval)
@@ -0,0 +1,359 @@
+import os
+import sys
+import json
+import mmap
+import time
+import traceback
+from array import array
+from .storage import to_epoch_ms, from_epoch_ms, TABLES
+from .query import HistoryQuery
+from .rollups import to_number
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+# Columns kept per table, with their array typecode and the matching little-endian numpy dtype.
+# Timestamps are epoch milliseconds, missing readings are NaN.
+COLUMNS = {
+    'SENSOR_BME680_DATA': [('timestamp', 'q', '<i8'), ('temperature', 'f', '<f4'),
+                           ('humidity', 'f', '<f4'), ('pressure', 'f', '<f4'),
+                           ('gas_resistance', 'f', '<f4'), ('air_quality', 'f', '<f4'),
+                           ('fancoil_running', 'b', '<i1')],
+    'YR_WEATHER_API_DATA': [('timestamp', 'q', '<i8'), ('temperature', 'f', '<f4'),
+                            ('humidity', 'f', '<f4'), ('pressure', 'f', '<f4'),
+                            ('condition_code', 'h', '<i2'), ('wind_speed', 'f', '<f4'),
+                            ('wind_direction_degrees', 'f', '<f4'), ('precipitation', 'f', '<f4')],
+}
+
+class ColumnarTable():
+    '''Serves as a read-only view of a table of the columnar archive. Every column file is memory
+    mapped, as a numpy.memmap when numpy is available or as a typed memoryview otherwise, so
+    slicing years of history never copies it into the heap.'''
+
+    def __init__(self, path, meta):
+        '''Args:
+            path (:obj:`str`): Directory of the table.
+            meta (:obj:`dict`): Table metadata, as written by ColumnarArchive.
+        '''
+        self.path = path
+        self.rows = meta['rows']
+        self.types = {name: (code, dtype) for name, code, dtype in meta['columns']}
+        self.columns = {}
+        self.maps = []
+
+    def column(self, name):
+        '''Gets a whole column, mapped on first use.
+
+        Args:
+            name (:obj:`str`): Column name.
+
+        Returns:
+            object: A numpy.memmap, or a memoryview if numpy is not installed. Timestamps are
+            epoch milliseconds.
+        '''
+        if name not in self.columns:
+            code, dtype = self.types[name]
+            fpath = os.path.join(self.path, name + '.bin')
+            if self.rows == 0:
+                self.columns[name] = (np.zeros(0, dtype=dtype) if np is not None
+                                      else memoryview(array(code)))
+            elif np is not None:
+                self.columns[name] = np.memmap(fpath, dtype=dtype, mode='r', shape=(self.rows,))
+            else:
+                with open(fpath, 'rb') as f:
+                    mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+                self.maps.append(mm)
+                size = array(code).itemsize
+                self.columns[name] = memoryview(mm)[:self.rows * size].cast(code)
+        return self.columns[name]
+
+    def search(self, start = None, end = None):
+        '''Finds the rows between two timestamps with a binary search on the timestamp column.
+
+        Args:
+            start (:obj:`datetime`, optional): First timestamp included.
+            end (:obj:`datetime`, optional): First timestamp excluded.
+
+        Returns:
+            :obj:`tuple`: Index of the first row and index after the last one.
+        '''
+        tstamps = self.column('timestamp')
+        lo = 0 if start is None else self.bisect(tstamps, to_epoch_ms(start))
+        hi = self.rows if end is None else self.bisect(tstamps, to_epoch_ms(end))
+        return (lo, hi)
+
+    def bisect(self, tstamps, msecs):
+        '''Helper method to get the index of the first timestamp at or after a given one.
+
+        Args:
+            tstamps (object): The timestamp column.
+            msecs (int): Epoch milliseconds.
+
+        Returns:
+            int: The insertion index.
+        '''
+        if np is not None:
+            return int(np.searchsorted(tstamps, msecs, side='left'))
+
+        lo, hi = 0, self.rows
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if tstamps[mid] < msecs:
+                lo = mid + 1
+            else:
+                hi = mid
+        return lo
+
+    def slice(self, start = None, end = None, columns = None):
+        '''Gets the columns of the rows between two timestamps, without copying them.
+
+        Args:
+            start (:obj:`datetime`, optional): First timestamp included.
+            end (:obj:`datetime`, optional): First timestamp excluded.
+            columns (:obj:`list`, optional): Column names. Defaults to all of them.
+
+        Returns:
+            :obj:`dict`: Column slices per column name.
+        '''
+        lo, hi = self.search(start, end)
+        names = self.types.keys() if columns is None else columns
+        return {name: self.column(name)[lo:hi] for name in names}
+
+    def close(self):
+        '''Drops the memory maps of the table, each one being unmapped as soon as no slice taken
+        from it is in use anymore.
+        '''
+        self.columns = {}
+        self.maps = []
+
+class ColumnarArchive():
+    '''Serves as the class that keeps a columnar copy of the sensor and weather history: one
+    fixed-dtype binary file per column, appended with the rows newer than the last copied one.
+    Each table keeps a meta.json file with its row count, updated atomically once every column
+    file got the new rows, so readers only ever see complete rows.'''
+
+    def __init__(self, dbase_path, root = None, retention = None, interval = 3600,
+                 enabled = False):
+        '''The module is intented to be a secondary thread of the base class SmartCoil.
+
+        Args:
+            dbase_path (:obj:`str`): Path to the SQLite database.
+            root (:obj:`str`, optional): Directory of the columnar archive. Defaults to
+                '/assets/db/columnar'.
+            retention (:obj:`RetentionManager`, optional): When given, rows already moved to the
+                CSV archive are copied too on the first pass. Defaults to None.
+            interval (int, optional): Seconds between passes. Defaults to 1 hour.
+            enabled (bool, optional): Whether the background thread should run. Defaults to
+                False.
+        '''
+        if root is None:
+            dirname = os.path.dirname(__file__)
+            root = os.path.join(dirname, '../../assets/db/columnar')
+
+        self.dbase_path = dbase_path
+        self.root = root
+        self.history = HistoryQuery(dbase_path, retention)
+        self.interval = interval
+        self.enabled = enabled
+
+    def table_path(self, table):
+        '''Gets the directory of a table of the archive.
+
+        Args:
+            table (:obj:`str`): Raw table name.
+
+        Returns:
+            :obj:`str`: The directory path.
+        '''
+        return os.path.join(self.root, table)
+
+    def read_meta(self, table):
+        '''Gets the metadata of a table of the archive.
+
+        Args:
+            table (:obj:`str`): Raw table name.
+
+        Returns:
+            :obj:`dict`: Column types, row count and last timestamp (epoch ms, or None).
+        '''
+        path = os.path.join(self.table_path(table), 'meta.json')
+        if not os.path.exists(path):
+            return {'columns': COLUMNS[table], 'rows': 0, 'last_timestamp': None}
+        with open(path) as f:
+            return json.load(f)
+
+    def write_meta(self, table, meta):
+        '''Helper method to replace the metadata of a table atomically.
+
+        Args:
+            table (:obj:`str`): Raw table name.
+            meta (:obj:`dict`): The new metadata.
+        '''
+        path = os.path.join(self.table_path(table), 'meta.json')
+        with open(path + '.tmp', 'w') as f:
+            json.dump(meta, f)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(path + '.tmp', path)
+
+    def append_table(self, table, chunk_size = 5000):
+        '''Appends the rows of a table newer than the last copied one, in chunks. Leftovers of an
+        interrupted append, past the row count of the metadata, are dropped first. Rows older than
+        the last copied one are never picked up, see rebuild_table.
+
+        Args:
+            table (:obj:`str`): Raw table name.
+            chunk_size (int, optional): Rows written per chunk. Defaults to 5000.
+
+        Returns:
+            int: The number of rows appended.
+        '''
+        os.makedirs(self.table_path(table), exist_ok=True)
+        meta = self.read_meta(table)
+        cols = meta['columns']
+        last = meta['last_timestamp']
+        idx = [TABLES[table].index(name) for name, _, _ in cols]
+
+        files = []
+        for name, code, _ in cols:
+            f = open(os.path.join(self.table_path(table), name + '.bin'), 'ab')
+            f.truncate(meta['rows'] * array(code).itemsize)
+            files.append(f)
+
+        start = None if last is None else from_epoch_ms(last + 1)
+        appended = 0
+        try:
+            chunk = []
+            for row in self.history.range(table, start):
+                msecs = to_epoch_ms(row[0])
+                if last is not None and msecs <= last:
+                    continue
+                chunk.append([msecs] + [row[i] for i in idx[1:]])
+                last = msecs
+                if len(chunk) >= chunk_size:
+                    appended += self.write_chunk(table, meta, files, chunk)
+                    chunk = []
+            if chunk:
+                appended += self.write_chunk(table, meta, files, chunk)
+        finally:
+            for f in files:
+                f.close()
+
+        return appended
+
+    def rebuild_table(self, table, since = None):
+        '''Drops the archived rows of a table from a given timestamp on and appends them again,
+        along with the newer ones. Appends only copy rows newer than the last copied one, so rows
+        reaching the DB later with older timestamps (imports, restores) need a rebuild from their
+        first timestamp on. The column files are truncated by the append itself.
+
+        Args:
+            table (:obj:`str`): Raw table name.
+            since (:obj:`datetime`, optional): First timestamp to copy again. Defaults to None,
+                rebuilding the whole table.
+
+        Returns:
+            int: The number of rows appended.
+        '''
+        meta = self.read_meta(table)
+        keep, last = 0, None
+        if since is not None and meta['rows']:
+            view = ColumnarTable(self.table_path(table), meta)
+            keep = view.search(since)[0]
+            if keep:
+                last = int(view.column('timestamp')[keep - 1])
+            view.close()
+        if not keep:
+            meta['columns'] = COLUMNS[table]
+
+        # committed before truncating, so an interrupted rebuild is picked up by the next append.
+        meta['rows'], meta['last_timestamp'] = keep, last
+        os.makedirs(self.table_path(table), exist_ok=True)
+        self.write_meta(table, meta)
+        return self.append_table(table)
+
+    def rebuild(self, since = None):
+        '''Rebuilds every archived table from a given timestamp on, see rebuild_table. Readers
+        opened before must be closed, and the app must not be appending meanwhile.
+
+        Args:
+            since (:obj:`datetime`, optional): First timestamp to copy again. Defaults to None,
+                rebuilding the whole archive.
+
+        Returns:
+            :obj:`dict`: Number of rows appended per table.
+        '''
+        return {table: self.rebuild_table(table, since) for table in COLUMNS}
+
+    def write_chunk(self, table, meta, files, chunk):
+        '''Helper method to append a chunk of rows to every column file, then commit the new row
+        count to the metadata.
+
+        Args:
+            table (:obj:`str`): Raw table name.
+            meta (:obj:`dict`): Table metadata, updated in place.
+            files (:obj:`list`): Open column files, in column order.
+            chunk (:obj:`list`): Rows with the timestamp as epoch ms, in column order.
+
+        Returns:
+            int: The number of rows appended.
+        '''
+        for i, ((_, code, _), f) in enumerate(zip(meta['columns'], files)):
+            if code in 'fd':
+                values = [to_number(r[i]) for r in chunk]
+                col = array(code, [float('nan') if v is None else v for v in values])
+            else:
+                col = array(code, [0 if r[i] is None else int(r[i]) for r in chunk])
+            if sys.byteorder != 'little':
+                col.byteswap()
+            col.tofile(f)
+            f.flush()
+            os.fsync(f.fileno())
+
+        meta['rows'] += len(chunk)
+        meta['last_timestamp'] = chunk[-1][0]
+        self.write_meta(table, meta)
+        return len(chunk)
+
+    def run_once(self):
+        '''Performs a single append pass over every archived table.
+
+        Returns:
+            :obj:`dict`: Number of rows appended per table.
+        '''
+        return {table: self.append_table(table) for table in COLUMNS}
+
+    def run(self, exit_evt = None):
+        '''The main loop that periodically appends new rows to the archive.
+
+        Args:
+            exit_evt (:obj:`Event`, optional): Event flag to manage thread cleaning before exiting
+                the full app.
+        '''
+        sleep_func = time.sleep if exit_evt == None else exit_evt.wait
+
+        while True if exit_evt == None else not exit_evt.is_set():
+            try:
+                appended = self.run_once()
+                if any(appended.values()):
+                    print('columnar archive appended: {}'.format(appended))
+            except Exception as e:
+                print('Exception at ColumnarArchive.run')
+                print(type(e))
+                print(e)
+                traceback.print_tb(e.__traceback__)
+
+            sleep_func(self.interval)
+
+    def open(self, table):
+        '''Opens a table of the archive for reading.
+
+        Args:
+            table (:obj:`str`): Raw table name.
+
+        Returns:
+            :obj:`ColumnarTable`: The table view, as of its last complete append.
+        '''
+        return ColumnarTable(self.table_path(table), self.read_meta(table))
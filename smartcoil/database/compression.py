@@ -0,0 +1,223 @@
+def seconds(tstamp):
+    '''Helper method to get a timestamp as seconds since the epoch.
+
+    Args:
+        tstamp (:obj:`datetime`): The timestamp.
+
+    Returns:
+        float: Seconds since the epoch.
+    '''
+    return tstamp.timestamp()
+
+def is_number(value):
+    '''Helper method to check if a reading can be interpolated.
+
+    Args:
+        value (object): The reading.
+
+    Returns:
+        bool: Whether the value is an int or a float.
+    '''
+    return isinstance(value, (int, float)) and not isinstance(value, bool)
+
+class SwingingDoorCompressor():
+    '''Serves as the class that drops redundant sensor rows before they reach the DB, using the
+    swinging door algorithm. A row is only stored when the rows in between the last stored row
+    and the new one can no longer be rebuilt by linear interpolation within the per column
+    tolerance.'''
+
+    def __init__(self, columns, tolerances, max_interval = 600, enabled = False):
+        '''Columns without a tolerance (or with a zero tolerance), such as fancoil_running, are
+        treated as steps: every change is stored right away, together with the row before it.
+
+        Args:
+            columns (:obj:`list`): Column names of the rows, starting with the timestamp.
+            tolerances (:obj:`dict`): Max interpolation error allowed per column name.
+            max_interval (int, optional): Max seconds between two stored rows. Defaults to 10
+                minutes.
+            enabled (bool, optional): Whether to compress at all. When disabled every row is
+                stored. Defaults to False, compression is lossy and must be opted in.
+        '''
+        self.columns = columns
+        self.tolerances = [tolerances.get(c, 0) for c in columns[1:]]
+        self.max_interval = max_interval
+        self.enabled = enabled
+
+        # last stored row, last row seen (pending to be stored) and whether it was stored.
+        self.anchor = None
+        self.held = None
+        self.held_stored = True
+        # lower and upper slopes of the door of every column.
+        self.slopes = []
+
+        self.rows_in = 0
+        self.rows_out = 0
+
+    def open_door(self, anchor, row):
+        '''Helper method to start a new door from an anchor row.
+
+        Args:
+            anchor (:obj:`list`): The last stored row.
+            row (:obj:`list`): The first row after the anchor, or None.
+        '''
+        self.anchor = anchor
+        self.slopes = [[float('-inf'), float('inf')] for _ in self.tolerances]
+        if row is not None:
+            self.door_closed(row)
+
+    def is_step(self, row):
+        '''Helper method to check if a row changes a column that must not be interpolated.
+
+        Args:
+            row (:obj:`list`): The new row.
+
+        Returns:
+            bool: Whether a step column (or a non numeric value) changed since the last row.
+        '''
+        for tol, old, new in zip(self.tolerances, self.held[1:], row[1:]):
+            if old != new and (tol <= 0 or not (is_number(old) and is_number(new))):
+                return True
+        return False
+
+    def door_closed(self, row):
+        '''Helper method to narrow the door of every column with a new row.
+
+        Args:
+            row (:obj:`list`): The new row.
+
+        Returns:
+            bool: Whether the door of any column closed, meaning the rows since the anchor can not
+                be rebuilt by interpolating from the anchor to the new row.
+        '''
+        elapsed = seconds(row[0]) - seconds(self.anchor[0])
+        if elapsed <= 0:
+            return False
+
+        closed = False
+        for i, tol in enumerate(self.tolerances):
+            base, val = self.anchor[i + 1], row[i + 1]
+            if tol <= 0 or not (is_number(base) and is_number(val)):
+                continue
+            door = self.slopes[i]
+            slope = (val - base) / elapsed
+            closed = closed or slope < door[0] or slope > door[1]
+            door[0] = max(door[0], slope - tol / elapsed)
+            door[1] = min(door[1], slope + tol / elapsed)
+        return closed
+
+    def add(self, row):
+        '''Feeds a new row to the compressor.
+
+        Args:
+            row (:obj:`list`): The new row, its first value being a datetime timestamp.
+
+        Returns:
+            :obj:`list`: Rows to be stored now, possibly empty.
+        '''
+        self.rows_in += 1
+        out = []
+
+        if not self.enabled or self.anchor is None:
+            out.append(row)
+            self.open_door(row, None)
+            self.held, self.held_stored = row, True
+        elif self.is_step(row):
+            # keep both sides of a step, so it isn't interpolated away.
+            if not self.held_stored:
+                out.append(self.held)
+            out.append(row)
+            self.open_door(row, None)
+            self.held, self.held_stored = row, True
+        elif (self.door_closed(row)
+              or seconds(row[0]) - seconds(self.anchor[0]) > self.max_interval):
+            if not self.held_stored:
+                out.append(self.held)
+                self.open_door(self.held, row)
+                self.held, self.held_stored = row, False
+            else:
+                out.append(row)
+                self.open_door(row, None)
+                self.held, self.held_stored = row, True
+        else:
+            self.held, self.held_stored = row, False
+
+        self.rows_out += len(out)
+        return out
+
+    def flush(self):
+        '''Gets the last row seen if it wasn't stored yet. Use it before leaving the application,
+        so the series ends at its actual last value.
+
+        Returns:
+            :obj:`list`: Rows to be stored now, possibly empty.
+        '''
+        if self.held is None or self.held_stored:
+            return []
+
+        self.held_stored = True
+        self.open_door(self.held, None)
+        self.rows_out += 1
+        return [self.held]
+
+    def get_stats(self):
+        '''Gets the compression counters.
+
+        Returns:
+            :obj:`dict`: Rows received, rows stored and the compression ratio (received / stored).
+        '''
+        return {
+            'rows_in': self.rows_in,
+            'rows_out': self.rows_out,
+            'ratio': round(self.rows_in / max(self.rows_out, 1), 2),
+        }
+
+    def reconstruct(self, rows, timestamps, max_gap = None):
+        '''Rebuilds a compressed series at given timestamps, by linear interpolation of numeric
+        columns between the stored rows around each timestamp. Non numeric columns and step columns
+        keep the value of the previous stored row. The result is within the tolerance of the
+        original rows.
+
+        Args:
+            rows (iterable): Stored rows sorted by timestamp, the first value being a datetime.
+            timestamps (iterable): Sorted datetime objects to rebuild the series at, it may be
+                endless: it's consumed until the last stored row.
+            max_gap (int, optional): Max seconds between two stored rows to interpolate between
+                them, longer gaps are left empty. Defaults to None, no limit.
+
+        Yields:
+            :obj:`list`: One row per timestamp within the stored range.
+        '''
+        rows = iter(rows)
+        prev = next(rows, None)
+        curr = next(rows, None)
+        if prev is None:
+            return
+
+        for tstamp in timestamps:
+            while curr is not None and curr[0] < tstamp:
+                prev, curr = curr, next(rows, None)
+
+            if tstamp < prev[0]:
+                continue
+            if curr is None:
+                if tstamp == prev[0]:
+                    yield list(prev)
+                return
+            if tstamp == curr[0]:
+                yield list(curr)
+                continue
+
+            span = seconds(curr[0]) - seconds(prev[0])
+            if max_gap is not None and span > max_gap:
+                if tstamp == prev[0]:
+                    yield list(prev)
+                continue
+
+            frac = (seconds(tstamp) - seconds(prev[0])) / span
+            row = [tstamp]
+            for tol, a, b in zip(self.tolerances, prev[1:], curr[1:]):
+                if tol > 0 and is_number(a) and is_number(b):
+                    row.append(a + (b - a) * frac)
+                else:
+                    row.append(a)
+            yield row
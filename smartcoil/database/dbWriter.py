@@ -0,0 +1,340 @@
+import re
+import sqlite3
+import time
+import traceback
+from queue import Queue, Empty
+from threading import Event
+from .storage import StorageCodec
+
+# Special queue items used to control the writer thread.
+FLUSH = 'FLUSH'
+STOP = 'STOP'
+# Queue item standing for a row seen but not stored, only passed to the observers of its table.
+OBSERVE = 'OBSERVE'
+
+# SQLite errors raised while another connection holds the lock, worth retrying.
+BUSY_ERRORS = ('database is locked', 'database is busy', 'database table is locked')
+
+# Gets the table targeted by an INSERT statement.
+INSERT_PATTERN = re.compile(r'^\s*INSERT\s+(?:OR\s+\w+\s+)?INTO\s+(\w+)', re.IGNORECASE)
+
+class DBWriter():
+    '''Serves as the class that owns the only long-lived write connection to the SQLite DB.
+    Statements are queued by any thread and committed in batches by the writer thread, so an
+    insert never has to wait for a disk sync.'''
+
+    def __init__(self, dbase_path, flush_interval = 2.0, batch_size = 200, journal_mode = 'WAL',
+                 synchronous = 'NORMAL', max_retries = 8, retry_delay = 0.1):
+        '''The module is intented to be a secondary thread of the base class SmartCoil.
+        Rows are grouped into one transaction per flush interval, or earlier if the batch size is
+        reached.
+
+        Args:
+            dbase_path (:obj:`str`): Path to the SQLite database.
+            flush_interval (float, optional): Max seconds a queued statement waits before being
+                committed. Defaults to 2 seconds.
+            batch_size (int, optional): Max number of statements per transaction. Defaults to 200.
+            journal_mode (:obj:`str`, optional): SQLite journal mode for the connection. WAL lets
+                readers work while the writer commits. Defaults to 'WAL'.
+            synchronous (:obj:`str`, optional): SQLite synchronous setting. Defaults to 'NORMAL'.
+            max_retries (int, optional): Times a batch is retried while the DB is locked by
+                another connection (backup, import, retention) before its rows are dropped.
+                Defaults to 8.
+            retry_delay (float, optional): Seconds before the first retry, doubled on every
+                retry up to 5 seconds. Defaults to 0.1.
+        '''
+        self.dbase_path = dbase_path
+        self.flush_interval = flush_interval
+        self.batch_size = batch_size
+        self.journal_mode = journal_mode
+        self.synchronous = synchronous
+        self.max_retries = max_retries
+        self.retry_delay = retry_delay
+
+        self.queue = Queue()
+        self.stopped = Event()
+        self.conn = None
+        self.codec = None
+
+        # Hooks run inside the same transaction right after a row is inserted into a table.
+        self.hooks = {}
+        self.observers = {}
+        self.txn_hooks = []
+
+        # counters exposed through get_stats.
+        self.rows_committed = 0
+        self.rows_failed = 0
+        self.retries = 0
+        self.transactions = 0
+        self.last_batch_rows = 0
+        self.max_batch_rows = 0
+        self.last_commit_ms = 0.0
+        self.max_commit_ms = 0.0
+        self.total_commit_ms = 0.0
+
+    def submit(self, sql, params):
+        '''Queues a statement to be committed by the writer thread.
+
+        Args:
+            sql (:obj:`str`): The SQL string to be executed.
+            params (:obj:`list`): A list of parameters to be included in the query.
+        '''
+        self.queue.put((sql, params))
+
+    def observe(self, table, params):
+        '''Queues a row that is not stored, i.e. dropped by a compressor, for the observers of its
+        table to see it in order with the stored rows.
+
+        Args:
+            table (:obj:`str`): Table name the row belongs to.
+            params (:obj:`list`): The row, in table column order.
+        '''
+        self.queue.put((OBSERVE, (table, params)))
+
+    def add_hook(self, table, hook):
+        '''Registers a method to be executed after each row inserted into a given table. The hook
+        runs in the writer thread and within the same transaction as the insert.
+
+        Args:
+            table (:obj:`str`): Table name the hook is interested in.
+            hook (:obj:`function`): Method receiving the writer cursor and the inserted params.
+        '''
+        self.hooks.setdefault(table, []).append(hook)
+
+    def add_observer(self, table, hook):
+        '''Registers a method to be executed for each row observed for a given table, stored or
+        not, instead of the inserted ones only. It runs in the writer thread and within the
+        transaction the row is processed in.
+
+        Args:
+            table (:obj:`str`): Table name the hook is interested in.
+            hook (:obj:`function`): Method receiving the writer cursor and the observed row.
+        '''
+        self.observers.setdefault(table, []).append(hook)
+
+    def add_transaction_hook(self, on_commit, on_rollback):
+        '''Registers methods to be executed when a batch is committed or rolled back, so hooks
+        keeping state in memory can drop what a rolled back batch changed before it's retried.
+
+        Args:
+            on_commit (:obj:`function`): Method called, without arguments, after each commit.
+            on_rollback (:obj:`function`): Method called, without arguments, after each rollback.
+        '''
+        self.txn_hooks.append((on_commit, on_rollback))
+
+    def flush(self, timeout = None):
+        '''Blocks until every statement queued before this call is committed.
+
+        Args:
+            timeout (float, optional): Max seconds to wait. Defaults to None (wait forever).
+
+        Returns:
+            bool: Whether the flush completed in time.
+        '''
+        if self.stopped.is_set():
+            return True
+
+        done = Event()
+        self.queue.put((FLUSH, done))
+        return done.wait(timeout)
+
+    def close(self, timeout = 10):
+        '''Commits any pending statement and stops the writer thread. Use it before leaving the
+        application.
+
+        Args:
+            timeout (float, optional): Max seconds to wait for pending rows. Defaults to 10.
+        '''
+        if self.stopped.is_set():
+            return
+
+        self.queue.put((STOP, None))
+        self.stopped.wait(timeout)
+
+    def get_stats(self):
+        '''Gets the writer counters.
+
+        Returns:
+            :obj:`dict`: Committed and failed rows, transaction count, rows per transaction and
+                commit latency in milliseconds.
+        '''
+        txns = max(self.transactions, 1)
+        return {
+            'queued': self.queue.qsize(),
+            'rows_committed': self.rows_committed,
+            'rows_failed': self.rows_failed,
+            'retries': self.retries,
+            'transactions': self.transactions,
+            'rows_per_txn_last': self.last_batch_rows,
+            'rows_per_txn_max': self.max_batch_rows,
+            'rows_per_txn_avg': round(self.rows_committed / txns, 2),
+            'commit_ms_last': round(self.last_commit_ms, 3),
+            'commit_ms_max': round(self.max_commit_ms, 3),
+            'commit_ms_avg': round(self.total_commit_ms / txns, 3),
+        }
+
+    def connect(self):
+        '''Helper method to open the persistent connection used by the writer thread.
+        '''
+        self.conn = sqlite3.connect(self.dbase_path)
+        self.conn.execute('PRAGMA journal_mode={}'.format(self.journal_mode))
+        self.conn.execute('PRAGMA synchronous={}'.format(self.synchronous))
+        self.codec = StorageCodec.load(self.conn)
+
+    def collect_batch(self):
+        '''Helper method that waits for the first queued statement and then keeps collecting more
+        until the flush interval expires or the batch is full.
+
+        Returns:
+            :obj:`tuple`: The list of (sql, params) statements, and the list of control items
+                (flush or stop requests) found while collecting.
+        '''
+        batch = []
+        controls = []
+        item = self.queue.get()
+        deadline = time.monotonic() + self.flush_interval
+
+        while True:
+            if item[0] in (FLUSH, STOP):
+                # control items close the batch right away.
+                controls.append(item)
+                break
+
+            batch.append(item)
+            if len(batch) >= self.batch_size:
+                break
+
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+
+            try:
+                item = self.queue.get(timeout=remaining)
+            except Empty:
+                break
+
+        return (batch, controls)
+
+    def commit_batch(self, batch):
+        '''Commits a batch of statements inside a single transaction. If the DB is locked by
+        another connection the transaction is rolled back and the whole batch retried, waiting
+        longer every time; after max_retries its rows are dropped.
+
+        Args:
+            batch (:obj:`list`): List of (sql, params) statements.
+        '''
+        if not batch:
+            return
+
+        delay = self.retry_delay
+        for attempt in range(self.max_retries + 1):
+            try:
+                self.execute_batch(batch)
+                return
+            except sqlite3.OperationalError as e:
+                self.conn.rollback()
+                for _, on_rollback in self.txn_hooks:
+                    on_rollback()
+                if attempt == self.max_retries:
+                    self.rows_failed += len(batch)
+                    print('DB still busy after {} retries, {} rows dropped: {}'.format(
+                        self.max_retries, len(batch), e))
+                    return
+
+                self.retries += 1
+                print('DB busy, retrying {} rows in {} s: {}'.format(len(batch), delay, e))
+                time.sleep(delay)
+                delay = min(delay * 2, 5)
+
+    def execute_batch(self, batch):
+        '''Helper method to execute a batch of statements and commit them. A failing statement is
+        reported and skipped, the remaining ones are still committed, unless it failed because the
+        DB is locked.
+
+        Args:
+            batch (:obj:`list`): List of (sql, params) statements.
+
+        Raises:
+            :obj:`sqlite3.OperationalError`: If the DB is locked by another connection.
+        '''
+        start = time.perf_counter()
+        crsr = self.conn.cursor()
+        rows = 0
+        failed = 0
+        for sql, params in batch:
+            try:
+                if sql == OBSERVE:
+                    table, params = params
+                    for hook in self.observers.get(table, ()):
+                        hook(crsr, params)
+                    continue
+
+                match = INSERT_PATTERN.match(sql)
+                if match is None:
+                    crsr.execute(sql, params)
+                else:
+                    # rows are queued in v1 format, the codec stores them in the DB format.
+                    table = match.group(1)
+                    crsr.execute(sql, self.codec.encode_row(crsr, table, params))
+                    for hook in self.hooks.get(table, ()):
+                        hook(crsr, params)
+                rows += 1
+            except sqlite3.OperationalError as e:
+                if str(e) in BUSY_ERRORS:
+                    raise
+                failed += 1
+                print('Exception at DBWriter.execute_batch')
+                print(type(e))
+                print(e)
+            except Exception as e:
+                failed += 1
+                print('Exception at DBWriter.execute_batch')
+                print(type(e))
+                print(e)
+        self.conn.commit()
+        for on_commit, _ in self.txn_hooks:
+            on_commit()
+        elapsed = (time.perf_counter() - start) * 1000
+
+        self.rows_failed += failed
+        self.rows_committed += rows
+        self.transactions += 1
+        self.last_batch_rows = rows
+        self.max_batch_rows = max(self.max_batch_rows, rows)
+        self.last_commit_ms = elapsed
+        self.max_commit_ms = max(self.max_commit_ms, elapsed)
+        self.total_commit_ms += elapsed
+
+    def run(self):
+        '''The main loop that drains the statements queue into the database until a stop request
+        is received.
+        '''
+        try:
+            self.connect()
+            stop = False
+            while not stop:
+                batch, controls = self.collect_batch()
+                try:
+                    self.commit_batch(batch)
+                except Exception as e:
+                    # the loop keeps going, or every later row would be queued for nothing.
+                    self.rows_failed += len(batch)
+                    print('Exception at DBWriter.run')
+                    print(type(e))
+                    print(e)
+                    traceback.print_tb(e.__traceback__)
+
+                for ctrl, done in controls:
+                    if ctrl == STOP:
+                        stop = True
+                    else:
+                        done.set()
+        except Exception as e:
+            print('Exception at DBWriter.run')
+            print(type(e))
+            print(e)
+            traceback.print_tb(e.__traceback__)
+        finally:
+            if self.conn is not None:
+                self.conn.close()
+            self.stopped.set()
@@ -0,0 +1,227 @@
+import io
+import sys
+import csv
+import gzip
+import json
+from contextlib import contextmanager
+from datetime import datetime, timedelta
+from .storage import TABLES
+from .rollups import GRANULARITIES, bucket_start, to_number
+
+# Output formats supported by the exporter.
+FORMATS = ('csv', 'jsonl')
+
+# Joined view of indoor sensor rows and the outdoor weather seen at the same time.
+JOINED_VIEW = 'INDOOR_OUTDOOR'
+JOINED_COLUMNS = ['timestamp', 'indoor_temperature', 'indoor_humidity', 'air_quality',
+                  'fancoil_running', 'outdoor_temperature', 'outdoor_humidity', 'condition',
+                  'wind_speed', 'precipitation']
+
+# How far before the start of a joined export to look for the outdoor weather of the first rows.
+WEATHER_LOOKBACK = timedelta(hours=1)
+
+@contextmanager
+def open_output(path, compress = False):
+    '''Opens the text stream an export is written to, closing it afterwards. Stdout is flushed
+    but left open.
+
+    Args:
+        path (:obj:`str`): Output file path, or '-' for stdout.
+        compress (bool, optional): Whether to gzip the output. Defaults to False.
+
+    Yields:
+        :obj:`TextIOBase`: The stream to write to.
+    '''
+    if path != '-':
+        with (gzip.open(path, 'wt', newline='') if compress else open(path, 'w', newline='')) as f:
+            yield f
+    elif compress:
+        with io.TextIOWrapper(gzip.GzipFile(fileobj=sys.stdout.buffer, mode='wb'),
+                              newline='') as f:
+            yield f
+    else:
+        yield sys.stdout
+        sys.stdout.flush()
+
+def to_json(value):
+    '''Helper method to get a value JSON serializable.
+
+    Args:
+        value (object): A row value.
+
+    Returns:
+        object: Timestamps as ISO formatted strings, any other value as it is.
+    '''
+    return value.isoformat() if isinstance(value, datetime) else value
+
+class HistoryExporter():
+    '''Serves as the class that streams SmartCoil DB history out as CSV or JSON Lines. Rows are
+    pulled from a HistoryQuery generator and written one at a time, so memory use stays the same
+    whatever the exported range is.'''
+
+    def __init__(self, history):
+        '''Args:
+            history (:obj:`HistoryQuery`): Read path of the DB to export from.
+        '''
+        self.history = history
+
+    def columns(self, source):
+        '''Gets the column names of an export source.
+
+        Args:
+            source (:obj:`str`): Raw table name or 'INDOOR_OUTDOOR'.
+
+        Returns:
+            :obj:`list`: The column names, starting with the timestamp.
+        '''
+        if source == JOINED_VIEW:
+            return list(JOINED_COLUMNS)
+        if source not in TABLES:
+            raise ValueError('unknown table {}'.format(source))
+        return list(TABLES[source])
+
+    def rows(self, source, start = None, end = None, rebuild = False):
+        '''Streams the rows of an export source in timestamp order.
+
+        Args:
+            source (:obj:`str`): Raw table name or 'INDOOR_OUTDOOR'.
+            start (:obj:`datetime`, optional): Only rows at or after this timestamp.
+            end (:obj:`datetime`, optional): Only rows before this timestamp.
+            rebuild (bool, optional): Whether sensor rows are rebuilt at regular steps, see
+                HistoryQuery.interpolate. Defaults to False, the rows as stored.
+
+        Yields:
+            :obj:`list`: Rows in v1 format, with the timestamp as a datetime object.
+        '''
+        if source == JOINED_VIEW:
+            yield from self.joined(start, end, rebuild)
+        else:
+            self.columns(source)
+            read = self.history.interpolate if rebuild else self.history.range
+            yield from read(source, start, end)
+
+    def joined(self, start = None, end = None, rebuild = False):
+        '''Helper method to stream sensor rows along with the last weather row at or before each
+        of them. Both tables are scanned once, in timestamp order, side by side.
+
+        Args:
+            start (:obj:`datetime`, optional): Only rows at or after this timestamp.
+            end (:obj:`datetime`, optional): Only rows before this timestamp.
+            rebuild (bool, optional): Whether sensor rows are rebuilt at regular steps.
+                Defaults to False.
+
+        Yields:
+            :obj:`list`: Rows following the JOINED_COLUMNS order.
+        '''
+        wcols = TABLES['YR_WEATHER_API_DATA']
+        widx = [wcols.index(c) for c in ('temperature', 'humidity', 'condition', 'wind_speed',
+                                         'precipitation')]
+        wstart = None if start is None else start - WEATHER_LOOKBACK
+        weather = self.history.range('YR_WEATHER_API_DATA', wstart, end)
+
+        current = None
+        upcoming = next(weather, None)
+        read = self.history.interpolate if rebuild else self.history.range
+        for tstamp, temp, humi, _, _, airq, fan in read('SENSOR_BME680_DATA', start, end):
+            while upcoming is not None and upcoming[0] <= tstamp:
+                current, upcoming = upcoming, next(weather, None)
+
+            outdoor = [None] * len(widx) if current is None else [current[i] for i in widx]
+            yield [tstamp, temp, humi, airq, fan] + outdoor
+
+    def resample(self, rows, bucket):
+        '''Helper method to aggregate streamed rows in time buckets, keeping a single bucket in
+        memory. Numeric columns are averaged, any other column keeps its last value.
+
+        Args:
+            rows (iterable): Rows sorted by timestamp, the first value being a datetime.
+            bucket (object): Either 'minute', 'hour', 'day' or a bucket length in seconds.
+
+        Yields:
+            :obj:`list`: One row per bucket, timestamped with the bucket start.
+        '''
+        gran = bucket.upper() if isinstance(bucket, str) and not bucket.isdigit() else None
+        if gran is not None:
+            if gran not in GRANULARITIES:
+                raise ValueError('unknown bucket {}'.format(bucket))
+            get_bucket = lambda tstamp: bucket_start(tstamp, gran)
+        else:
+            secs = int(bucket)
+            get_bucket = lambda tstamp: datetime.fromtimestamp(tstamp.timestamp() // secs * secs)
+
+        current = None
+        sums = counts = lasts = None
+        for row in rows:
+            bkt = get_bucket(row[0])
+            if bkt != current:
+                if current is not None:
+                    yield self.bucket_row(current, sums, counts, lasts)
+                current = bkt
+                sums = [0.0] * (len(row) - 1)
+                counts = [0] * (len(row) - 1)
+                lasts = [None] * (len(row) - 1)
+
+            for i, val in enumerate(row[1:]):
+                num = to_number(val)
+                if num is not None:
+                    sums[i] += num
+                    counts[i] += 1
+                elif val is not None:
+                    lasts[i] = val
+
+        if current is not None:
+            yield self.bucket_row(current, sums, counts, lasts)
+
+    def bucket_row(self, bkt, sums, counts, lasts):
+        '''Helper method to build the row of a finished bucket.
+
+        Args:
+            bkt (:obj:`datetime`): The bucket start.
+            sums (:obj:`list`): Sum of the numeric values of every column.
+            counts (:obj:`list`): Number of numeric values of every column.
+            lasts (:obj:`list`): Last non numeric value of every column.
+
+        Returns:
+            :obj:`list`: The bucket row.
+        '''
+        return [bkt] + [round(s / c, 4) if c else last for s, c, last in zip(sums, counts, lasts)]
+
+    def export(self, out, source, start = None, end = None, fmt = 'csv', bucket = None):
+        '''Streams an export source into an open text stream.
+
+        Args:
+            out (:obj:`TextIOBase`): Stream to write to, see open_output.
+            source (:obj:`str`): Raw table name or 'INDOOR_OUTDOOR'.
+            start (:obj:`datetime`, optional): Only rows at or after this timestamp.
+            end (:obj:`datetime`, optional): Only rows before this timestamp.
+            fmt (:obj:`str`, optional): Either 'csv' or 'jsonl'. Defaults to 'csv'.
+            bucket (object, optional): Resampling bucket, either 'minute', 'hour', 'day' or a
+                length in seconds. Sensor rows are resampled out of their series rebuilt at
+                regular steps. Defaults to None, exporting the rows as they are.
+
+        Returns:
+            int: The number of rows written.
+        '''
+        if fmt not in FORMATS:
+            raise ValueError('unknown format {}'.format(fmt))
+
+        columns = self.columns(source)
+        rows = self.rows(source, start, end, rebuild=bucket is not None)
+        if bucket is not None:
+            rows = self.resample(rows, bucket)
+
+        written = 0
+        if fmt == 'csv':
+            writer = csv.writer(out)
+            writer.writerow(columns)
+            for row in rows:
+                writer.writerow(row)
+                written += 1
+        else:
+            for row in rows:
+                out.write(json.dumps({c: to_json(v) for c, v in zip(columns, row)}))
+                out.write('\n')
+                written += 1
+
+        out.flush()
+        return written
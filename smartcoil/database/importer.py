@@ -0,0 +1,183 @@
+import csv
+import gzip
+import json
+import time
+import sqlite3
+from datetime import datetime
+from .storage import StorageCodec, TABLES, V2
+from .retention import parse_value
+
+def open_input(path):
+    '''Helper method to open an import file as text, gzip'd or not.
+
+    Args:
+        path (:obj:`str`): Path ending in '.csv', '.jsonl', optionally followed by '.gz'.
+
+    Returns:
+        :obj:`TextIOBase`: The open file.
+    '''
+    if path.endswith('.gz'):
+        return gzip.open(path, 'rt', newline='')
+    return open(path, newline='')
+
+def read_rows(path, columns):
+    '''Streams the rows of a CSV (with a header) or JSON Lines file, as written by
+    "smartcoil export".
+
+    Args:
+        path (:obj:`str`): Path to the file.
+        columns (:obj:`list`): Column names of the target table, starting with the timestamp.
+
+    Yields:
+        :obj:`list`: Rows in v1 format following the table columns, missing columns as None and
+        the timestamp as a datetime object.
+    '''
+    is_json = path[:-3].endswith('.jsonl') if path.endswith('.gz') else path.endswith('.jsonl')
+    with open_input(path) as f:
+        if is_json:
+            records = (json.loads(line) for line in f if line.strip())
+        else:
+            records = ({k: parse_value(v) for k, v in r.items()} for r in csv.DictReader(f))
+
+        for rec in records:
+            row = [rec.get(c) for c in columns]
+            if not isinstance(row[0], datetime):
+                row[0] = datetime.fromisoformat(str(row[0]))
+            yield row
+
+class BulkImporter():
+    '''Serves as the class that loads history files into the raw tables of the SmartCoil DB.
+    Rows are inserted with executemany, many per transaction, skipping timestamps already in the
+    table. Transactions are kept short with a pause in between, so it can run next to the app's
+    DB writer; for very large offline loads the timestamp index can be dropped and rebuilt once
+    at the end instead.'''
+
+    def __init__(self, dbase_path, txn_rows = 5000, pause = 0.1, defer_indexes = False):
+        '''Args:
+            dbase_path (:obj:`str`): Path to the SQLite database.
+            txn_rows (int, optional): Rows per transaction. Defaults to 5000.
+            pause (float, optional): Seconds to sleep between transactions, so the DB writer can
+                take the write lock. Defaults to 0.1.
+            defer_indexes (bool, optional): Whether to drop the timestamp index during the load
+                and rebuild it at the end. Only meant for very large loads while the app is
+                stopped. Defaults to False.
+        '''
+        self.dbase_path = dbase_path
+        self.txn_rows = txn_rows
+        self.pause = pause
+        self.defer_indexes = defer_indexes
+
+    def existing(self, conn, table, rows):
+        '''Helper method to get the stored timestamps within the time range of a chunk, through
+        the timestamp index.
+
+        Args:
+            conn (:obj:`Connection`): Open connection to the database.
+            table (:obj:`str`): Raw table name.
+            rows (:obj:`list`): The chunk, already encoded.
+
+        Returns:
+            :obj:`set`: The stored timestamps, as stored.
+        '''
+        tstamps = [r[0] for r in rows]
+        crsr = conn.execute('SELECT timestamp FROM {} WHERE timestamp BETWEEN ? AND ?'
+                            .format(table), [min(tstamps), max(tstamps)])
+        return {t for t, in crsr}
+
+    def import_file(self, path, table):
+        '''Loads a CSV or JSON Lines file into a raw table.
+
+        Args:
+            path (:obj:`str`): Path to the file, optionally gzip'd.
+            table (:obj:`str`): Raw table name, i.e. 'SENSOR_BME680_DATA'.
+
+        Returns:
+            :obj:`dict`: Rows read, inserted and skipped, first and last timestamp inserted
+            (None if no row was), duration and rows/s.
+        '''
+        if table not in TABLES:
+            raise ValueError('unknown table {}'.format(table))
+
+        start = time.time()
+        columns = TABLES[table]
+        insert = 'INSERT INTO {} VALUES ({})'.format(table, ', '.join('?' * len(columns)))
+        index = 'IDX_{}_TIMESTAMP'.format(table)
+        stats = {'read': 0, 'inserted': 0, 'skipped': 0, 'first': None, 'last': None}
+
+        conn = sqlite3.connect(self.dbase_path, timeout=30)
+        codes = conn.cursor()
+        try:
+            codec = StorageCodec.load(conn)
+            # v2 tables are clustered on their timestamp, their primary key can't be dropped.
+            deferred = self.defer_indexes and codec.format != V2
+            stored = None
+            if deferred:
+                # without the index, duplicates are checked against every stored timestamp.
+                stored = {t for t, in conn.execute('SELECT timestamp FROM {}'.format(table))}
+                conn.execute('DROP INDEX IF EXISTS {}'.format(index))
+                conn.commit()
+
+            chunk = []
+            for row in read_rows(path, columns):
+                stats['read'] += 1
+                chunk.append(codec.encode_row(codes, table, row))
+                if len(chunk) >= self.txn_rows:
+                    self.insert_chunk(conn, codec, table, insert, chunk, stored, stats)
+                    chunk = []
+            if chunk:
+                self.insert_chunk(conn, codec, table, insert, chunk, stored, stats)
+
+            if deferred:
+                conn.execute('CREATE INDEX IF NOT EXISTS {} ON {} (timestamp)'.format(index,
+                                                                                     table))
+                conn.commit()
+        finally:
+            codes.close()
+            conn.close()
+
+        for key in ('first', 'last'):
+            if stats[key] is not None:
+                stats[key] = codec.decode_time(stats[key])
+        duration = time.time() - start
+        stats['duration'] = round(duration, 2)
+        stats['rows_per_sec'] = round(stats['inserted'] / max(duration, 1e-6))
+        return stats
+
+    def insert_chunk(self, conn, codec, table, insert, chunk, stored, stats):
+        '''Helper method to insert a chunk of rows in a single transaction, leaving out the
+        timestamps already stored or repeated within the chunk.
+
+        Args:
+            conn (:obj:`Connection`): Open connection to the database.
+            codec (:obj:`StorageCodec`): Codec of the DB storage format.
+            table (:obj:`str`): Raw table name.
+            insert (:obj:`str`): The insert statement.
+            chunk (:obj:`list`): Encoded rows.
+            stored (:obj:`set`): Every stored timestamp when the index is deferred, or None to
+                look them up per chunk.
+            stats (:obj:`dict`): Import counters, updated in place.
+        '''
+        seen = self.existing(conn, table, chunk) if stored is None else stored
+        rows = []
+        for row in chunk:
+            # v1 timestamps are stored as text, the way sqlite3 adapts datetime objects.
+            key = str(row[0]) if codec.format != V2 else row[0]
+            if key in seen:
+                continue
+            seen.add(key)
+            rows.append(row)
+
+        conn.executemany(insert, rows)
+        conn.commit()
+        stats['inserted'] += len(rows)
+        stats['skipped'] += len(chunk) - len(rows)
+        if rows:
+            # stored timestamps, decoded once the file is loaded.
+            first, last = min(r[0] for r in rows), max(r[0] for r in rows)
+            if stats['first'] is None or first < stats['first']:
+                stats['first'] = first
+            if stats['last'] is None or last > stats['last']:
+                stats['last'] = last
+
+        if self.pause > 0:
+            time.sleep(self.pause)
@@ -0,0 +1,115 @@
+import os
+import re
+import sqlite3
+from datetime import datetime
+
+# Migration scripts are named after the version they bring the DB to, i.e. '0002_some_name.sql'.
+SCRIPT_PATTERN = re.compile(r'^(\d+)_(\w+)\.sql$')
+
+class SchemaMigrator():
+    '''Serves as the class that keeps the SmartCoil DB schema up to date. Every script found in
+    '/assets/db/migrations' is applied once, in version order, and recorded in the schema_version
+    table.'''
+
+    def __init__(self, dbase_path, migrations_dir = None):
+        '''This constructor only gathers the available migration scripts, the DB is not touched
+        until migrate is called.
+
+        Args:
+            dbase_path (:obj:`str`): Path to the SQLite database. Created if it does not exist.
+            migrations_dir (:obj:`str`, optional): Directory holding the migration scripts.
+                Defaults to '/assets/db/migrations'.
+        '''
+        if migrations_dir is None:
+            dirname = os.path.dirname(__file__)
+            migrations_dir = os.path.join(dirname, '../../assets/db/migrations')
+
+        self.dbase_path = dbase_path
+        self.migrations_dir = migrations_dir
+        self.scripts = self.find_scripts()
+
+    def find_scripts(self):
+        '''Helper method to list the migration scripts sorted by version.
+
+        Returns:
+            :obj:`list`: Tuples of (version, name, path) for every migration script.
+        '''
+        scripts = []
+        for fname in os.listdir(self.migrations_dir):
+            match = SCRIPT_PATTERN.match(fname)
+            if match is not None:
+                path = os.path.join(self.migrations_dir, fname)
+                scripts.append((int(match.group(1)), match.group(2), path))
+
+        return sorted(scripts)
+
+    def current_version(self, conn):
+        '''Gets the schema version the DB is currently at.
+
+        Args:
+            conn (:obj:`Connection`): Open connection to the database.
+
+        Returns:
+            int: The last applied migration version, 0 for a brand new DB.
+        '''
+        conn.execute('CREATE TABLE IF NOT EXISTS schema_version '
+                     + '(version integer PRIMARY KEY, name varchar(64), applied_at datetime)')
+        version, = conn.execute('SELECT coalesce(max(version), 0) FROM schema_version').fetchone()
+        return version
+
+    def pending(self, conn):
+        '''Gets the migration scripts not yet applied to the DB.
+
+        Args:
+            conn (:obj:`Connection`): Open connection to the database.
+
+        Returns:
+            :obj:`list`: Tuples of (version, name, path) to be applied, in order.
+        '''
+        version = self.current_version(conn)
+        return [s for s in self.scripts if s[0] > version]
+
+    def apply(self, conn, version, name, path):
+        '''Applies a single migration script inside its own transaction, so a failing script
+        leaves the DB at the previous version.
+
+        Args:
+            conn (:obj:`Connection`): Open connection to the database.
+            version (int): Version the script brings the DB to.
+            name (:obj:`str`): Name of the migration.
+            path (:obj:`str`): Path to the SQL script.
+        '''
+        with open(path, 'r') as f:
+            script = f.read()
+
+        print('applying DB migration {:04d}_{}...'.format(version, name))
+        try:
+            conn.executescript('BEGIN;\n' + script + '\n;')
+            conn.execute('INSERT INTO schema_version VALUES (?, ?, ?)',
+                         [version, name, datetime.now()])
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+
+    def migrate(self):
+        '''Brings the DB up to the latest schema version.
+
+        Returns:
+            int: The schema version after applying all pending migrations.
+        '''
+        conn = sqlite3.connect(self.dbase_path, isolation_level=None)
+        try:
+            version = self.current_version(conn)
+            for script in self.pending(conn):
+                self.apply(conn, *script)
+                version = script[0]
+        finally:
+            conn.close()
+
+        return version
+
+if __name__ == '__main__':
+    dirname = os.path.dirname(__file__)
+    sm = SchemaMigrator(os.path.join(dirname, '../../assets/db/SmartCoilDB'))
+    print('DB schema is at version {}'.format(sm.migrate()))
@@ -0,0 +1,314 @@
+import math
+import sqlite3
+from datetime import datetime, timedelta
+from .storage import StorageCodec, TABLES
+from .rollups import SOURCES, GRANULARITIES, bucket_start, to_number
+from .retention import ARCHIVED_TABLES
+
+# Aggregations supported by resample, and how they are computed out of a rollup bucket.
+ROLLUP_AGGS = {
+    'min': '{0}_min',
+    'max': '{0}_max',
+    'sum': '{0}_sum',
+    'count': '{0}_count',
+    'mean': '{0}_sum / {0}_count',
+}
+
+class HistoryQuery():
+    '''Serves as the read path for the SmartCoil DB history, shared by the GUI, the server and
+    offline scripts. Rows are streamed out of index range scans a few at a time, so large ranges
+    never have to fit in memory, and are always returned in v1 format whatever the DB storage
+    format is.'''
+
+    def __init__(self, dbase_path, retention = None, fetch_size = 500, compressor = None,
+                 step = 60, max_gap = None):
+        '''Sensor rows are stored by a swinging door compressor, far more often while readings
+        change than while they're steady, so aggregating them as they are is biased towards the
+        changes. Given the compressor, sensor rows are aggregated out of the series it rebuilds
+        at regular steps instead.
+
+        Args:
+            dbase_path (:obj:`str`): Path to the SQLite database.
+            retention (:obj:`RetentionManager`, optional): When given, rows already moved to the
+                archive are streamed too. Defaults to None.
+            fetch_size (int, optional): Number of rows fetched from SQLite at a time.
+                Defaults to 500.
+            compressor (:obj:`SwingingDoorCompressor`, optional): Compressor the sensor rows were
+                stored with. Defaults to None, aggregating the stored rows.
+            step (int, optional): Seconds between the rows of a rebuilt sensor series.
+                Defaults to 60.
+            max_gap (int, optional): Max seconds between two stored sensor rows to rebuild the
+                series in between, longer gaps are most likely periods where the app was down.
+                Defaults to None, no limit.
+        '''
+        self.dbase_path = dbase_path
+        self.retention = retention
+        self.fetch_size = fetch_size
+        self.compressor = compressor
+        self.step = step
+        self.max_gap = max_gap
+
+    def connect(self):
+        '''Helper method to open a reading connection along with its storage codec.
+
+        Returns:
+            :obj:`tuple`: The connection and the codec matching the DB storage format.
+        '''
+        conn = sqlite3.connect(self.dbase_path)
+        return (conn, StorageCodec.load(conn))
+
+    def fetch(self, crsr):
+        '''Helper method to stream the rows of an executed query with fetchmany.
+
+        Args:
+            crsr (:obj:`Cursor`): Cursor of the executed query.
+
+        Yields:
+            :obj:`tuple`: Every row of the query.
+        '''
+        rows = crsr.fetchmany(self.fetch_size)
+        while rows:
+            yield from rows
+            rows = crsr.fetchmany(self.fetch_size)
+
+    def range(self, table, start = None, end = None):
+        '''Streams the rows of a raw table between two timestamps, in timestamp order. Archived
+        rows come first when a retention manager is available.
+
+        Args:
+            table (:obj:`str`): Raw table name, i.e. 'SENSOR_BME680_DATA'.
+            start (:obj:`datetime`, optional): Only rows at or after this timestamp.
+            end (:obj:`datetime`, optional): Only rows before this timestamp.
+
+        Yields:
+            :obj:`list`: Rows in v1 format, with the timestamp as a datetime object.
+        '''
+        last = None
+        if self.retention is not None and table in ARCHIVED_TABLES:
+            for row in self.retention.read_archive(table, start, end):
+                last = row[0]
+                yield row
+
+        if last is not None:
+            # the table is read from where the archive ends, so rows stay in timestamp order.
+            start = last + timedelta(microseconds=1)
+
+        conn, codec = self.connect()
+        try:
+            conds = []
+            params = []
+            if start is not None:
+                conds.append('timestamp >= ?')
+                params.append(codec.encode_time(start))
+            if end is not None:
+                conds.append('timestamp < ?')
+                params.append(codec.encode_time(end))
+
+            where = '' if not conds else ' WHERE ' + ' AND '.join(conds)
+            crsr = conn.execute('SELECT * FROM {}{} ORDER BY timestamp'.format(table, where),
+                                params)
+            for row in self.fetch(crsr):
+                yield codec.decode_row(conn, table, row)
+        finally:
+            conn.close()
+
+    def interpolate(self, table, start = None, end = None):
+        '''Streams the rows of a raw table between two timestamps, the sensor series being
+        rebuilt at regular steps when the compressor is known. Rows of other tables are streamed
+        as they are stored.
+
+        Args:
+            table (:obj:`str`): Raw table name, i.e. 'SENSOR_BME680_DATA'.
+            start (:obj:`datetime`, optional): Only rows at or after this timestamp.
+            end (:obj:`datetime`, optional): Only rows before this timestamp.
+
+        Yields:
+            :obj:`list`: Rows in v1 format, with the timestamp as a datetime object.
+        '''
+        if self.compressor is None or table != 'SENSOR_BME680_DATA':
+            yield from self.range(table, start, end)
+            return
+
+        # stored rows right outside the range are needed to interpolate its ends.
+        margin = timedelta(seconds=self.compressor.max_interval)
+        rows = self.range(table, None if start is None else start - margin,
+                          None if end is None else end + margin)
+        first = next(rows, None)
+        if first is None:
+            return
+
+        begin = first[0].timestamp() if start is None else start.timestamp()
+        tstamp = math.ceil(begin / self.step) * self.step
+
+        def grid(tstamp):
+            while end is None or tstamp < end.timestamp():
+                yield datetime.fromtimestamp(tstamp)
+                tstamp += self.step
+
+        yield from self.compressor.reconstruct(self.chain(first, rows), grid(tstamp),
+                                               self.max_gap)
+
+    def chain(self, first, rows):
+        '''Helper method to put back the first row taken out of a stream.
+
+        Args:
+            first (:obj:`list`): The row taken out.
+            rows (iterable): The rest of the stream.
+
+        Yields:
+            :obj:`list`: Every row of the stream.
+        '''
+        yield first
+        yield from rows
+
+    def latest(self, table):
+        '''Gets the most recent row of a raw table.
+
+        Args:
+            table (:obj:`str`): Raw table name, i.e. 'USER_DATA'.
+
+        Returns:
+            :obj:`list`: The row in v1 format, or None if the table is empty.
+        '''
+        conn, codec = self.connect()
+        try:
+            row = conn.execute('SELECT * FROM {} ORDER BY timestamp DESC LIMIT 1'
+                               .format(table)).fetchone()
+            return None if row is None else codec.decode_row(conn, table, row)
+        finally:
+            conn.close()
+
+    def resample(self, table, column, bucket, agg = 'mean', start = None, end = None):
+        '''Streams a column of a raw table aggregated in time buckets. Minute, hour and day
+        buckets are read straight from the rollup tables where they exist, other cases are
+        aggregated on the fly over the raw rows.
+
+        Args:
+            table (:obj:`str`): Raw table name, i.e. 'SENSOR_BME680_DATA'.
+            column (:obj:`str`): Column to aggregate, i.e. 'temperature'. For the sensor table,
+                'fancoil_running' with the 'duty' aggregation gives the fancoil duty fraction.
+            bucket (object): Either 'minute', 'hour', 'day' or a bucket length in seconds.
+            agg (:obj:`str`, optional): Either 'min', 'max', 'sum', 'count', 'mean' or 'duty'.
+                Defaults to 'mean'.
+            start (:obj:`datetime`, optional): Only buckets at or after this timestamp.
+            end (:obj:`datetime`, optional): Only buckets before this timestamp.
+
+        Yields:
+            :obj:`tuple`: The bucket start as a datetime object and the aggregated value.
+        '''
+        gran = bucket.upper() if isinstance(bucket, str) else None
+        if gran is not None and gran not in GRANULARITIES:
+            raise ValueError('unknown bucket {}'.format(bucket))
+
+        if gran is not None and table in SOURCES:
+            prefix, cols, fan_idx = SOURCES[table]
+            rolled_up = [c for c, _ in cols]
+            if column in rolled_up and agg in ROLLUP_AGGS:
+                expr = ROLLUP_AGGS[agg].format(column)
+                cond = '{}_count > 0'.format(column)
+            elif column == 'fancoil_running' and fan_idx is not None and agg == 'duty':
+                expr = 'fan_on_secs / covered_secs'
+                cond = 'covered_secs > 0'
+            else:
+                expr = None
+
+            if expr is not None:
+                yield from self.resample_rollup(prefix + '_ROLLUP_' + gran, expr, cond, gran,
+                                                start, end)
+                return
+
+        yield from self.resample_raw(table, column, gran or bucket, agg, start, end)
+
+    def resample_rollup(self, rollup, expr, cond, gran, start, end):
+        '''Helper method to stream pre-aggregated buckets out of a rollup table.
+
+        Args:
+            rollup (:obj:`str`): Rollup table name.
+            expr (:obj:`str`): SQL expression of the aggregated value.
+            cond (:obj:`str`): SQL condition for buckets holding a value.
+            gran (:obj:`str`): Rollup granularity.
+            start (:obj:`datetime`): Only buckets at or after this timestamp, or None.
+            end (:obj:`datetime`): Only buckets before this timestamp, or None.
+
+        Yields:
+            :obj:`tuple`: The bucket start as a datetime object and the aggregated value.
+        '''
+        conds = [cond]
+        params = []
+        if start is not None:
+            conds.append('bucket >= ?')
+            params.append(bucket_start(start, gran))
+        if end is not None:
+            conds.append('bucket < ?')
+            params.append(end)
+
+        sql = 'SELECT bucket, {} FROM {} WHERE {} ORDER BY bucket'.format(expr, rollup,
+                                                                        ' AND '.join(conds))
+        conn = sqlite3.connect(self.dbase_path)
+        try:
+            for bkt, value in self.fetch(conn.execute(sql, params)):
+                yield (datetime.fromisoformat(bkt), value)
+        finally:
+            conn.close()
+
+    def resample_raw(self, table, column, bucket, agg, start, end):
+        '''Helper method to aggregate raw rows in time buckets while they are streamed, keeping a
+        single bucket in memory. Sensor rows are rebuilt at regular steps first when possible.
+
+        Args:
+            table (:obj:`str`): Raw table name.
+            column (:obj:`str`): Column to aggregate.
+            bucket (object): Either a rollup granularity or a bucket length in seconds.
+            agg (:obj:`str`): Either 'min', 'max', 'sum', 'count' or 'mean'.
+            start (:obj:`datetime`): Only rows at or after this timestamp, or None.
+            end (:obj:`datetime`): Only rows before this timestamp, or None.
+
+        Yields:
+            :obj:`tuple`: The bucket start as a datetime object and the aggregated value.
+        '''
+        if agg not in ROLLUP_AGGS:
+            raise ValueError('unsupported aggregation {} for raw rows'.format(agg))
+
+        idx = TABLES[table].index(column)
+        if bucket in GRANULARITIES:
+            get_bucket = lambda tstamp: bucket_start(tstamp, bucket)
+        else:
+            secs = int(bucket)
+            get_bucket = lambda tstamp: datetime.fromtimestamp(tstamp.timestamp() // secs * secs)
+
+        current = None
+        values = []
+        for row in self.interpolate(table, start, end):
+            bkt = get_bucket(row[0])
+            if bkt != current:
+                if values:
+                    yield (current, aggregate(values, agg))
+                current = bkt
+                values = []
+
+            val = to_number(row[idx])
+            if val is not None:
+                values.append(val)
+
+        if values:
+            yield (current, aggregate(values, agg))
+
+def aggregate(values, agg):
+    '''Helper method to aggregate the values of a bucket.
+
+    Args:
+        values (:obj:`list`): Numeric values of the bucket.
+        agg (:obj:`str`): Either 'min', 'max', 'sum', 'count' or 'mean'.
+
+    Returns:
+        float: The aggregated value.
+    '''
+    if agg == 'min':
+        return min(values)
+    if agg == 'max':
+        return max(values)
+    if agg == 'sum':
+        return sum(values)
+    if agg == 'count':
+        return len(values)
+    return sum(values) / len(values)
@@ -0,0 +1,342 @@
+import os
+import csv
+import gzip
+import json
+import sqlite3
+import time
+import traceback
+from datetime import datetime, timedelta
+from .storage import StorageCodec
+
+# Raw tables whose old rows are moved to the archive.
+ARCHIVED_TABLES = ('SENSOR_BME680_DATA', 'YR_WEATHER_API_DATA')
+
+def parse_value(value):
+    '''Helper method to restore the type of a value read back from a CSV archive.
+
+    Args:
+        value (:obj:`str`): The CSV field.
+
+    Returns:
+        object: None for empty fields, an int or float for numeric fields, or the string itself.
+    '''
+    if value == '':
+        return None
+    for cast in (int, float):
+        try:
+            return cast(value)
+        except ValueError:
+            pass
+    return value
+
+class RetentionManager():
+    '''Serves as the class that keeps the raw sensor and weather tables small. Rows older than the
+    retention period are moved, in small chunks, to gzip'd CSV files with one file per table and
+    month. Rollup tables are left untouched.
+
+    Every archive file has a watermark next to it with its size and newest timestamp as of the
+    last chunk deleted from the DB. Rows appended past the watermark belong to a chunk that may
+    not have been deleted yet (crash or DB error in between): they are dropped from the file if
+    they're still in the DB, so archiving the chunk again never duplicates them, and readers
+    skip them meanwhile.'''
+
+    def __init__(self, dbase_path, archive_dir = None, keep_days = 90, chunk_size = 500,
+                 interval = 3600, pause = 0.5, enabled = False):
+        '''The module is intented to be a secondary thread of the base class SmartCoil.
+
+        Args:
+            dbase_path (:obj:`str`): Path to the SQLite database.
+            archive_dir (:obj:`str`, optional): Directory for the archive files. Defaults to
+                '/assets/db/archive'.
+            keep_days (int, optional): Days of raw rows kept in the DB. Defaults to 90.
+            chunk_size (int, optional): Max rows moved per transaction, keeping every write lock
+                short. Defaults to 500.
+            interval (int, optional): Seconds between archiving passes. Defaults to 1 hour.
+            pause (float, optional): Seconds to sleep between chunks, so the DB writer can take
+                the write lock. Defaults to 0.5.
+            enabled (bool, optional): Whether the archiving thread should run. Defaults to False.
+        '''
+        if archive_dir is None:
+            dirname = os.path.dirname(__file__)
+            archive_dir = os.path.join(dirname, '../../assets/db/archive')
+
+        self.dbase_path = dbase_path
+        self.archive_dir = archive_dir
+        self.keep_days = keep_days
+        self.chunk_size = chunk_size
+        self.interval = interval
+        self.pause = pause
+        self.enabled = enabled
+
+        self.rows_archived = 0
+        self.last_run = None
+
+    def archive_path(self, table, month):
+        '''Gets the path of the archive file for a table and month.
+
+        Args:
+            table (:obj:`str`): Raw table name.
+            month (:obj:`str`): Month formatted as 'YYYY-MM'.
+
+        Returns:
+            :obj:`str`: Path to the gzip'd CSV file.
+        '''
+        return os.path.join(self.archive_dir, '{}_{}.csv.gz'.format(table, month))
+
+    def read_mark(self, path):
+        '''Helper method to get the watermark of an archive file.
+
+        Args:
+            path (:obj:`str`): Path to the archive file.
+
+        Returns:
+            :obj:`tuple`: Size in bytes and newest timestamp (None if there are no rows yet) of
+            the rows known to be deleted from the DB, or None if the file has no watermark.
+        '''
+        try:
+            with open(path + '.mark', 'r') as f:
+                mark = json.load(f)
+        except FileNotFoundError:
+            return None
+
+        through = mark['through']
+        return (mark['size'], None if through is None else datetime.fromisoformat(through))
+
+    def write_mark(self, path, through):
+        '''Helper method to set the watermark of an archive file to its current size.
+
+        Args:
+            path (:obj:`str`): Path to the archive file.
+            through (:obj:`datetime`): Newest timestamp archived in the file, or None.
+        '''
+        tmp = path + '.mark.tmp'
+        with open(tmp, 'w') as f:
+            json.dump({'size': os.path.getsize(path),
+                       'through': None if through is None else str(through)}, f)
+        os.replace(tmp, path + '.mark')
+
+    def read_rows(self, path, offset = 0):
+        '''Helper method to stream the rows of an archive file, with their raw fields.
+
+        Args:
+            path (:obj:`str`): Path to the archive file.
+            offset (int, optional): Byte offset to start reading at, the start of a gzip member.
+                Defaults to 0, skipping the header.
+
+        Yields:
+            :obj:`list`: The CSV fields of every row.
+        '''
+        with open(path, 'rb') as raw:
+            raw.seek(offset)
+            with gzip.open(raw, 'rt', newline='') as f:
+                reader = csv.reader(f)
+                if offset == 0:
+                    next(reader, None)
+                yield from reader
+
+    def recover(self, conn, codec, table, path):
+        '''Helper method to settle rows appended to an archive file past its watermark, before
+        appending more. If they're still in the DB their chunk was never deleted and they're
+        truncated away, otherwise the watermark is moved past them. Files archived before
+        watermarks existed get one as they are.
+
+        Args:
+            conn (:obj:`Connection`): Open connection to the database.
+            codec (:obj:`StorageCodec`): Codec matching the DB storage format.
+            table (:obj:`str`): Raw table name.
+            path (:obj:`str`): Path to the archive file.
+
+        Returns:
+            :obj:`datetime`: Newest timestamp archived in the file, or None.
+        '''
+        mark = self.read_mark(path)
+        size = os.path.getsize(path)
+        if mark is not None and mark[0] == size:
+            return mark[1]
+
+        offset, through = (0, None) if mark is None else mark
+        try:
+            tail = [datetime.fromisoformat(r[0]) for r in self.read_rows(path, offset)]
+            pending = mark is not None and len(tail) > 0 and conn.execute(
+                'SELECT 1 FROM {} WHERE timestamp = ?'.format(table),
+                [codec.encode_time(tail[0])]).fetchone() is not None
+        except (OSError, EOFError, ValueError):
+            # a chunk only partly written, it was never deleted.
+            pending = True
+
+        if pending:
+            with open(path, 'r+b') as f:
+                f.truncate(offset)
+        elif tail:
+            through = max(tail) if through is None else max([through] + tail)
+        self.write_mark(path, through)
+        return through
+
+    def write_chunk(self, conn, codec, table, header, rows):
+        '''Helper method to append rows to their monthly archive files. Every append is written as
+        a new gzip member, which gzip readers transparently concatenate.
+
+        Args:
+            conn (:obj:`Connection`): Open connection to the database.
+            codec (:obj:`StorageCodec`): Codec matching the DB storage format.
+            table (:obj:`str`): Raw table name.
+            header (:obj:`list`): Column names of the table.
+            rows (:obj:`list`): Rows to archive, sorted by timestamp.
+
+        Returns:
+            :obj:`dict`: Newest timestamp per archive file written, to set their watermarks to
+            once the rows are deleted from the DB.
+        '''
+        months = {}
+        for row in rows:
+            months.setdefault(str(row[0])[:7], []).append(row)
+
+        marks = {}
+        for month, month_rows in months.items():
+            path = self.archive_path(table, month)
+            if os.path.exists(path):
+                through = self.recover(conn, codec, table, path)
+            else:
+                through = None
+                with gzip.open(path, 'wt', newline='') as f:
+                    csv.writer(f).writerow(header)
+                self.write_mark(path, None)
+
+            with gzip.open(path, 'at', newline='') as f:
+                csv.writer(f).writerows(month_rows)
+            newest = month_rows[-1][0]
+            marks[path] = newest if through is None else max(through, newest)
+
+        return marks
+
+    def archive_table(self, conn, table, cutoff, exit_evt = None):
+        '''Moves rows older than a cutoff from a table into the archive, one chunk per
+        transaction. Each chunk is written to disk before being deleted from the DB, and the
+        watermarks of its files are moved once it's deleted.
+
+        Args:
+            conn (:obj:`Connection`): Open connection to the database.
+            table (:obj:`str`): Raw table name.
+            cutoff (:obj:`datetime`): Rows with an older timestamp are archived.
+            exit_evt (:obj:`Event`, optional): Event flag to stop in between chunks.
+
+        Returns:
+            int: The number of rows archived.
+        '''
+        sleep_func = time.sleep if exit_evt == None else exit_evt.wait
+        codec = StorageCodec.load(conn)
+        key = codec.key_column()
+        sql = 'SELECT {}, * FROM {} WHERE timestamp < ? ORDER BY timestamp LIMIT ?'.format(key,
+                                                                                         table)
+        moved = 0
+
+        while True if exit_evt == None else not exit_evt.is_set():
+            crsr = conn.execute(sql, [codec.encode_time(cutoff), self.chunk_size])
+            header = [d[0] for d in crsr.description][1:]
+            rows = crsr.fetchall()
+            if not rows:
+                break
+
+            # archives are always written in v1 format, whatever the DB storage format is.
+            marks = self.write_chunk(conn, codec, table, header,
+                                     [codec.decode_row(conn, table, r[1:]) for r in rows])
+            conn.executemany('DELETE FROM {} WHERE {} = ?'.format(table, key),
+                             [(r[0],) for r in rows])
+            conn.commit()
+            for path, through in marks.items():
+                self.write_mark(path, through)
+
+            moved += len(rows)
+            sleep_func(self.pause)
+
+        return moved
+
+    def run_once(self, exit_evt = None):
+        '''Performs a single archiving pass over every raw table, first settling the archive
+        files left past their watermark by an interrupted pass.
+
+        Args:
+            exit_evt (:obj:`Event`, optional): Event flag to stop in between chunks.
+
+        Returns:
+            :obj:`dict`: Number of rows archived per table.
+        '''
+        os.makedirs(self.archive_dir, exist_ok=True)
+        cutoff = datetime.now() - timedelta(days=self.keep_days)
+        moved = {}
+
+        with sqlite3.connect(self.dbase_path, timeout=30) as conn:
+            codec = StorageCodec.load(conn)
+            for fname in sorted(os.listdir(self.archive_dir)):
+                table = fname.rsplit('_', 1)[0]
+                if table in ARCHIVED_TABLES and fname.endswith('.csv.gz'):
+                    self.recover(conn, codec, table, os.path.join(self.archive_dir, fname))
+
+            for table in ARCHIVED_TABLES:
+                moved[table] = self.archive_table(conn, table, cutoff, exit_evt)
+                self.rows_archived += moved[table]
+
+        self.last_run = datetime.now()
+        return moved
+
+    def run(self, exit_evt = None):
+        '''The main loop that periodically archives old rows.
+
+        Args:
+            exit_evt (:obj:`Event`, optional): Event flag to manage thread cleaning before exiting
+                the full app.
+        '''
+        sleep_func = time.sleep if exit_evt == None else exit_evt.wait
+
+        while True if exit_evt == None else not exit_evt.is_set():
+            try:
+                moved = self.run_once(exit_evt)
+                if any(moved.values()):
+                    print('archived old rows: {}'.format(moved))
+            except Exception as e:
+                print('Exception at RetentionManager.run')
+                print(type(e))
+                print(e)
+                traceback.print_tb(e.__traceback__)
+
+            sleep_func(self.interval)
+
+    def read_archive(self, table, start = None, end = None):
+        '''Streams archived rows of a table back, one row at a time and in timestamp order. Rows
+        past the watermark of their file are left out, they're still in the DB.
+
+        Args:
+            table (:obj:`str`): Raw table name.
+            start (:obj:`datetime`, optional): Only rows at or after this timestamp.
+            end (:obj:`datetime`, optional): Only rows before this timestamp.
+
+        Yields:
+            :obj:`list`: An archived row, with the timestamp as a datetime object.
+        '''
+        if not os.path.isdir(self.archive_dir):
+            return
+
+        prefix = table + '_'
+        first = None if start is None else start.strftime('%Y-%m')
+        last = None if end is None else end.strftime('%Y-%m')
+
+        for fname in sorted(os.listdir(self.archive_dir)):
+            if not (fname.startswith(prefix) and fname.endswith('.csv.gz')):
+                continue
+
+            month = fname[len(prefix):-len('.csv.gz')]
+            if (first is not None and month < first) or (last is not None and month > last):
+                continue
+
+            path = os.path.join(self.archive_dir, fname)
+            mark = self.read_mark(path)
+            if mark is not None and mark[1] is None:
+                continue
+
+            for row in self.read_rows(path):
+                tstamp = datetime.fromisoformat(row[0])
+                if mark is not None and tstamp > mark[1]:
+                    continue
+                if (start is not None and tstamp < start) or (end is not None and tstamp >= end):
+                    continue
+                yield [tstamp] + [parse_value(v) for v in row[1:]]
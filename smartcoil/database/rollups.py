@@ -0,0 +1,282 @@
+import sqlite3
+from datetime import datetime, timedelta
+from .storage import StorageCodec
+
+# Rollup granularities and the length of their buckets.
+GRANULARITIES = {
+    'MINUTE': timedelta(minutes=1),
+    'HOUR': timedelta(hours=1),
+    'DAY': timedelta(days=1),
+}
+
+# Raw tables being rolled up: rollup tables prefix, position of each aggregated column in the
+# raw row, and position of the fancoil_running column (if any).
+SOURCES = {
+    'SENSOR_BME680_DATA': ('SENSOR', [('temperature', 1), ('humidity', 2), ('pressure', 3),
+                                      ('gas_resistance', 4), ('air_quality', 5)], 6),
+    'YR_WEATHER_API_DATA': ('WEATHER', [('temperature', 3), ('humidity', 4), ('pressure', 5),
+                                        ('wind_speed', 8), ('precipitation', 11)], None),
+}
+
+def bucket_start(tstamp, granularity):
+    '''Helper method to get the start of the bucket a timestamp falls into.
+
+    Args:
+        tstamp (:obj:`datetime`): The timestamp to place in a bucket.
+        granularity (:obj:`str`): Either 'MINUTE', 'HOUR' or 'DAY'.
+
+    Returns:
+        :obj:`datetime`: The timestamp truncated to the start of its bucket.
+    '''
+    if granularity == 'MINUTE':
+        return tstamp.replace(second=0, microsecond=0)
+    if granularity == 'HOUR':
+        return tstamp.replace(minute=0, second=0, microsecond=0)
+    return tstamp.replace(hour=0, minute=0, second=0, microsecond=0)
+
+def to_number(value):
+    '''Helper method to get a numeric reading, non numeric placeholders such as the '-' used for
+    air quality while the sensor primes are treated as missing.
+
+    Args:
+        value (object): The raw value stored in the DB.
+
+    Returns:
+        float: The numeric value, or None if it is missing.
+    '''
+    if value is None or isinstance(value, str):
+        return None
+    return float(value)
+
+class RollupManager():
+    '''Serves as the class that keeps the minute, hour and day rollup tables of sensor and weather
+    readings. Rollups are updated incrementally, row by row, as the DB writer commits raw rows.'''
+
+    def __init__(self, max_gap = 600):
+        '''The fancoil duty fraction is time weighted: the time between two consecutive sensor
+        rows is credited to the fancoil state of the first one.
+
+        Args:
+            max_gap (int, optional): Max seconds between two sensor rows to be credited to the
+                duty fraction. Longer gaps are most likely periods where the app was down.
+                Defaults to 10 minutes.
+        '''
+        self.max_gap = timedelta(seconds=max_gap)
+        self.sql = {}
+        for table, (prefix, cols, fan_idx) in SOURCES.items():
+            for gran in GRANULARITIES:
+                self.sql[(table, gran)] = self.build_upsert(prefix + '_ROLLUP_' + gran, cols)
+                if fan_idx is not None:
+                    self.sql[(table, gran, 'FAN')] = self.build_fan_upsert(prefix + '_ROLLUP_'
+                                                                           + gran)
+
+        # last (timestamp, fancoil_running) seen, to credit the fancoil duty time, and the one
+        # seen when the writer last committed, restored if its batch is rolled back.
+        self.last_fan_state = None
+        self.committed_fan_state = None
+
+    def build_upsert(self, rollup, cols):
+        '''Helper method to build the statement that merges one reading into a rollup bucket.
+
+        Args:
+            rollup (:obj:`str`): Rollup table name.
+            cols (:obj:`list`): Tuples of (column name, raw row position) being aggregated.
+
+        Returns:
+            :obj:`str`: The SQL upsert statement. Its parameters are the bucket followed by the
+                min, max, sum and count of every column.
+        '''
+        names = ['bucket', 'samples']
+        updates = ['samples = samples + 1']
+        for c, _ in cols:
+            names += [c + '_min', c + '_max', c + '_sum', c + '_count']
+            updates += [
+                '{0}_min = coalesce(min({0}_min, excluded.{0}_min), {0}_min, excluded.{0}_min)'
+                    .format(c),
+                '{0}_max = coalesce(max({0}_max, excluded.{0}_max), {0}_max, excluded.{0}_max)'
+                    .format(c),
+                '{0}_sum = coalesce({0}_sum, 0) + excluded.{0}_sum'.format(c),
+                '{0}_count = coalesce({0}_count, 0) + excluded.{0}_count'.format(c),
+            ]
+
+        return ('INSERT INTO {} ({}) VALUES (?, 1, {}) ON CONFLICT(bucket) DO UPDATE SET {}'
+                .format(rollup, ', '.join(names), ', '.join(['?'] * (len(names) - 2)),
+                        ', '.join(updates)))
+
+    def build_fan_upsert(self, rollup):
+        '''Helper method to build the statement that credits fancoil time to a rollup bucket.
+
+        Args:
+            rollup (:obj:`str`): Rollup table name.
+
+        Returns:
+            :obj:`str`: The SQL upsert statement, with bucket, fancoil on seconds and covered
+                seconds as parameters.
+        '''
+        return ('INSERT INTO {} (bucket, samples, fan_on_secs, covered_secs) VALUES (?, 0, ?, ?) '
+                + 'ON CONFLICT(bucket) DO UPDATE SET '
+                + 'fan_on_secs = coalesce(fan_on_secs, 0) + excluded.fan_on_secs, '
+                + 'covered_secs = coalesce(covered_secs, 0) + excluded.covered_secs'
+                ).format(rollup)
+
+    def update(self, crsr, table, row):
+        '''Merges a raw row into the minute, hour and day rollups of its table. Meant to be used as
+        a DB writer hook, so it runs within the same transaction as the insert.
+
+        Args:
+            crsr (:obj:`Cursor`): Cursor of the connection the raw row was inserted with.
+            table (:obj:`str`): Raw table name, either 'SENSOR_BME680_DATA' or
+                'YR_WEATHER_API_DATA'.
+            row (:obj:`list`): The raw row, in table column order.
+        '''
+        _, cols, fan_idx = SOURCES[table]
+        tstamp = row[0]
+        if isinstance(tstamp, str):
+            tstamp = datetime.fromisoformat(tstamp)
+
+        values = []
+        for _, idx in cols:
+            val = to_number(row[idx])
+            if val is None:
+                values += [None, None, 0, 0]
+            else:
+                values += [val, val, val, 1]
+
+        for gran in GRANULARITIES:
+            crsr.execute(self.sql[(table, gran)], [bucket_start(tstamp, gran)] + values)
+
+        if fan_idx is not None:
+            self.credit_fan_time(crsr, table, tstamp, int(row[fan_idx] or 0))
+
+    def credit_fan_time(self, crsr, table, tstamp, fan_running):
+        '''Helper method to credit the time elapsed since the previous sensor row to the fancoil
+        duty of every bucket it spans.
+
+        Args:
+            crsr (:obj:`Cursor`): Cursor of the connection the raw row was inserted with.
+            table (:obj:`str`): Raw table name.
+            tstamp (:obj:`datetime`): Timestamp of the new row.
+            fan_running (int): Whether the fancoil was running at the new row.
+        '''
+        prev = self.last_fan_state
+        self.last_fan_state = (tstamp, fan_running)
+
+        if prev is None or tstamp <= prev[0] or tstamp - prev[0] > self.max_gap:
+            return
+
+        for gran, length in GRANULARITIES.items():
+            start = prev[0]
+            while start < tstamp:
+                end = min(bucket_start(start, gran) + length, tstamp)
+                secs = (end - start).total_seconds()
+                crsr.execute(self.sql[(table, gran, 'FAN')],
+                             [bucket_start(start, gran), secs * prev[1], secs])
+                start = end
+
+    def commit(self):
+        '''Keeps the fancoil state seen so far. Meant to be used as a DB writer transaction hook.
+        '''
+        self.committed_fan_state = self.last_fan_state
+
+    def rollback(self):
+        '''Forgets the fancoil state seen since the last commit, the rows will be merged again
+        when the writer retries them. Meant to be used as a DB writer transaction hook.
+        '''
+        self.last_fan_state = self.committed_fan_state
+
+    def hook_for(self, table):
+        '''Gets a DB writer hook that updates the rollups of a given raw table.
+
+        Args:
+            table (:obj:`str`): Raw table name.
+
+        Returns:
+            :obj:`function`: Method receiving the writer cursor and the inserted row.
+        '''
+        return lambda crsr, row: self.update(crsr, table, row)
+
+    def rebuild(self, dbase_path, chunk_size = 5000):
+        '''Recomputes the rollup tables from the raw rows already stored in the DB. Useful for
+        databases created before rollups existed, or after rows were imported or restored.
+        Rollups older than the raw rows, whose raw rows were moved to the archive by retention,
+        are kept: only the days fully covered by raw rows are recomputed.
+
+        Args:
+            dbase_path (:obj:`str`): Path to the SQLite database.
+            chunk_size (int, optional): Number of raw rows processed per transaction, so the
+                DB writer is never locked out for long. Defaults to 5000.
+
+        Returns:
+            :obj:`dict`: Number of raw rows processed per table.
+        '''
+        processed = {}
+        with sqlite3.connect(dbase_path) as conn:
+            codec = StorageCodec.load(conn)
+            read = conn.cursor()
+            write = conn.cursor()
+            for table, (prefix, _, fan_idx) in SOURCES.items():
+                processed[table] = 0
+                self.last_fan_state = None
+                since = self.rebuild_start(conn, codec, table, prefix)
+                if since is False:
+                    continue
+
+                if since is None:
+                    for gran in GRANULARITIES:
+                        write.execute('DELETE FROM {}_ROLLUP_{}'.format(prefix, gran))
+                    read.execute('SELECT * FROM {} ORDER BY timestamp'.format(table))
+                else:
+                    for gran in GRANULARITIES:
+                        write.execute('DELETE FROM {}_ROLLUP_{} WHERE bucket >= ?'
+                                      .format(prefix, gran), (since,))
+                    if fan_idx is not None:
+                        # time between the last row kept and the first one recomputed.
+                        prev = read.execute('SELECT * FROM {} WHERE timestamp < ? '
+                                            'ORDER BY timestamp DESC LIMIT 1'.format(table),
+                                            (codec.encode_time(since),)).fetchone()
+                        if prev is not None:
+                            prev = codec.decode_row(conn, table, prev)
+                            self.last_fan_state = (prev[0], int(prev[fan_idx] or 0))
+                    read.execute('SELECT * FROM {} WHERE timestamp >= ? ORDER BY timestamp'
+                                 .format(table), (codec.encode_time(since),))
+
+                rows = read.fetchmany(chunk_size)
+                while rows:
+                    for row in rows:
+                        self.update(write, table, codec.decode_row(conn, table, row))
+                    conn.commit()
+                    processed[table] += len(rows)
+                    rows = read.fetchmany(chunk_size)
+
+            self.last_fan_state = None
+            self.committed_fan_state = None
+
+        return processed
+
+    def rebuild_start(self, conn, codec, table, prefix):
+        '''Helper method to get where the rollups of a raw table can be recomputed from.
+
+        Args:
+            conn (:obj:`Connection`): Connection to the SQLite database.
+            codec (:obj:`StorageCodec`): Codec matching the DB storage format.
+            table (:obj:`str`): Raw table name.
+            prefix (:obj:`str`): Prefix of its rollup tables.
+
+        Returns:
+            object: None to recompute every rollup, the start of the first day fully covered by
+            raw rows if older rollups were made out of rows archived since, or False if there
+            are no raw rows left to recompute from.
+        '''
+        first = conn.execute('SELECT timestamp FROM {} ORDER BY timestamp LIMIT 1'
+                             .format(table)).fetchone()
+        if first is None:
+            return False
+
+        first = codec.decode_time(first[0])
+        oldest = conn.execute('SELECT min(bucket) FROM {}_ROLLUP_MINUTE'.format(prefix)).fetchone()
+        if oldest[0] is None or datetime.fromisoformat(str(oldest[0])) >= bucket_start(first,
+                                                                                      'MINUTE'):
+            return None
+
+        since = bucket_start(first, 'DAY')
+        return since if since == first else since + GRANULARITIES['DAY']
@@ -0,0 +1,238 @@
+import sqlite3
+from datetime import datetime
+from .storage import StorageCodec
+
+# Runs overlapping a [start, end) window, open runs being counted up to now. Runs never overlap,
+# so they are found with a start_time range scan from the last run started before the window.
+WINDOW_RUNS = ('WITH runs AS ('
+               + 'SELECT start_time, coalesce(end_time, :now) AS end_time, speed, continued '
+               + 'FROM FANCOIL_RUNS WHERE start_time >= coalesce((SELECT max(start_time) '
+               + 'FROM FANCOIL_RUNS WHERE start_time <= :start), :start) '
+               + 'AND start_time < :end AND coalesce(end_time, :now) > :start) ')
+
+WINDOW_STATS = (WINDOW_RUNS
+                + 'SELECT coalesce(sum((julianday(min(end_time, :end)) '
+                + '- julianday(max(start_time, :start))) * 86400), 0), '
+                + 'coalesce(sum(continued = 0), 0), '
+                + '(SELECT continued FROM runs ORDER BY start_time LIMIT 1) FROM runs')
+
+WINDOW_SPEEDS = (WINDOW_RUNS
+                 + 'SELECT speed, sum((julianday(min(end_time, :end)) '
+                 + '- julianday(max(start_time, :start))) * 86400) FROM runs GROUP BY speed')
+
+class FancoilRuns():
+    '''Serves as the class that keeps the FANCOIL_RUNS interval table, one row per stretch of time
+    the fancoil ran at a constant speed. Rows are opened and closed by the control path as the
+    relays change, so runtime and cycle questions are answered from a few indexed rows instead of
+    scanning every sensor row.'''
+
+    def __init__(self, dbase_path, submit = None):
+        '''Args:
+            dbase_path (:obj:`str`): Path to the SQLite database.
+            submit (callable, optional): Function queuing a (sql, params) statement to the DB
+                writer. Defaults to None, only allowing queries.
+        '''
+        self.dbase_path = dbase_path
+        self.submit = submit
+        # start time and speed of the open run, if any.
+        self.current = None
+
+    def started(self, speed, mode, tstamp = None):
+        '''Records that the relays started the fancoil, or changed its speed while running.
+
+        Args:
+            speed (int): Fan speed.
+            mode (:obj:`str`): Either 'COOL' or 'HEAT'.
+            tstamp (:obj:`datetime`, optional): Time of the change. Defaults to now.
+        '''
+        if tstamp is None:
+            tstamp = datetime.now()
+
+        continued = 0
+        if self.current is not None:
+            if self.current[1] == speed:
+                return
+            # a speed change closes the current run, the new one continues the same cycle.
+            self.stopped(tstamp)
+            continued = 1
+
+        self.submit('INSERT INTO FANCOIL_RUNS (start_time, end_time, speed, mode, continued) '
+                    + 'VALUES (?, NULL, ?, ?, ?)', [tstamp, speed, mode, continued])
+        self.current = (tstamp, speed)
+
+    def stopped(self, tstamp = None):
+        '''Records that the relays stopped the fancoil, closing the open run.
+
+        Args:
+            tstamp (:obj:`datetime`, optional): Time of the change. Defaults to now.
+        '''
+        if self.current is None:
+            return
+        if tstamp is None:
+            tstamp = datetime.now()
+
+        self.submit('UPDATE FANCOIL_RUNS SET end_time = ? WHERE start_time = ?',
+                    [tstamp, self.current[0]])
+        self.current = None
+
+    def recover(self):
+        '''Closes runs left open by an app that didn't exit cleanly, at the last sensor row
+        written after them. Use it at startup, before the DB writer starts.
+
+        Returns:
+            int: The number of runs closed.
+        '''
+        with sqlite3.connect(self.dbase_path) as conn:
+            codec = StorageCodec.load(conn)
+            open_runs = conn.execute('SELECT start_time FROM FANCOIL_RUNS '
+                                     + 'WHERE end_time IS NULL').fetchall()
+            for start_time, in open_runs:
+                start = datetime.fromisoformat(start_time)
+                last, = conn.execute('SELECT max(timestamp) FROM SENSOR_BME680_DATA '
+                                     + 'WHERE timestamp > ?',
+                                     [codec.encode_time(start)]).fetchone()
+                end = start if last is None else codec.decode_time(last)
+                conn.execute('UPDATE FANCOIL_RUNS SET end_time = ? WHERE start_time = ?',
+                             [end, start_time])
+        return len(open_runs)
+
+    def stats(self, start = None, end = None):
+        '''Gets runtime figures over a time window. Runs are clipped to the window, and a cycle
+        already going at the start of the window is counted too.
+
+        Args:
+            start (:obj:`datetime`, optional): Start of the window. Defaults to the first run.
+            end (:obj:`datetime`, optional): End of the window. Defaults to now.
+
+        Returns:
+            :obj:`dict`: Total runtime in seconds, number of cycles and mean cycle length in
+            seconds within the window.
+        '''
+        now = datetime.now()
+        params = {
+            'start': datetime(1970, 1, 1) if start is None else start,
+            'end': now if end is None else end,
+            'now': now,
+        }
+
+        conn = sqlite3.connect(self.dbase_path)
+        try:
+            runtime, cycles, first_continued = conn.execute(WINDOW_STATS, params).fetchone()
+        finally:
+            conn.close()
+
+        if first_continued == 1:
+            cycles += 1
+
+        return {
+            'runtime': round(runtime, 1),
+            'cycles': cycles,
+            'mean_cycle': round(runtime / cycles, 1) if cycles else 0,
+        }
+
+    def runtime_per_speed(self, start = None, end = None):
+        '''Gets the seconds the fancoil ran at each speed within a time window.
+
+        Args:
+            start (:obj:`datetime`, optional): Start of the window. Defaults to the first run.
+            end (:obj:`datetime`, optional): End of the window. Defaults to now.
+
+        Returns:
+            :obj:`dict`: Runtime in seconds per speed, None for runs of unknown speed.
+        '''
+        now = datetime.now()
+        params = {
+            'start': datetime(1970, 1, 1) if start is None else start,
+            'end': now if end is None else end,
+            'now': now,
+        }
+
+        conn = sqlite3.connect(self.dbase_path)
+        try:
+            return dict(conn.execute(WINDOW_SPEEDS, params).fetchall())
+        finally:
+            conn.close()
+
+    def total_runtime(self, start = None, end = None):
+        '''Gets the seconds the fancoil ran within a time window.
+
+        Args:
+            start (:obj:`datetime`, optional): Start of the window. Defaults to the first run.
+            end (:obj:`datetime`, optional): End of the window. Defaults to now.
+
+        Returns:
+            float: Runtime in seconds.
+        '''
+        return self.stats(start, end)['runtime']
+
+    def cycle_count(self, start = None, end = None):
+        '''Gets the number of on/off cycles within a time window. Speed changes while running
+        don't start a new cycle.
+
+        Args:
+            start (:obj:`datetime`, optional): Start of the window. Defaults to the first run.
+            end (:obj:`datetime`, optional): End of the window. Defaults to now.
+
+        Returns:
+            int: Number of cycles.
+        '''
+        return self.stats(start, end)['cycles']
+
+    def mean_cycle_length(self, start = None, end = None):
+        '''Gets the mean length of the cycles within a time window.
+
+        Args:
+            start (:obj:`datetime`, optional): Start of the window. Defaults to the first run.
+            end (:obj:`datetime`, optional): End of the window. Defaults to now.
+
+        Returns:
+            float: Mean cycle length in seconds.
+        '''
+        return self.stats(start, end)['mean_cycle']
+
+    def backfill(self, chunk_size = 5000):
+        '''Derives runs from the fancoil_running column of sensor rows older than the first
+        recorded run, for databases created before runs were tracked. Speed and mode of these runs
+        are unknown. Run it while the app is stopped.
+
+        Args:
+            chunk_size (int, optional): Number of sensor rows read at a time. Defaults to 5000.
+
+        Returns:
+            int: The number of runs added.
+        '''
+        conn = sqlite3.connect(self.dbase_path)
+        try:
+            codec = StorageCodec.load(conn)
+            first, = conn.execute('SELECT min(start_time) FROM FANCOIL_RUNS').fetchone()
+            sql = 'SELECT timestamp, fancoil_running FROM SENSOR_BME680_DATA'
+            params = []
+            if first is not None:
+                sql += ' WHERE timestamp < ?'
+                params.append(codec.encode_time(datetime.fromisoformat(first)))
+
+            crsr = conn.execute(sql + ' ORDER BY timestamp', params)
+            runs = []
+            run_start = last = None
+            rows = crsr.fetchmany(chunk_size)
+            while rows:
+                for tstamp, running in rows:
+                    tstamp = codec.decode_time(tstamp)
+                    if running and run_start is None:
+                        run_start = tstamp
+                    elif not running and run_start is not None:
+                        runs.append([run_start, tstamp])
+                        run_start = None
+                    last = tstamp
+                rows = crsr.fetchmany(chunk_size)
+
+            if run_start is not None:
+                runs.append([run_start, last])
+
+            conn.executemany('INSERT OR IGNORE INTO FANCOIL_RUNS (start_time, end_time) '
+                             + 'VALUES (?, ?)', runs)
+            conn.commit()
+        finally:
+            conn.close()
+
+        return len(runs)
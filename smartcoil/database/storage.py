@@ -0,0 +1,324 @@
+import sqlite3
+import time
+from datetime import datetime
+
+# Storage formats of the raw tables.
+V1 = 'v1'
+V2 = 'v2'
+
+# Columns of every raw table, in insert order.
+TABLES = {
+    'SENSOR_BME680_DATA': ['timestamp', 'temperature', 'humidity', 'pressure', 'gas_resistance',
+                           'air_quality', 'fancoil_running'],
+    'YR_WEATHER_API_DATA': ['timestamp', 'latitude', 'longitude', 'temperature', 'humidity',
+                            'pressure', 'condition', 'condition_code', 'wind_speed',
+                            'wind_direction_name', 'wind_direction_degrees', 'precipitation'],
+    'USER_DATA': ['timestamp', 'temperature', 'speed'],
+    'APP_STATUS': ['timestamp', 'status'],
+}
+
+# v2 fixed-point columns and the factor their values are multiplied by before rounding.
+SCALES = {
+    'SENSOR_BME680_DATA': {'temperature': 100, 'humidity': 100, 'pressure': 100},
+    'YR_WEATHER_API_DATA': {'latitude': 100000, 'longitude': 100000, 'temperature': 100,
+                            'humidity': 100, 'pressure': 100, 'wind_speed': 100,
+                            'wind_direction_degrees': 100, 'precipitation': 100},
+    'USER_DATA': {'temperature': 100},
+}
+
+# v2 columns storing an id from the WEATHER_CODES table instead of a repeated string.
+CODED = {
+    'YR_WEATHER_API_DATA': {'condition': 'condition', 'wind_direction_name': 'wind_direction'},
+}
+
+# v2 tables: epoch milliseconds timestamps as clustered primary key and integer readings.
+V2_TABLES = {
+    'SENSOR_BME680_DATA': ('CREATE TABLE {} (timestamp integer PRIMARY KEY, temperature integer, '
+                           + 'humidity integer, pressure integer, gas_resistance integer, '
+                           + 'air_quality integer, fancoil_running integer) WITHOUT ROWID'),
+    'YR_WEATHER_API_DATA': ('CREATE TABLE {} (timestamp integer PRIMARY KEY, latitude integer, '
+                            + 'longitude integer, temperature integer, humidity integer, '
+                            + 'pressure integer, condition integer, condition_code integer, '
+                            + 'wind_speed integer, wind_direction_name integer, '
+                            + 'wind_direction_degrees integer, precipitation integer) '
+                            + 'WITHOUT ROWID'),
+    'USER_DATA': ('CREATE TABLE {} (timestamp integer PRIMARY KEY, temperature integer, '
+                  + 'speed integer) WITHOUT ROWID'),
+    'APP_STATUS': 'CREATE TABLE {} (timestamp integer PRIMARY KEY, status varchar(3)) WITHOUT ROWID',
+}
+
+def to_epoch_ms(tstamp):
+    '''Helper method to get a local timestamp as epoch milliseconds.
+
+    Args:
+        tstamp (object): Either a datetime object or an ISO formatted string.
+
+    Returns:
+        int: Milliseconds since the epoch.
+    '''
+    if isinstance(tstamp, str):
+        tstamp = datetime.fromisoformat(tstamp)
+    return int(round(tstamp.timestamp() * 1000))
+
+def from_epoch_ms(msecs):
+    '''Helper method to get a local datetime object out of epoch milliseconds.
+
+    Args:
+        msecs (int): Milliseconds since the epoch.
+
+    Returns:
+        :obj:`datetime`: The corresponding local timestamp.
+    '''
+    return datetime.fromtimestamp(msecs / 1000)
+
+def get_storage_format(conn):
+    '''Gets the storage format of the raw tables of a DB.
+
+    Args:
+        conn (:obj:`Connection`): Open connection to the database.
+
+    Returns:
+        :obj:`str`: Either 'v1' or 'v2'.
+    '''
+    try:
+        row = conn.execute("SELECT value FROM DB_META WHERE key = 'storage_format'").fetchone()
+    except sqlite3.OperationalError:
+        row = None
+    return V1 if row is None else row[0]
+
+class StorageCodec():
+    '''Serves as the compatibility layer between the raw tables and the rest of the app. Rows are
+    always handed to and returned by the codec as in the v1 format (datetime timestamps, float
+    readings and plain strings), whatever the format they are stored with.'''
+
+    def __init__(self, fmt = V1):
+        '''Args:
+            fmt (:obj:`str`, optional): Storage format of the DB, either 'v1' or 'v2'.
+                Defaults to 'v1'.
+        '''
+        self.format = fmt
+        # WEATHER_CODES cache, both ways.
+        self.code_ids = {}
+        self.code_names = {}
+
+    @classmethod
+    def load(cls, conn):
+        '''Builds the codec matching the storage format of a DB.
+
+        Args:
+            conn (:obj:`Connection`): Open connection to the database.
+
+        Returns:
+            :obj:`StorageCodec`: The codec for the DB.
+        '''
+        codec = cls(get_storage_format(conn))
+        if codec.format == V2:
+            codec.load_codes(conn)
+        return codec
+
+    def load_codes(self, conn):
+        '''Helper method to cache the WEATHER_CODES table.
+
+        Args:
+            conn (:obj:`Connection`): Open connection to the database.
+        '''
+        for code_id, kind, name in conn.execute('SELECT id, kind, name FROM WEATHER_CODES'):
+            self.code_ids[(kind, name)] = code_id
+            self.code_names[code_id] = name
+
+    def code_for(self, crsr, kind, name):
+        '''Gets the WEATHER_CODES id of a string, adding it to the table if it's a new one.
+
+        Args:
+            crsr (:obj:`Cursor`): Cursor used to add new codes.
+            kind (:obj:`str`): Code family, i.e. 'condition' or 'wind_direction'.
+            name (:obj:`str`): The string to encode.
+
+        Returns:
+            int: The code id, or None for a missing string.
+        '''
+        if name is None:
+            return None
+
+        code_id = self.code_ids.get((kind, name))
+        if code_id is None:
+            crsr.execute('INSERT OR IGNORE INTO WEATHER_CODES (kind, name) VALUES (?, ?)',
+                         [kind, name])
+            code_id, = crsr.execute('SELECT id FROM WEATHER_CODES WHERE kind = ? AND name = ?',
+                                    [kind, name]).fetchone()
+            self.code_ids[(kind, name)] = code_id
+            self.code_names[code_id] = name
+
+        return code_id
+
+    def name_for(self, conn, code_id):
+        '''Gets the string behind a WEATHER_CODES id.
+
+        Args:
+            conn (:obj:`Connection`): Connection used to look up codes not cached yet.
+            code_id (int): The code id.
+
+        Returns:
+            :obj:`str`: The decoded string, or None for a missing code.
+        '''
+        if code_id is None:
+            return None
+
+        if code_id not in self.code_names:
+            self.load_codes(conn)
+        return self.code_names.get(code_id)
+
+    def encode_time(self, tstamp):
+        '''Gets a timestamp the way it is stored, useful for query parameters.
+
+        Args:
+            tstamp (:obj:`datetime`): The timestamp to encode.
+
+        Returns:
+            object: The datetime itself for v1, or epoch milliseconds for v2.
+        '''
+        return tstamp if self.format == V1 else to_epoch_ms(tstamp)
+
+    def decode_time(self, value):
+        '''Gets a stored timestamp as a datetime object.
+
+        Args:
+            value (object): The stored timestamp.
+
+        Returns:
+            :obj:`datetime`: The decoded timestamp.
+        '''
+        if self.format == V2:
+            return from_epoch_ms(value)
+        if isinstance(value, str):
+            return datetime.fromisoformat(value)
+        return value
+
+    def key_column(self):
+        '''Gets the column that uniquely identifies raw rows, needed to delete them one by one.
+
+        Returns:
+            :obj:`str`: 'rowid' for v1, 'timestamp' for v2 (WITHOUT ROWID tables).
+        '''
+        return 'rowid' if self.format == V1 else 'timestamp'
+
+    def encode_row(self, crsr, table, row):
+        '''Gets a v1 formatted row the way it must be stored.
+
+        Args:
+            crsr (:obj:`Cursor`): Cursor used to add new weather codes.
+            table (:obj:`str`): Raw table name.
+            row (:obj:`list`): The row in v1 format.
+
+        Returns:
+            :obj:`list`: The row to be inserted.
+        '''
+        if self.format == V1 or table not in TABLES:
+            return row
+
+        scales = SCALES.get(table, {})
+        coded = CODED.get(table, {})
+        encoded = [to_epoch_ms(row[0])]
+        for col, val in zip(TABLES[table][1:], row[1:]):
+            if col in coded:
+                val = self.code_for(crsr, coded[col], val)
+            elif isinstance(val, str) and table == 'SENSOR_BME680_DATA':
+                # placeholders such as the '-' air quality while the sensor primes.
+                val = None
+            elif col in scales and val is not None:
+                val = int(round(float(val) * scales[col]))
+            elif isinstance(val, float):
+                val = int(round(val))
+            encoded.append(val)
+
+        return encoded
+
+    def decode_row(self, conn, table, row):
+        '''Gets a stored row in v1 format, with its timestamp as a datetime object.
+
+        Args:
+            conn (:obj:`Connection`): Connection used to look up weather codes not cached yet.
+            table (:obj:`str`): Raw table name.
+            row (:obj:`tuple`): The row as stored.
+
+        Returns:
+            :obj:`list`: The row in v1 format.
+        '''
+        if self.format == V1 or table not in TABLES:
+            return [self.decode_time(row[0])] + list(row[1:])
+
+        scales = SCALES.get(table, {})
+        coded = CODED.get(table, {})
+        decoded = [from_epoch_ms(row[0])]
+        for col, val in zip(TABLES[table][1:], row[1:]):
+            if col in coded:
+                val = self.name_for(conn, val)
+            elif col == 'air_quality' and val is None:
+                val = '-'
+            elif col in scales and val is not None:
+                val = val / scales[col]
+            decoded.append(val)
+
+        return decoded
+
+def convert_to_v2(dbase_path, chunk_size = 5000):
+    '''One-shot conversion of a v1 DB into the v2 storage format. Every raw table is copied into
+    its v2 version, the v1 table is dropped and the DB is vacuumed to give the space back. Rows
+    sharing the same millisecond keep the first one, the others are counted and reported. Tables
+    are converted in a single transaction, so an interrupted conversion leaves the DB in v1 and
+    can simply be run again. Run it while the app is stopped.
+
+    Args:
+        dbase_path (:obj:`str`): Path to the SQLite database, already migrated to the latest
+            schema version.
+        chunk_size (int, optional): Number of rows copied at a time. Defaults to 5000.
+
+    Returns:
+        :obj:`dict`: Number of rows converted per table, without the skipped ones, empty if the
+        DB was already in v2.
+    '''
+    converted = {}
+    conn = sqlite3.connect(dbase_path)
+    try:
+        if get_storage_format(conn) == V2:
+            return converted
+
+        codec = StorageCodec(V2)
+        read = conn.cursor()
+        write = conn.cursor()
+        # sqlite3 only opens a transaction on its own before DML, the tables created first would
+        # be committed right away: an interrupted conversion must leave nothing behind.
+        conn.execute('BEGIN')
+        for table, cols in TABLES.items():
+            # left by a conversion interrupted before it was made atomic.
+            write.execute('DROP TABLE IF EXISTS {}_V2'.format(table))
+            write.execute(V2_TABLES[table].format(table + '_V2'))
+            insert = 'INSERT OR IGNORE INTO {}_V2 VALUES ({})'.format(table,
+                                                                     ', '.join(['?'] * len(cols)))
+            converted[table] = 0
+            skipped = 0
+            read.execute('SELECT * FROM {} ORDER BY timestamp'.format(table))
+            rows = read.fetchmany(chunk_size)
+            while rows:
+                write.executemany(insert, [codec.encode_row(write, table, r) for r in rows])
+                converted[table] += write.rowcount
+                skipped += len(rows) - write.rowcount
+                rows = read.fetchmany(chunk_size)
+
+            if skipped:
+                print('{}: {} rows skipped, same millisecond as an earlier row.'.format(table,
+                                                                                       skipped))
+
+            write.execute('DROP TABLE {}'.format(table))
+            write.execute('ALTER TABLE {0}_V2 RENAME TO {0}'.format(table))
+
+        write.execute("UPDATE DB_META SET value = ? WHERE key = 'storage_format'", [V2])
+        conn.commit()
+
+        start = time.time()
+        conn.execute('VACUUM')
+        print('DB vacuumed in {:.1f} seconds.'.format(time.time() - start))
+    finally:
+        conn.close()
+
+    return converted
@@ -0,0 +1,288 @@
+import sqlite3
+import time
+import traceback
+from datetime import date, datetime, timedelta
+from .storage import StorageCodec
+from .runs import FancoilRuns
+
+# DAILY_SUMMARY columns, in table order.
+COLUMNS = ['day', 'indoor_min', 'indoor_max', 'indoor_avg', 'outdoor_min', 'outdoor_max',
+           'outdoor_avg', 'fan_secs_lo', 'fan_secs_mi', 'fan_secs_hi', 'fan_secs_unknown',
+           'setpoint_changes', 'uptime_secs', 'finalized_at']
+
+# Fancoil speeds and their DAILY_SUMMARY column.
+SPEED_COLUMNS = {1: 'fan_secs_lo', 2: 'fan_secs_mi', 3: 'fan_secs_hi', None: 'fan_secs_unknown'}
+
+class DailySummary():
+    '''Serves as the class that keeps the DAILY_SUMMARY table, one comfort and energy row per day.
+    A day is finalized shortly after midnight out of that day's rows only: temperatures come from
+    the day rollups, fancoil time from FANCOIL_RUNS, and setpoint changes and uptime from the few
+    USER_DATA and APP_STATUS rows of the day.'''
+
+    def __init__(self, dbase_path, delay = 300, interval = 600, enabled = True):
+        '''The module is intented to be a secondary thread of the base class SmartCoil.
+
+        Args:
+            dbase_path (:obj:`str`): Path to the SQLite database.
+            delay (int, optional): Seconds to wait after midnight before finalizing the day, so
+                its last rows are committed. Defaults to 5 minutes.
+            interval (int, optional): Seconds between checks for days to finalize. Defaults to
+                10 minutes.
+            enabled (bool, optional): Whether the summary thread should run. Defaults to True.
+        '''
+        self.dbase_path = dbase_path
+        self.delay = delay
+        self.interval = interval
+        self.enabled = enabled
+        self.runs = FancoilRuns(dbase_path)
+
+    def temperatures(self, conn, rollup, start):
+        '''Helper method to get the min, max and mean temperature of a day out of a day rollup.
+
+        Args:
+            conn (:obj:`Connection`): Open connection to the database.
+            rollup (:obj:`str`): Day rollup table name.
+            start (:obj:`datetime`): Start of the day.
+
+        Returns:
+            :obj:`list`: Min, max and mean temperature, None when there were no readings.
+        '''
+        row = conn.execute('SELECT temperature_min, temperature_max, '
+                           + 'temperature_sum / temperature_count FROM {} '.format(rollup)
+                           + 'WHERE bucket = ? AND temperature_count > 0', [start]).fetchone()
+        return [None] * 3 if row is None else list(row)
+
+    def fan_seconds(self, conn, start, end):
+        '''Helper method to get the seconds the fancoil ran per speed during a day. Days older
+        than the first recorded run fall back to the fan time of the sensor day rollup.
+
+        Args:
+            conn (:obj:`Connection`): Open connection to the database.
+            start (:obj:`datetime`): Start of the day.
+            end (:obj:`datetime`): Start of the next day.
+
+        Returns:
+            :obj:`list`: Seconds per speed, following the SPEED_COLUMNS order.
+        '''
+        per_speed = self.runs.runtime_per_speed(start, end)
+        if not per_speed:
+            row = conn.execute('SELECT fan_on_secs FROM SENSOR_ROLLUP_DAY WHERE bucket = ?',
+                               [start]).fetchone()
+            per_speed = {None: row[0] if row is not None and row[0] else 0}
+
+        return [round(per_speed.get(speed) or 0, 1) for speed in SPEED_COLUMNS]
+
+    def status_rows(self, conn, codec, table, start, end):
+        '''Helper method to get the rows of a small table within a day, along with the last row
+        before it and the first row after it.
+
+        Args:
+            conn (:obj:`Connection`): Open connection to the database.
+            codec (:obj:`StorageCodec`): Codec of the DB storage format.
+            table (:obj:`str`): Either 'USER_DATA' or 'APP_STATUS'.
+            start (:obj:`datetime`): Start of the day.
+            end (:obj:`datetime`): Start of the next day.
+
+        Returns:
+            :obj:`tuple`: The previous row (or None), the rows of the day and the next row (or
+            None), in v1 format.
+        '''
+        t0, t1 = codec.encode_time(start), codec.encode_time(end)
+        prev = conn.execute('SELECT * FROM {} WHERE timestamp < ? '.format(table)
+                            + 'ORDER BY timestamp DESC LIMIT 1', [t0]).fetchone()
+        rows = conn.execute('SELECT * FROM {} WHERE timestamp >= ? AND timestamp < ? '
+                            .format(table) + 'ORDER BY timestamp', [t0, t1]).fetchall()
+        nxt = conn.execute('SELECT * FROM {} WHERE timestamp >= ? ORDER BY timestamp LIMIT 1'
+                           .format(table), [t1]).fetchone()
+
+        decode = lambda row: None if row is None else codec.decode_row(conn, table, row)
+        return (decode(prev), [decode(r) for r in rows], decode(nxt))
+
+    def setpoint_changes(self, conn, codec, start, end):
+        '''Helper method to count the target temperature changes of a day.
+
+        Args:
+            conn (:obj:`Connection`): Open connection to the database.
+            codec (:obj:`StorageCodec`): Codec of the DB storage format.
+            start (:obj:`datetime`): Start of the day.
+            end (:obj:`datetime`): Start of the next day.
+
+        Returns:
+            int: Number of changes.
+        '''
+        prev, rows, _ = self.status_rows(conn, codec, 'USER_DATA', start, end)
+        last = None if prev is None else prev[1]
+        changes = 0
+        for row in rows:
+            if last is not None and row[1] != last:
+                changes += 1
+            last = row[1]
+        return changes
+
+    def uptime(self, conn, codec, start, end):
+        '''Helper method to get the seconds the app was up during a day. An 'ON' status followed
+        by another 'ON' means the app didn't exit cleanly, so it's considered up until the last
+        sensor row in between.
+
+        Args:
+            conn (:obj:`Connection`): Open connection to the database.
+            codec (:obj:`StorageCodec`): Codec of the DB storage format.
+            start (:obj:`datetime`): Start of the day.
+            end (:obj:`datetime`): Start of the next day.
+
+        Returns:
+            float: Seconds up.
+        '''
+        prev, rows, nxt = self.status_rows(conn, codec, 'APP_STATUS', start, end)
+        events = [r for r in [prev] + rows + [nxt] if r is not None]
+        secs = 0
+        for i, (tstamp, status) in enumerate(events):
+            if status != 'ON':
+                continue
+
+            following = events[i + 1] if i + 1 < len(events) else None
+            if following is not None and following[1] == 'OFF':
+                up_to = following[0]
+            else:
+                bound = [] if following is None else [codec.encode_time(following[0])]
+                sql = 'SELECT max(timestamp) FROM SENSOR_BME680_DATA WHERE timestamp > ?'
+                last, = conn.execute(sql + ('' if following is None else ' AND timestamp < ?'),
+                                     [codec.encode_time(tstamp)] + bound).fetchone()
+                up_to = tstamp if last is None else codec.decode_time(last)
+
+            secs += max(0, (min(up_to, end) - max(tstamp, start)).total_seconds())
+
+        return round(secs, 1)
+
+    def summarize(self, conn, day):
+        '''Computes the summary row of a day.
+
+        Args:
+            conn (:obj:`Connection`): Open connection to the database.
+            day (:obj:`date`): The day to summarize.
+
+        Returns:
+            :obj:`list`: The row, following the DAILY_SUMMARY columns.
+        '''
+        codec = StorageCodec.load(conn)
+        start = datetime(day.year, day.month, day.day)
+        end = start + timedelta(days=1)
+
+        return ([day.isoformat()]
+                + self.temperatures(conn, 'SENSOR_ROLLUP_DAY', start)
+                + self.temperatures(conn, 'WEATHER_ROLLUP_DAY', start)
+                + self.fan_seconds(conn, start, end)
+                + [self.setpoint_changes(conn, codec, start, end),
+                   self.uptime(conn, codec, start, end),
+                   datetime.now()])
+
+    def finalize(self, days):
+        '''Computes and stores the summary of some days, replacing any previous one.
+
+        Args:
+            days (iterable): The days to summarize, as date objects.
+
+        Returns:
+            int: The number of days stored.
+        '''
+        stored = 0
+        sql = 'INSERT OR REPLACE INTO DAILY_SUMMARY VALUES ({})'.format(', '.join('?'
+                                                                             * len(COLUMNS)))
+        with sqlite3.connect(self.dbase_path, timeout=30) as conn:
+            for day in days:
+                conn.execute(sql, self.summarize(conn, day))
+                conn.commit()
+                stored += 1
+        return stored
+
+    def pending_days(self):
+        '''Gets the finished days not summarized yet: every day after the last summarized one, or
+        only yesterday for a new table. Today is only finished once the delay after midnight
+        passed.
+
+        Returns:
+            :obj:`list`: The days, as date objects.
+        '''
+        last_finished = (datetime.now() - timedelta(seconds=self.delay)).date() - timedelta(days=1)
+        with sqlite3.connect(self.dbase_path) as conn:
+            last, = conn.execute('SELECT max(day) FROM DAILY_SUMMARY').fetchone()
+
+        day = last_finished if last is None else date.fromisoformat(last) + timedelta(days=1)
+        days = []
+        while day <= last_finished:
+            days.append(day)
+            day += timedelta(days=1)
+        return days
+
+    def backfill(self, start = None, end = None):
+        '''Summarizes past days, replacing their previous summary if any.
+
+        Args:
+            start (:obj:`date`, optional): First day. Defaults to the day of the first sensor row.
+            end (:obj:`date`, optional): Last day. Defaults to yesterday.
+
+        Returns:
+            int: The number of days stored.
+        '''
+        if start is None:
+            with sqlite3.connect(self.dbase_path) as conn:
+                codec = StorageCodec.load(conn)
+                first, = conn.execute('SELECT min(timestamp) FROM SENSOR_BME680_DATA').fetchone()
+            if first is None:
+                return 0
+            start = codec.decode_time(first).date()
+        if end is None:
+            end = date.today() - timedelta(days=1)
+
+        return self.finalize(start + timedelta(days=i) for i in range((end - start).days + 1))
+
+    def read(self, start = None, end = None):
+        '''Gets the stored summaries between two days, with a single primary key range scan.
+
+        Args:
+            start (:obj:`date`, optional): First day included.
+            end (:obj:`date`, optional): Last day included.
+
+        Returns:
+            :obj:`list`: One dict per day, keyed by DAILY_SUMMARY column.
+        '''
+        conds = []
+        params = []
+        if start is not None:
+            conds.append('day >= ?')
+            params.append(start.isoformat())
+        if end is not None:
+            conds.append('day <= ?')
+            params.append(end.isoformat())
+
+        where = '' if not conds else ' WHERE ' + ' AND '.join(conds)
+        conn = sqlite3.connect(self.dbase_path)
+        try:
+            rows = conn.execute('SELECT * FROM DAILY_SUMMARY{} ORDER BY day'.format(where),
+                                params).fetchall()
+        finally:
+            conn.close()
+        return [dict(zip(COLUMNS, r)) for r in rows]
+
+    def run(self, exit_evt = None):
+        '''The main loop that finalizes every finished day.
+
+        Args:
+            exit_evt (:obj:`Event`, optional): Event flag to manage thread cleaning before exiting
+                the full app.
+        '''
+        sleep_func = time.sleep if exit_evt == None else exit_evt.wait
+
+        while True if exit_evt == None else not exit_evt.is_set():
+            try:
+                days = self.pending_days()
+                if days:
+                    self.finalize(days)
+                    print('daily summary finalized for {}'.format(days[-1]))
+            except Exception as e:
+                print('Exception at DailySummary.run')
+                print(type(e))
+                print(e)
+                traceback.print_tb(e.__traceback__)
+
+            sleep_func(self.interval)
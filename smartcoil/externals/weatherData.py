@@ -4,11 +4,17 @@ from yr.libyr import Yr
 from datetime import datetime
 import time
 from ..utils import utils
+from ..utils.eventBus import Message, MsgType
+from ..utils.ringBuffer import RingBuffer
+
+# Attributes saved in the state snapshot, enough to show and store the last weather update.
+SNAPSHOT_FIELDS = ('lat', 'lon', 'temperature', 'humidity', 'pressure', 'condition', 'condition_code',
+                   'wind_speed', 'wind_dir_name', 'wind_dir_degs', 'precipitation', 'weather_icon')
 
 class WeatherData:
     '''Serves as the class that periodically fetches information from the norwegian weather API.'''
 
-    def __init__(self, outqueue = None, temp_in_f = True):
+    def __init__(self, outqueue = None, temp_in_f = True, history_hours = 6, snapshot = None):
         '''The module is intented to be a secondary thread of the base class SmartCoil.
         To allow communication between the main thread and this thread, a Queue can be passed
         as an argument.
@@ -17,10 +23,21 @@ class WeatherData:
             outqueue (:obj:`Queue`, optional): Outbound queue to send messages to the main thread.
             temp_in_f (boolean, optional): Whether to transform all temperature values from celcius
                                            to fahrenheit. Defaults to True.
+            history_hours (int, optional): Hours of weather updates kept in memory, one every 5
+                                           minutes. Defaults to 6 hours.
+            snapshot (:obj:`dict`, optional): Values of a previous update, see get_snapshot. When
+                                           given, they are used instead of blocking on the API until
+                                           the next update. Defaults to None.
         '''
         self.outbound_queue = outqueue
         self.temp_in_f = temp_in_f
-        self.update_values()
+        # Most recent weather updates, shared with the GUI, server and control loop.
+        self.recent = RingBuffer(['timestamp', 'temperature', 'humidity', 'pressure', 'wind_speed',
+                                  'precipitation'], history_hours * 12)
+        if snapshot is None:
+            self.update_values()
+        else:
+            self.restore_values(snapshot)
 
     def update_values(self):
         '''Method to get all weather information from the API into this class attributes.
@@ -69,6 +86,26 @@ class WeatherData:
         is_night = 0 if datetime.now().hour < 18 else 1
         self.weather_icon = 'https://api.met.no/weatherapi/weathericon/1.1?content_type=image%2Fpng&is_night={}&symbol={}'.format(is_night, self.condition_code)
 
+        self.recent.append([time.time(), self.temperature, self.humidity, self.pressure,
+                            self.wind_speed, self.precipitation])
+
+    def get_snapshot(self):
+        '''Gets the values of the last update, to be saved in the state snapshot.
+
+        Returns:
+            :obj:`dict`: The value of every attribute in SNAPSHOT_FIELDS.
+        '''
+        return {k: getattr(self, k, None) for k in SNAPSHOT_FIELDS}
+
+    def restore_values(self, values):
+        '''Restores the values of a previous update, as returned by get_snapshot.
+
+        Args:
+            values (:obj:`dict`): The saved values.
+        '''
+        for k in SNAPSHOT_FIELDS:
+            setattr(self, k, values.get(k))
+
     def retry_update_values(self, exit_evt = None):
         '''Helper method that retries getting data from the API and catches any server errors.
 
@@ -151,6 +188,33 @@ Wind is {5:.1f} Km/h {6} and we have an expected precipitation of {6} millimeter
 
         return weather
 
+    def seconds_to_next_update(self, wait_mins = 5):
+        '''Gets the seconds left until the next update slot, slots being multiples of wait_mins
+        minutes.
+
+        Args:
+            wait_mins (int, optional): Minutes between updates. Defaults to 5.
+
+        Returns:
+            float: Seconds until the next slot.
+        '''
+        now = datetime.now()
+        into_slot = (now.minute % wait_mins) * 60 + now.second + now.microsecond / 1e6
+        return wait_mins * 60 - into_slot
+
+    def updated(self, retried = False):
+        '''Notifies the main thread new weather information is available.
+
+        Args:
+            retried (bool, optional): Whether the update had to be retried. Defaults to False.
+        '''
+        if retried:
+            succ_time = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+            print('[{}] SUCCESS: weather API errors have been dealt with.'.format(succ_time))
+
+        if self.outbound_queue is not None:
+            self.outbound_queue.put(Message(MsgType.WTHMSG))
+
     def run_updates(self, exit_evt = None):
         '''The main loop that constantly fetches information from the weather API. More specifically,
         this method gets information from the weather API on periods of multiples of 5 minutes.
@@ -168,19 +232,8 @@ Wind is {5:.1f} Km/h {6} and we have an expected precipitation of {6} millimeter
             now_minute = datetime.now().minute
 
             if now_minute % waitTimeMins == 0 and not weatherUpdated:
-                ex_time = None
-                ex_name = None
-                retried = False
-
                 # do-while until data from weather API is fetched
-                retried = self.retry_update_values(exit_evt=exit_evt)
-
-                if retried:
-                    succ_time = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
-                    print('[{}] SUCCESS: Exception {} raised at {} has been dealt with.'.format(succ_time, ex_name, ex_time))
-
-                if self.outbound_queue is not None:
-                    self.outbound_queue.put(utils.Message('WTHMSG'))
+                self.updated(self.retry_update_values(exit_evt=exit_evt))
 
                 weatherUpdated = True
                 last_updated_minute = now_minute
@@ -0,0 +1,175 @@
+import signal
+import traceback
+from multiprocessing import get_context
+from queue import Empty, Full
+from threading import Lock
+
+from ..utils.eventBus import Message, MsgType
+from ..utils.sharedState import SharedState
+from ..utils.stateStore import StateStore
+
+# User settings a GUI command can change.
+USER_FIELDS = ('setpoint', 'speed', 'last_speed')
+
+class RemoteGUIApp():
+    '''Serves as the stand-in for SmartCoilGUIApp in the control core when the GUI runs in its own
+    process. Kivy rendering and touch handling then have their own interpreter and GIL, so they
+    can't delay sensor ticks or relay switching, and the other way around. Every change of the
+    state store is mirrored to a shared memory block the GUI reads, user input comes back on a
+    small command queue.'''
+
+    def __init__(self, outqueue, store, refresh_interval = 0.1):
+        '''Args:
+            outqueue (:obj:`EventBus`): Bus to report user interactions to the main thread.
+            store (:obj:`StateStore`): The app state store.
+            refresh_interval (float, optional): Seconds between GUI reads of the shared state.
+                Defaults to 0.1.
+        '''
+        self.outbound_queue = outqueue
+        self.store = store
+        self.refresh_interval = refresh_interval
+        self.state = SharedState()
+        # id of the last command applied, so the GUI knows when the block caught up with it.
+        self.ack = 0
+        self.lock = Lock()
+        # spawn, so the GUI process doesn't inherit the threads of the core.
+        self.context = get_context('spawn')
+        self.commands = self.context.Queue()
+        self.process = None
+        self.store.subscribe(self.publish)
+        self.publish()
+
+    def publish(self, state = None):
+        '''Mirrors the current state of the store to the shared block. Subscribed to the store.
+
+        Args:
+            state (:obj:`AppState`, optional): The state that changed, unused: the latest one is
+                published.
+        '''
+        with self.lock:
+            self.state.update(ack=self.ack, **self.store.get()._asdict())
+
+    def run(self):
+        '''Starts the GUI process and applies its user interactions to the store, reporting them
+        on the bus, until it exits. Run in the main thread of the app, in place of the Kivy app.
+        '''
+        self.process = self.context.Process(target=run_gui_process, name='gui', daemon=True,
+                                            args=(self.state.name, self.commands,
+                                                  self.refresh_interval))
+        self.process.start()
+
+        while self.process.is_alive():
+            try:
+                cmd_id, command = self.commands.get(timeout=0.5)
+            except Empty:
+                continue
+
+            if 'setpoint' in command:
+                self.store.update(setpoint=int(command['setpoint']))
+            if 'speed' in command:
+                self.store.set_user_speed(command['speed'])
+            self.ack = cmd_id
+            self.publish()
+
+            try:
+                self.outbound_queue.put(Message(MsgType.GUIMSG))
+            except Full:
+                print('app busy, user interaction not reported.')
+
+        print('GUI process exited with code {}.'.format(self.process.exitcode))
+
+    def close(self):
+        '''Stops the GUI process and removes the shared state block. Use it before leaving the
+        app.
+        '''
+        self.store.unsubscribe(self.publish)
+        if self.process is not None and self.process.is_alive():
+            self.process.terminate()
+            self.process.join(2)
+        self.state.close()
+
+class GUIChannel():
+    '''Serves as the GUI process end of the shared state block and command queue. It copies the
+    block into the local state store the widgets render from, and it's the outbound queue of
+    GUIWidget: instead of a message, it sends the core the user settings that changed. User
+    settings in the block are left out until the core has applied every command sent, so a
+    stale copy never undoes a newer touch.'''
+
+    def __init__(self, state, commands, store):
+        '''Args:
+            state (:obj:`SharedState`): The shared state block, attached by name.
+            commands (:obj:`Queue`): Queue of user interactions, read by the core.
+            store (:obj:`StateStore`): The state store of the GUI process.
+        '''
+        self.state = state
+        self.commands = commands
+        self.store = store
+        self.seq = None
+        self.sent_id = 0
+        # user settings the core is known to have.
+        self.known = {}
+
+    def refresh(self, dt):
+        '''Copies the block into the local store if the core wrote to it since the last refresh.
+        Scheduled on the Kivy clock.
+
+        Args:
+            dt (float): Seconds since the last call, passed by the Kivy clock.
+        '''
+        try:
+            seq, values = self.state.read()
+            if seq is None or seq == self.seq:
+                return
+            self.seq = seq
+
+            ack = values.pop('ack')
+            del values['version']
+            if ack < self.sent_id:
+                for f in USER_FIELDS:
+                    del values[f]
+            else:
+                self.known = {'setpoint': values['setpoint'], 'speed': values['speed']}
+            self.store.update(**values)
+        except Exception as e:
+            print('Exception at GUIChannel.refresh')
+            print(type(e))
+            print(e)
+            traceback.print_tb(e.__traceback__)
+
+    def put(self, msg):
+        '''Sends the user settings changed by an interaction to the core.
+
+        Args:
+            msg (:obj:`Message`): The message GUIWidget would put on the bus, unused.
+        '''
+        state = self.store.get()
+        current = {'setpoint': state.setpoint, 'speed': state.speed}
+        command = {k: v for k, v in current.items() if self.known.get(k) != v}
+        if command:
+            self.sent_id += 1
+            self.commands.put((self.sent_id, command))
+            self.known.update(command)
+
+def run_gui_process(state_name, commands, refresh_interval):
+    '''Entry point of the GUI process. Kivy is only imported here, so the core never opens a
+    window.
+
+    Args:
+        state_name (:obj:`str`): Name of the shared state block.
+        commands (:obj:`Queue`): Queue of user interactions, read by the core.
+        refresh_interval (float): Seconds between reads of the shared state.
+    '''
+    # CTRL-C reaches both processes, the core cleans up and stops this one.
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+
+    from kivy.clock import Clock
+    from .KivySmartCoilGUI import SmartCoilGUIApp
+
+    state = SharedState(state_name)
+    store = StateStore()
+    channel = GUIChannel(state, commands, store)
+    Clock.schedule_interval(channel.refresh, refresh_interval)
+    try:
+        SmartCoilGUIApp(channel, store).run()
+    finally:
+        state.close()
@@ -15,11 +15,14 @@ from pygame.mouse import set_cursor
 from kivy.uix.widget import Widget
 from kivy.properties import ObjectProperty, NumericProperty, ListProperty
 from kivy.animation import Animation
+from kivy.clock import Clock
 
 from time import time
+from queue import Full
 from math import cos, sin, pi, sqrt
 
-from ..utils import utils
+from ..utils.eventBus import Message, MsgType
+from ..utils.stateStore import StateStore
 
 class CircularSlider(Slider):
     '''Subclass that handles all interaction with the circular slider that sets
@@ -111,15 +114,18 @@ class GUIWidget(BoxLayout):
     '''
     LEFT_PADDING = NumericProperty(15)
 
-    def __init__(self, outqueue, **kwargs):
+    def __init__(self, outqueue, store, **kwargs):
         '''The module is intented to be a secondary thread of the base class
         SmartCoil.
         To allow communication between the main thread and this thread, a Queue
-        can be passed as an argument.
+        can be passed as an argument. Everything shown comes from the state
+        store, and user input goes to it: widgets are only touched from the Kivy
+        thread.
 
         Args:
             outqueue (:obj:`Queue`): Outbound queue to send messages
                 to the main thread.
+            store (:obj:`StateStore`): The app state store.
             **kwargs: Arbitrary keyword arguments.
         '''
         super(GUIWidget, self).__init__(**kwargs)
@@ -134,11 +140,16 @@ class GUIWidget(BoxLayout):
                                     '../../assets/icons/placeholder.png')
         self.ids.c_sldr.set_color()
         self.outbound_queue = outqueue
-        self.speed = 1
-        self.speed_changed = False
-        self.last_usr_spd_seen = 1
+        self.store = store
         self.last_usr_tmp_seen = int(self.ids.c_sldr.value)
 
+        # state last shown. Changes made from other threads only schedule a render, several
+        # of them before the next frame make a single one.
+        self.rendered = None
+        self.render_trigger = Clock.create_trigger(self.render)
+        self.store.subscribe(lambda state: self.render_trigger())
+        self.render_trigger()
+
     def on_touch_move(self, touch):
         '''Listener for the event of dragging a finger on the PiTFT screen.
 
@@ -167,8 +178,9 @@ class GUIWidget(BoxLayout):
         '''
         sup = super(GUIWidget, self).on_touch_up(touch)
         if self.last_usr_tmp_seen != int(self.ids.c_sldr.value):
-            self.outbound_queue.put(utils.Message('GUIMSG'))
             self.last_usr_tmp_seen = int(self.ids.c_sldr.value)
+            self.store.update(setpoint=self.last_usr_tmp_seen)
+            self.notify_app()
 
         return sup
 
@@ -218,73 +230,22 @@ class GUIWidget(BoxLayout):
             print(e)
             traceback.print_tb(e.__traceback__)
 
-    def get_user_temp(self):
-        '''Gets the temperature value assigned by the user in the GUI.
-
-        Returns:
-            int: The target temperature assigned by the user.
-        '''
-        return int(self.c_sldr.ids.tmpture_txt.text)
-
     def set_user_temp(self, temp):
-        '''Sets the target temperature value in the GUI.
+        '''Shows a target temperature on the slider.
 
         Args:
-            temp (int): The target temperature to assign.
+            temp (int): The target temperature to show.
         '''
         self.c_sldr.value = temp
         self.ids.c_sldr.set_color()
-
-    def user_turned_off_fancoil(self):
-        '''Verifies if the user turned off the smartcoil by checking if the
-        speed is zero.
-
-        Returns:
-            bool: Whether the smartcoil is explicitly turned off or not.
-        '''
-        return self.speed == 0
-
-    def get_user_speed(self):
-        '''Gets the speed currently set for the smartcoil.
-
-        Returns:
-            int: A value ranging from 0 (off) to 3 (high speed).
-        '''
-        return self.speed
-
-    def get_last_speed_seen(self):
-        '''Gets the last speed set before the smartcoil was turned off.
-
-        Returns:
-            int: A value ranging from 1 (low speed) to 3 (high speed).
-        '''
-        return self.last_usr_spd_seen
-
-    def get_speed_changed_flag(self):
-        '''Gets a flag that verifies if the speed was recently changed.
-
-        Returns:
-            bool: Whether the speed was recently changed.
-        '''
-        return self.speed_changed
-
-    def clear_speed_changed_flag(self):
-        '''Clears the "speed_changed" flag, to be used right after the flag is processed in the
-            main SmartCoil app.
-        '''
-        self.speed_changed = False
+        self.last_usr_tmp_seen = int(temp)
 
     def set_user_speed(self, speed):
-        '''Sets the speed value in the GUI.
+        '''Shows a fan speed on the speed buttons.
 
         Args:
             speed (int): A value from 0 to 3 for off, low, medium or high speed.
         '''
-        self.speed = speed
-        self.speed_changed = True
-        if speed > 0:
-            self.last_usr_spd_seen = speed
-
         off = self.ids.off_button
         lo = self.ids.lo_button
         mi = self.ids.mi_button
@@ -296,45 +257,81 @@ class GUIWidget(BoxLayout):
 
         buttons[speed].state = 'down'
 
+    def render(self, dt = None):
+        '''Shows the current state of the store. The slider and the speed buttons are only set
+        when their value changed, so a new sensor reading doesn't move the slider under the
+        user's finger.
+
+        Args:
+            dt (float, optional): Seconds since scheduled, passed by the Kivy clock.
+        '''
+        state = self.store.get()
+        prev = self.rendered
+        if state is prev:
+            return
+
+        if prev is None or state.setpoint != prev.setpoint:
+            self.set_user_temp(state.setpoint)
+        if prev is None or state.speed != prev.speed:
+            self.set_user_speed(state.speed)
+
+        if state.temperature is not None:
+            self.updateCurrentTemp('{} °F'.format(round(state.temperature)))
+        if state.humidity is not None:
+            self.updateHumidity(round(state.humidity))
+        if state.air_quality is not None:
+            airq = state.air_quality
+            self.updateAirQuality(airq if isinstance(airq, str) else round(airq))
+        if state.outdoor_temp is not None:
+            self.updateTodayTemp('{} °F'.format(int(state.outdoor_temp)))
+        if state.weather_icon is not None and state.weather_icon != self.tod_icon.source:
+            self.updateTodayIcon(state.weather_icon)
+
+        self.rendered = state
+
+    def notify_app(self):
+        '''Helper method to report a user interaction on the outbound queue (read by the main
+        SmartCoil app). If the app is too busy to take it, the interaction is only logged: the
+        next one reports the latest widget values anyway.
+        '''
+        try:
+            self.outbound_queue.put(Message(MsgType.GUIMSG))
+        except Full:
+            print('app busy, user interaction not reported.')
+
     def fancoil_on_lo(self):
-        '''Helper method to report the speed was set to low on the outbound queue (read by th main
-        SmartCoil app).
+        '''Helper method to set the speed to low and report it on the outbound queue (read by the
+        main SmartCoil app).
         '''
-        self.speed = 1
-        self.last_usr_spd_seen = 1
-        self.speed_changed = True
-        self.outbound_queue.put(utils.Message('GUIMSG'))
+        self.store.set_user_speed(1)
+        self.notify_app()
 
     def fancoil_on_mi(self):
-        '''Helper method to report the speed was set to medium on the outbound queue (read by th main
-        SmartCoil app).
+        '''Helper method to set the speed to medium and report it on the outbound queue (read by
+        the main SmartCoil app).
         '''
-        self.speed = 2
-        self.last_usr_spd_seen = 2
-        self.speed_changed = True
-        self.outbound_queue.put(utils.Message('GUIMSG'))
+        self.store.set_user_speed(2)
+        self.notify_app()
 
     def fancoil_on_hi(self):
-        '''Helper method to report the speed was set to high on the outbound queue (read by th main
-        SmartCoil app).
+        '''Helper method to set the speed to high and report it on the outbound queue (read by the
+        main SmartCoil app).
         '''
-        self.speed = 3
-        self.last_usr_spd_seen = 3
-        self.speed_changed = True
-        self.outbound_queue.put(utils.Message('GUIMSG'))
+        self.store.set_user_speed(3)
+        self.notify_app()
 
     def fancoil_off(self):
-        '''Helper method to report the speed was set to off on the outbound queue (read by th main
-        SmartCoil app).
+        '''Helper method to turn the fancoil off and report it on the outbound queue (read by the
+        main SmartCoil app).
         '''
-        self.speed = 0
-        self.outbound_queue.put(utils.Message('GUIMSG'))
+        self.store.set_user_speed(0)
+        self.notify_app()
 
 
 class SmartCoilGUIApp(App):
     '''Serves as the class that initiates the graphic user interface with Kivy.
     '''
-    def __init__(self, outqueue = None):
+    def __init__(self, outqueue = None, store = None):
         '''The module is intented to be a secondary thread of the base class
         SmartCoil.
         To allow communication between the main thread and this thread, a Queue
@@ -343,14 +340,17 @@ class SmartCoilGUIApp(App):
         Args:
             outqueue (:obj:`Queue`, optional): Outbound queue to send messages
                 to the main thread.
+            store (:obj:`StateStore`, optional): The app state store. Defaults
+                to a new one.
         '''
         super(SmartCoilGUIApp, self).__init__()
         self.outbound_queue = outqueue
+        self.store = StateStore() if store is None else store
 
     def build(self):
         '''Required Kivy method to build and show the GUI.
         '''
-        return GUIWidget(self.outbound_queue)
+        return GUIWidget(self.outbound_queue, self.store)
 
 if __name__ == "__main__":
     SmartCoilGUIApp().run()
@@ -1,12 +1,15 @@
 import bme680
 import time
+import math
 from ..utils import utils
+from ..utils.eventBus import Message, MsgType
+from ..utils.ringBuffer import RingBuffer
 
 class SensorData:
     '''Serves as the class that periodically fetches information from the BME680
     sensor.'''
 
-    def __init__(self, outqueue = None, burn_time = 300):
+    def __init__(self, outqueue = None, burn_time = 300, history_hours = 6):
         '''The module is intented to be a secondary thread of the base class
         SmartCoil.
         To allow communication between the main thread and this thread, a Queue
@@ -20,6 +23,8 @@ class SensorData:
                 to the main thread.
             burn_time (int): Time in seconds to allow the sensor to burn before
                 sending accurate readings. Defaults to 5 minutes.
+            history_hours (int, optional): Hours of readings kept in memory, one
+                sample per second. Defaults to 6 hours.
         '''
         try:
             self.outbound_queue = outqueue
@@ -64,6 +69,15 @@ class SensorData:
         # calculation of air_quality_score (25:75, humidity:gas)
         self.hum_weighting = 0.25
 
+        # Most recent readings, shared with the GUI, server and control loop.
+        # Temperature is kept in celcius, missing air quality as NaN.
+        self.recent = RingBuffer(['timestamp', 'temperature', 'pressure',
+                                  'humidity', 'gas_resistance', 'air_quality'],
+                                 history_hours * 3600)
+
+        # readings at the resolution shown to the user, as of the last tick.
+        self.last_levels = None
+
     def build_gas_baseline(self):
         ''' Primes the gas sensor based on the specified burning time in
         seconds.
@@ -132,6 +146,46 @@ class SensorData:
 
         return air_quality_score
 
+    def read_sample(self):
+        '''Reads a sample out of the live BME680 data.
+
+        Returns:
+            list: Timestamp in seconds since the epoch, temperature in celcius,
+            pressure, humidity, gas resistance and air quality (NaN if not
+            available yet).
+        '''
+        airq = self.calc_air_quality()
+        return [time.time(),
+                self.sensor.data.temperature,
+                self.sensor.data.pressure,
+                self.sensor.data.humidity,
+                self.sensor.data.gas_resistance,
+                math.nan if airq < 0 else airq]
+
+    def record_sample(self):
+        '''Writes the current readings into the in-memory buffer of recent
+        readings. Only the sensor thread should call it.
+        '''
+        self.recent.append(self.read_sample())
+
+    def format_sample(self, sample, temp_in_f = True):
+        '''Helper method to turn a buffered sample into readings.
+
+        Args:
+            sample (list): A sample as stored in the recent readings buffer.
+            temp_in_f (bool, optional): Specifies if the temperature must be
+                specified in Fahrenheit. Defaults to True.
+
+        Returns:
+            list: temperature, pressure, humidity, gas resistance, air quality.
+        '''
+        _, temp, pres, humi, gas_res, airq = sample
+        if temp_in_f:
+            temp = utils.c_to_f(temp)
+        airq = '-' if math.isnan(airq) else int(airq)
+
+        return [temp, pres, humi, gas_res, airq]
+
     def get_most_recent_readings(self, temp_in_f = True):
         '''Gets the most recent values fetched from the BME680 sensor, these
         values are:
@@ -140,6 +194,8 @@ class SensorData:
             - humidity
             - gas resistance
             - air quality
+        The values come from the last sample of the recent readings buffer, the
+        live sensor data is only read if the buffer is still empty.
 
         Args:
             temp_in_f (bool, optional): Specifies if the temperature must be
@@ -152,16 +208,103 @@ class SensorData:
         '''
         if not self.sensor_ready(): return None
 
+        sample = self.recent.last()
+        if sample is None:
+            sample = self.read_sample()
+
+        return self.format_sample(sample, temp_in_f)
+
+    def get_recent_readings(self, seconds, temp_in_f = True):
+        '''Gets the readings of the last given seconds out of the recent
+        readings buffer.
+
+        Args:
+            seconds (float): How far back to look.
+            temp_in_f (bool, optional): Specifies if the temperature must be
+                specified in Fahrenheit. Defaults to True.
+
+        Returns:
+            list: (timestamp, readings) tuples, oldest first, where readings
+            follow the get_most_recent_readings order.
+        '''
+        samples = self.recent.since(time.time() - seconds)
+        return [(s[0], self.format_sample(s, temp_in_f)) for s in samples]
+
+    def read_levels(self, temp_in_f = True):
+        '''Helper method to get the last fetched readings at the resolution shown to the user,
+        used to tell whether they changed.
+
+        Args:
+            temp_in_f (bool, optional): Specifies if the temperature must be
+                specified in Fahrenheit. Defaults to True.
+
+        Returns:
+            :obj:`tuple`: Temperature rounded to 0.5, pressure, humidity and air
+            quality ('-' while the gas sensor burns in), plus the unrounded
+            temperature.
+        '''
         temp = self.sensor.data.temperature
         if temp_in_f:
             temp = utils.c_to_f(temp)
-        pres = self.sensor.data.pressure
-        humi = self.sensor.data.humidity
-        gas_res = self.sensor.data.gas_resistance
+        real_temp = temp
+        # 'half-rounding' temperature to closest 0.5 increment
+        temp = round(temp) - (round(temp) - int(temp))/2
+
+        pres = int(self.sensor.data.pressure)
+        humi = int(self.sensor.data.humidity)
         airq = self.calc_air_quality()
-        airq = '-' if airq < 0 else airq
+        airq = '-' if airq < 0 else int(airq)
 
-        return [temp, pres, humi, gas_res, airq]
+        return (temp, pres, humi, airq, real_temp)
+
+    def poll(self, verbose = False, temp_in_f = True):
+        '''Performs a single tick of the sensor loop: fetches new data from the
+        BME680 and notifies the main thread if the readings shown changed.
+
+        Args:
+            verbose (bool, optional): Whether to print the readings to STDOUT.
+            temp_in_f (bool, optional): Specifies if the temperature must be
+                specified in Fahrenheit. Defaults to True.
+        '''
+        if self.last_levels is None:
+            self.last_levels = self.read_levels(temp_in_f)[:4]
+
+        levels = self.read_levels(temp_in_f)
+
+        # temperature offset in celcius after monitoring and comparing
+        #aginst another thermometer.
+        self.sensor.set_temp_offset(-1.9)
+
+        if self.sensor.get_sensor_data():
+            self.build_gas_baseline()
+
+            if self.sensor_ready():
+                self.record_sample()
+
+            values_changed = levels[:4] != self.last_levels
+
+            if self.outbound_queue is not None and values_changed:
+                self.outbound_queue.put(Message(MsgType.SNSMSG))
+
+            if verbose:
+                temp, pres, humi, airq = self.last_levels
+                output = ('temp: {0:.2f} F ({1:.3f}), pressure: {2:.1f} '
+                + 'hPa, humidity: {3:.0f}%, air quaility: {4}%').format(
+                    temp, levels[4],
+                    pres,
+                    humi,
+                    airq)
+
+                print(output)
+
+        # update last seen values
+        self.last_levels = levels[:4]
+
+    def stopped(self):
+        '''Notifies the main thread that the sensor loop ended.
+        '''
+        if self.outbound_queue is not None:
+            self.outbound_queue.put(Message(MsgType.EXIT))
 
     def run_sensor(self, verbose = False, exit_evt = None, temp_in_f = True):
         '''The main loop that constantly fetches information from the BME680
@@ -177,65 +320,11 @@ class SensorData:
         '''
         sleep_func = time.sleep if exit_evt == None else exit_evt.wait
 
-        temp = self.sensor.data.temperature
-        if temp_in_f:
-            temp = utils.c_to_f(temp)
-        # 'half-rounding' temperature to closest 0.5 increment
-        temp = round(temp) - (round(temp) - int(temp))/2
-
-        pres = int(self.sensor.data.pressure)
-        humi = int(self.sensor.data.humidity)
-        airq = self.calc_air_quality()
-        airq = '-' if airq < 0 else int(airq)
-
         while True if exit_evt == None else not exit_evt.is_set():
-            new_temp = self.sensor.data.temperature
-            if temp_in_f:
-                new_temp = utils.c_to_f(new_temp)
-            real_temp = new_temp
-            # 'half-rounding' temperature to closest 0.5 increment
-            new_temp = round(new_temp) - (round(new_temp) - int(new_temp))/2
-
-            new_pres = int(self.sensor.data.pressure)
-            new_humi = int(self.sensor.data.humidity)
-            new_airq = self.calc_air_quality()
-            new_airq = '-' if new_airq < 0 else int(new_airq)
-
-            # temperature offset in celcius after monitoring and comparing
-            #aginst another thermometer.
-            self.sensor.set_temp_offset(-1.9)
-
-            if self.sensor.get_sensor_data():
-                self.build_gas_baseline()
-
-                values_changed = (new_temp != temp or
-                                  new_pres != pres or
-                                  new_humi != humi or
-                                  new_airq != airq)
-
-                if self.outbound_queue is not None and values_changed:
-                    self.outbound_queue.put(utils.Message('SNSMSG'))
-
-                if verbose:
-                    output = ('temp: {0:.2f} F ({1:.3f}), pressure: {2:.1f} '
-                    + 'hPa, humidity: {3:.0f}%, air quaility: {4}%').format(
-                        temp, real_temp,
-                        pres,
-                        humi,
-                        airq)
-
-                    print(output)
-
-            # update last seen values
-            temp = new_temp
-            pres = new_pres
-            humi = new_humi
-            airq = new_airq
-
+            self.poll(verbose, temp_in_f)
             sleep_func(1)
 
-        if self.outbound_queue is not None:
-            self.outbound_queue.put(utils.Message('EXIT'))
+        self.stopped()
 
 if __name__=='__main__':
     sd = SensorData()
@@ -5,7 +5,8 @@ from shutil import copyfile
 import json
 from datetime import datetime
 import subprocess
-from ..utils import utils
+from queue import Full
+from ..utils.eventBus import Message, MsgType
 
 class AlexaResponse():
     '''Subclass that builds up the JSON responses for the Alexa Smart Home
@@ -144,10 +145,14 @@ class Endpoint(object):
 
         Returns:
             :obj:`str`: A JSON response (provided by the endpoint action) with a
-            status code of 200.
+            status code of 200, or the status code returned by the action along
+            with the JSON.
         '''
         answer = self.action()
-        self.response = Response(answer, status=200,
+        status = 200
+        if isinstance(answer, tuple):
+            answer, status = answer
+        self.response = Response(answer, status=status,
                                  mimetype='application/json')
         return self.response
 
@@ -155,26 +160,33 @@ class ServerManager():
     '''Serves as the class that runs both the Flask server that manages Alexa
     requests, as well as the SSH tunnel based on the pagekite library.
     '''
-    def __init__(self, outqueue = None, inqueue = None):
+    def __init__(self, outqueue = None, requests = None, store = None):
         '''The module is intented to be a secondary thread of the base class
         SmartCoil.
         To allow communication between the main thread and this thread, a Queue
         must be passed as an argument.
-        Additionally, this class receives information from the main SmartCoil
-        thread, which is performed with a second Queue enabling 2-way
-        communication.
+        Additionally, this class queries information from the main SmartCoil
+        thread, which is performed with a RequestBroker over that same Queue,
+        each request waiting for its own answer, unless the app state store is
+        passed: the state is then read straight from it.
 
         Args:
             outqueue (:obj:`Queue`): Outbound queue to send messages to the main
                 thread.
-            inqueue (:obj:`Queue`): Inbound queue to receive messages from the
-            main thread.
+            requests (:obj:`RequestBroker`): Broker sending requests to the main
+                thread and waiting for their answers.
+            store (:obj:`StateStore`, optional): The app state store. Defaults
+                to None, querying the main thread.
         '''
         self.app = Flask(__name__)
         self.load_endpoints()
 
-        self.inbound_queue = inqueue
         self.outbound_queue = outqueue
+        self.requests = requests
+        self.store = store
+
+        # last state reported by the main thread, answered if it's too busy.
+        self.last_state = None
 
         self.tunnel_address = None
         self.tunnel_port = None
@@ -302,8 +314,19 @@ class ServerManager():
             params (:obj:`dict`): A dictionary of parameters to be used by the
                 main class.
 
+        Raises:
+            :obj:`Full`: If the main thread is too busy to take the message.
         '''
-        self.outbound_queue.put(utils.Message('SRVMSG', action, params))
+        self.outbound_queue.put(Message(MsgType.SRVMSG, action, params))
+
+    def busy(self):
+        '''Helper method to build the answer to a request the main thread is too busy to take.
+
+        Returns:
+            :obj:`tuple`: An error JSON and the 503 status code.
+        '''
+        self.debug('App busy, request rejected.')
+        return ('{"error": "busy"}', 503)
 
     def debug(self, dbg_msg):
         print('[{}] DEBUG: {}'.format(datetime.now(), dbg_msg))
@@ -343,6 +366,8 @@ class ServerManager():
             res.set_token(request['directive']['endpoint']['scope']['token'])
 
             return res.get_json()
+        except Full:
+            return self.busy()
         except:
             return '{"error": "invalid information"}'
 
@@ -380,6 +405,8 @@ class ServerManager():
             res.set_header(response_header)
             res.set_token(request['directive']['endpoint']['scope']['token'])
             return res.get_json()
+        except Full:
+            return self.busy()
         except:
             return '{"error": "invalid information"}'
 
@@ -415,6 +442,8 @@ class ServerManager():
             res.set_header(response_header)
             res.set_token(request['directive']['endpoint']['scope']['token'])
             return res.get_json()
+        except Full:
+            return self.busy()
         except:
             return '{"error": "invalid information"}'
 
@@ -422,8 +451,11 @@ class ServerManager():
         '''Gets and process a request from Amazon Alexa (AWS LAmbda server) to get the SmartCoil
         state, this is, current indoor temperature, target temperature, if the fancoil is
         on/off, and fan speed.
-        Once the message is successfully parsed, the corresponding state request is communicated to
-        the main SmartCoil thread and waits for the status in an inbound queue.
+        Once the message is successfully parsed, the state is read from the app state store if
+        available, without involving the main SmartCoil thread. Otherwise the corresponding state
+        request is communicated to the main thread and waits for the status, up to the broker
+        timeout. Concurrent state requests share a single message, and the last known state is
+        reported if the main thread doesn't answer in time.
 
         Returns:
             A response JSON back to the AWS Lambda server to inform about the current state, or an
@@ -436,16 +468,17 @@ class ServerManager():
 
             request = data['request']
 
-            self.message_smartcoil('SCOIL_STATE')
-
-            msg = self.inbound_queue.get()
-            type = msg.type
-            action = msg.action
-            info = msg.params
-
-            if not (type == 'APPMSG' and action == 'SCOIL_STATE-R'):
-                print('unrecognized App action.')
+            if self.store is not None:
+                info = self.store.get().report()
+            else:
+                info = self.requests.request(MsgType.SRVMSG, 'SCOIL_STATE',
+                                             fallback=self.last_state, shared=True)
+            if info is None:
+                print('no state available from the App.')
                 return '{"error": "invalid information"}'
+            if info is self.last_state:
+                self.debug('App busy, reporting the last known state.')
+            self.last_state = info
 
             dbg = ('Current state is:\nstate: {}, speed: {}, '
                     + 'thermostat temp: {}, AC temp set to: {}').format(
@@ -488,6 +521,8 @@ class ServerManager():
             res.add_property(prop)
 
             return res.get_json()
+        except Full:
+            return self.busy()
         except:
             return '{"error": "invalid information"}'
 
@@ -0,0 +1,169 @@
+import time
+import traceback
+from array import array
+from bisect import bisect_left
+from threading import Lock
+from .eventBus import MsgType
+
+# Upper bounds of the time histogram buckets, in milliseconds. A last bucket takes the rest.
+TIME_BOUNDS_MS = (0.1, 0.25, 0.5, 1, 2.5, 5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000)
+
+# Upper bounds of the queue depth histogram buckets, in messages.
+DEPTH_BOUNDS = (0, 1, 2, 4, 8, 16, 32, 64, 128, 256)
+
+class Histogram():
+    '''Serves as a fixed bucket histogram. Buckets are allocated once, recording a value is a
+    binary search over the bounds and a counter increment.'''
+    __slots__ = ('bounds', 'labels', 'counts', 'count', 'total', 'max')
+
+    def __init__(self, bounds, scale = 1):
+        '''Args:
+            bounds (:obj:`tuple`): Upper bounds of the buckets, in display units.
+            scale (float, optional): Display units per recorded unit, i.e. 1000 to record seconds
+                and show milliseconds. Defaults to 1.
+        '''
+        self.bounds = tuple(b / scale for b in bounds)
+        self.labels = ['<={}'.format(b) for b in bounds] + ['>{}'.format(bounds[-1])]
+        self.counts = array('L', [0] * (len(bounds) + 1))
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def record(self, value):
+        '''Adds a value to its bucket.
+
+        Args:
+            value (float): The value, in recorded units.
+        '''
+        self.counts[bisect_left(self.bounds, value)] += 1
+        self.count += 1
+        self.total += value
+        if value > self.max:
+            self.max = value
+
+    def percentile(self, pct):
+        '''Gets the upper bound of the bucket holding a percentile.
+
+        Args:
+            pct (float): Percentile, between 0 and 100.
+
+        Returns:
+            float: The bucket bound in recorded units, the max for the last bucket, or None if
+            nothing was recorded.
+        '''
+        if not self.count:
+            return None
+        rank = pct / 100 * self.count
+        seen = 0
+        for i, n in enumerate(self.counts):
+            seen += n
+            if seen >= rank and n:
+                return self.bounds[i] if i < len(self.bounds) else self.max
+        return self.max
+
+    def reset(self):
+        '''Clears every bucket.
+        '''
+        for i in range(len(self.counts)):
+            self.counts[i] = 0
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def summary(self, scale = 1):
+        '''Gets the histogram as a dict.
+
+        Args:
+            scale (float, optional): Display units per recorded unit. Defaults to 1.
+
+        Returns:
+            :obj:`dict`: Count, mean, p50, p99, max and the non empty buckets, in display units.
+        '''
+        show = lambda v: None if v is None else round(v * scale, 3)
+        return {
+            'count': self.count,
+            'mean': show(self.total / self.count) if self.count else None,
+            'p50': show(self.percentile(50)),
+            'p99': show(self.percentile(99)),
+            'max': show(self.max),
+            'buckets': {l: n for l, n in zip(self.labels, self.counts) if n},
+        }
+
+class BusMetrics():
+    '''Serves as the instrumentation of the event bus: per message type histograms of the time
+    spent by the handlers and of the time between a message being created and handled, plus a
+    histogram of the queue depth sampled at every dispatch. Nothing is allocated per message;
+    when disabled the bus doesn't even call it.'''
+
+    def __init__(self, enabled = False, interval = 300, reset = False):
+        '''The module is intented to be a secondary thread of the base class SmartCoil, which
+        periodically dumps the metrics.
+
+        Args:
+            enabled (bool, optional): Whether the bus should record metrics. Defaults to False.
+            interval (int, optional): Seconds between dumps. Defaults to 5 minutes.
+            reset (bool, optional): Whether to clear the histograms after every dump, so each one
+                covers its own interval. Defaults to False.
+        '''
+        self.enabled = enabled
+        self.interval = interval
+        self.reset_on_dump = reset
+        self.handler = [Histogram(TIME_BOUNDS_MS, 1000) for _ in MsgType]
+        self.latency = [Histogram(TIME_BOUNDS_MS, 1000) for _ in MsgType]
+        self.depth = Histogram(DEPTH_BOUNDS)
+        self.lock = Lock()
+
+    def record(self, msg_type, depth, created, started, finished):
+        '''Records the handling of a message. Called by the bus, from the handler thread.
+
+        Args:
+            msg_type (:obj:`MsgType`): Type of the message.
+            depth (int): Messages still pending when it was taken.
+            created (float): Monotonic time the message was created.
+            started (float): Monotonic time its handlers started.
+            finished (float): Monotonic time its handlers finished.
+        '''
+        with self.lock:
+            self.depth.record(depth)
+            self.latency[msg_type].record(started - created)
+            self.handler[msg_type].record(finished - started)
+
+    def dump(self):
+        '''Gets the current metrics, clearing them if configured so.
+
+        Returns:
+            :obj:`dict`: Queue depth histogram, and per message type handler duration and
+            created-to-handled latency histograms in milliseconds. Types never seen are left out.
+        '''
+        with self.lock:
+            metrics = {
+                'depth': self.depth.summary(),
+                'handler_ms': {t.name: self.handler[t].summary(1000) for t in MsgType
+                               if self.handler[t].count},
+                'latency_ms': {t.name: self.latency[t].summary(1000) for t in MsgType
+                               if self.latency[t].count},
+            }
+            if self.reset_on_dump:
+                for hist in self.handler + self.latency + [self.depth]:
+                    hist.reset()
+        return metrics
+
+    def run(self, exit_evt = None):
+        '''The main loop that periodically prints the metrics.
+
+        Args:
+            exit_evt (:obj:`Event`, optional): Event flag to manage thread cleaning before exiting
+                the full app.
+        '''
+        sleep_func = time.sleep if exit_evt == None else exit_evt.wait
+
+        while True if exit_evt == None else not exit_evt.is_set():
+            sleep_func(self.interval)
+            try:
+                print('[{}] bus metrics: {}'.format(time.strftime('%Y-%m-%d %H:%M:%S'),
+                                                    self.dump()))
+            except Exception as e:
+                print('Exception at BusMetrics.run')
+                print(type(e))
+                print(e)
+                traceback.print_tb(e.__traceback__)
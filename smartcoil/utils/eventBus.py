@@ -0,0 +1,561 @@
+import time
+import traceback
+from collections import deque
+from concurrent.futures import Future, TimeoutError
+from enum import IntEnum
+from itertools import count
+from queue import Empty, Full
+from threading import Condition, Lock
+
+class MsgType(IntEnum):
+    '''Types of the messages exchanged between the SmartCoil threads.'''
+    SNSMSG = 0  # new BME680 sensor readings.
+    WTHMSG = 1  # new weather API values.
+    GUIMSG = 2  # user interaction on the GUI.
+    SRVMSG = 3  # Alexa request from the Flask server.
+    APPMSG = 4  # message from the main class to other components.
+    EXIT = 5    # stop handling messages.
+
+class Lane(IntEnum):
+    '''Priority lanes of the inbound channel, highest priority first.'''
+    CONTROL = 0      # user and Alexa commands, which may switch the relays right away.
+    SENSOR = 1       # indoor readings driving the thermostat.
+    BOOKKEEPING = 2  # weather values and persistence.
+
+# Lane of every message type.
+LANES = {
+    MsgType.SNSMSG: Lane.SENSOR,
+    MsgType.WTHMSG: Lane.BOOKKEEPING,
+    MsgType.GUIMSG: Lane.CONTROL,
+    MsgType.SRVMSG: Lane.CONTROL,
+    MsgType.APPMSG: Lane.CONTROL,
+    MsgType.EXIT: Lane.CONTROL,
+}
+
+# Notification types that carry no state of their own, the handler reads the latest values from
+# their source. One pending message per source is enough, further ones are merged into it.
+COALESCED = (MsgType.SNSMSG, MsgType.WTHMSG)
+
+# What to do with a message whose lane is full.
+BLOCK = 'block'              # wait up to block_timeout for room, then reject it.
+DROP_OLDEST = 'drop_oldest'  # drop the oldest pending message of the lane to make room.
+REJECT = 'reject'            # reject it right away, so the caller can answer it's busy.
+FORCE = 'force'              # queue it anyway, for the few messages that can't be lost.
+
+# Overflow policy of every message type. Coalescing keeps at most one pending notification per
+# source, and the app sends a single source per notification type, so the sensor and bookkeeping
+# lanes never fill up in practice: their bounds and DROP_OLDEST are a safety net for senders that
+# add sources of their own.
+POLICIES = {
+    MsgType.SNSMSG: DROP_OLDEST,
+    MsgType.WTHMSG: DROP_OLDEST,
+    MsgType.GUIMSG: BLOCK,
+    MsgType.SRVMSG: REJECT,
+    MsgType.APPMSG: BLOCK,
+    MsgType.EXIT: FORCE,
+}
+
+class Message():
+    '''Utility class to represent messages being used in queue communication between threads.
+    Messages are slotted and can't be changed once created.'''
+    __slots__ = ('type', 'action', 'params', 'corr_id', 'created')
+
+    def __init__(self, type, action = None, params = None, corr_id = None):
+        '''Args:
+            type (:obj:`MsgType`): Type of message.
+            action (:obj:`str`, optional): String identifier for the action to be executed. Thought
+                as a type subcategory. Defaults to None.
+            params (:obj:`dict`, optional): Dictionary of parameters to be used when executing the
+                corresponding action. Defaults to None.
+            corr_id (int, optional): Id of the request waiting for an answer to this message, see
+                RequestBroker. Defaults to None, for messages expecting no answer.
+        '''
+        object.__setattr__(self, 'type', type)
+        object.__setattr__(self, 'action', action)
+        object.__setattr__(self, 'params', params)
+        object.__setattr__(self, 'corr_id', corr_id)
+        # monotonic clock, so the age of a message is not affected by clock adjustments.
+        object.__setattr__(self, 'created', time.monotonic())
+
+    def __setattr__(self, name, value):
+        raise AttributeError('messages are immutable')
+
+    def __delattr__(self, name):
+        raise AttributeError('messages are immutable')
+
+    def __repr__(self):
+        return 'Message({}, {!r}, {!r})'.format(self.type.name, self.action, self.params)
+
+    def age(self):
+        '''Gets the seconds elapsed since the message was created.
+
+        Returns:
+            float: Age of the message.
+        '''
+        return time.monotonic() - self.created
+
+class PriorityChannel():
+    '''Serves as a queue with one FIFO lane per priority. The highest priority pending message is
+    taken first, but a lower lane passed over max_skips times in a row is served next, so
+    bookkeeping still advances while commands keep coming. The time every message waited is
+    recorded per lane. Sensor and weather notifications are coalesced by source, so a slow
+    handler finds at most one of each pending instead of a backlog of stale ones. Lanes are
+    bounded, a message whose lane is full follows the overflow policy of its type. Only the
+    control lane can fill up with the messages the app sends, the bounds of the other lanes only
+    matter for notifications from many sources.'''
+
+    def __init__(self, max_skips = 8, max_pending = None, block_timeout = 0.5):
+        '''Args:
+            max_skips (int, optional): Times a pending lane can be passed over by higher ones
+                before it's served anyway. Defaults to 8.
+            max_pending (:obj:`dict`, optional): Max pending messages per lane name. Defaults to
+                32 per lane. The sensor and bookkeeping lanes hold one notification per source,
+                so their bound is only reached with more sources than that.
+            block_timeout (float, optional): Max seconds a message with the block policy waits
+                for room. Defaults to 0.5.
+        '''
+        max_pending = {} if max_pending is None else max_pending
+        self.max_skips = max_skips
+        self.max_pending = [max_pending.get(lane.name, 32) for lane in Lane]
+        self.block_timeout = block_timeout
+        self.lanes = [deque() for _ in Lane]
+        self.skips = [0] * len(Lane)
+        self.lane_of = [LANES[t] for t in MsgType]
+        self.policy_of = [POLICIES[t] for t in MsgType]
+        self.coalesced_types = [t in COALESCED for t in MsgType]
+        self.lock = Lock()
+        self.not_empty = Condition(self.lock)
+        self.not_full = Condition(self.lock)
+        self.pending = 0
+        # pending coalesced notification per source key.
+        self.pending_keys = {}
+
+        # wait time counters per lane, exposed through get_stats.
+        self.taken = [0] * len(Lane)
+        self.total_wait = [0.0] * len(Lane)
+        self.max_wait = [0.0] * len(Lane)
+        self.last_wait = [0.0] * len(Lane)
+        self.coalesced = [0] * len(MsgType)
+        # overflow counters per message type, exposed through get_stats.
+        self.blocked = [0] * len(MsgType)
+        self.dropped = [0] * len(MsgType)
+        self.rejected = [0] * len(MsgType)
+
+    def put(self, msg):
+        '''Queues a message in the lane of its type. A notification whose source already has one
+        pending is merged into it instead.
+
+        Args:
+            msg (:obj:`Message`): The message.
+
+        Raises:
+            :obj:`Full`: If the lane is full and the message was rejected.
+        '''
+        with self.lock:
+            coalesced = self.coalesced_types[msg.type]
+            if coalesced and (msg.type, msg.action) in self.pending_keys:
+                self.coalesced[msg.type] += 1
+                return
+
+            lane = self.lane_of[msg.type]
+            if len(self.lanes[lane]) >= self.max_pending[lane]:
+                self.make_room(msg, lane)
+
+            if coalesced:
+                self.pending_keys[(msg.type, msg.action)] = msg
+            self.lanes[lane].append(msg)
+            self.pending += 1
+            self.not_empty.notify()
+
+    def make_room(self, msg, lane):
+        '''Helper method to apply the overflow policy of a message whose lane is full. Must be
+        called holding the lock.
+
+        Args:
+            msg (:obj:`Message`): The message.
+            lane (int): Its lane index.
+
+        Raises:
+            :obj:`Full`: If the message was rejected.
+        '''
+        policy = self.policy_of[msg.type]
+        if policy == DROP_OLDEST:
+            oldest = self.lanes[lane].popleft()
+            self.pending -= 1
+            if self.coalesced_types[oldest.type]:
+                del self.pending_keys[(oldest.type, oldest.action)]
+            self.dropped[oldest.type] += 1
+        elif policy == BLOCK:
+            self.blocked[msg.type] += 1
+            if not self.not_full.wait_for(
+                    lambda: len(self.lanes[lane]) < self.max_pending[lane], self.block_timeout):
+                self.rejected[msg.type] += 1
+                raise Full
+        elif policy == REJECT:
+            self.rejected[msg.type] += 1
+            raise Full
+
+    def get(self, block = True, timeout = None):
+        '''Takes the next message, following the lane priorities.
+
+        Args:
+            block (bool, optional): Whether to wait for a message. Defaults to True.
+            timeout (float, optional): Max seconds to wait. Defaults to None, waiting forever.
+
+        Returns:
+            :obj:`Message`: The message.
+
+        Raises:
+            :obj:`Empty`: If no message arrived in time.
+        '''
+        with self.not_empty:
+            if not block:
+                if not self.pending:
+                    raise Empty
+            elif not self.not_empty.wait_for(lambda: self.pending, timeout):
+                raise Empty
+
+            lane = self.next_lane()
+            msg = self.lanes[lane].popleft()
+            self.pending -= 1
+            self.not_full.notify()
+            if self.coalesced_types[msg.type]:
+                del self.pending_keys[(msg.type, msg.action)]
+
+            wait = time.monotonic() - msg.created
+            self.taken[lane] += 1
+            self.total_wait[lane] += wait
+            self.last_wait[lane] = wait
+            if wait > self.max_wait[lane]:
+                self.max_wait[lane] = wait
+            return msg
+
+    def next_lane(self):
+        '''Helper method to pick the lane to serve, updating the skip counters. Must be called
+        holding the lock with at least one pending message.
+
+        Returns:
+            int: The lane index.
+        '''
+        pending = [lane for lane, msgs in enumerate(self.lanes) if msgs]
+        chosen = pending[0]
+        for lane in pending[1:]:
+            if self.skips[lane] >= self.max_skips:
+                chosen = lane
+                break
+
+        for lane in pending:
+            self.skips[lane] = 0 if lane == chosen else self.skips[lane] + 1
+        return chosen
+
+    def qsize(self):
+        '''Gets the number of pending messages.
+
+        Returns:
+            int: Pending messages.
+        '''
+        return self.pending
+
+    def get_stats(self):
+        '''Gets the channel counters.
+
+        Returns:
+            :obj:`dict`: Per lane name, pending and handled messages and their wait time in
+            milliseconds, plus the number of coalesced, blocked, dropped and rejected messages
+            per message type.
+        '''
+        with self.lock:
+            stats = {lane.name: {
+                        'pending': len(self.lanes[lane]),
+                        'max_pending': self.max_pending[lane],
+                        'taken': self.taken[lane],
+                        'wait_ms_last': round(self.last_wait[lane] * 1000, 3),
+                        'wait_ms_max': round(self.max_wait[lane] * 1000, 3),
+                        'wait_ms_avg': round(self.total_wait[lane] * 1000
+                                             / max(self.taken[lane], 1), 3),
+                    } for lane in Lane}
+            stats['coalesced'] = {t.name: self.coalesced[t] for t in COALESCED}
+            for name in ('blocked', 'dropped', 'rejected'):
+                counts = getattr(self, name)
+                stats[name] = {t.name: counts[t] for t in MsgType if counts[t]}
+            return stats
+
+class EventBus():
+    '''Serves as the channel that carries messages from the peripherals, GUI, weather API and
+    server to the main SmartCoil thread. Components subscribe handlers per message type, and the
+    handlers of every type are resolved once into a table indexed by type, so dispatching a
+    message is a list lookup. Producers only need its put method, just like a Queue. Pending
+    messages wait in priority lanes, so commands are never stuck behind bookkeeping.'''
+
+    def __init__(self, queue = None, max_skips = 8, max_pending = None, block_timeout = 0.5,
+                 metrics = None):
+        '''Args:
+            queue (:obj:`Queue`, optional): Queue holding the pending messages. Defaults to a new
+                PriorityChannel.
+            max_skips (int, optional): Times a pending lane of the default channel can be passed
+                over by higher ones before it's served anyway. Defaults to 8.
+            max_pending (:obj:`dict`, optional): Max pending messages per lane name of the
+                default channel. Defaults to 32 per lane.
+            block_timeout (float, optional): Max seconds a control message waits for room in the
+                default channel. Defaults to 0.5.
+            metrics (:obj:`BusMetrics`, optional): Instrumentation recording every dispatch.
+                Defaults to None, recording nothing.
+        '''
+        if queue is None:
+            queue = PriorityChannel(max_skips, max_pending, block_timeout)
+        self.queue = queue
+        self.metrics = metrics
+        self.subscribers = {t: [] for t in MsgType}
+        self.handlers = None
+        # called after every put, i.e. to wake up an asyncio loop waiting for messages.
+        self.wakeup = None
+
+    def subscribe(self, type, handler):
+        '''Adds a handler for a message type. Handlers of the same type run in subscription order.
+
+        Args:
+            type (:obj:`MsgType`): Type of message to handle.
+            handler (callable): Function called with each message of the type.
+        '''
+        self.subscribers[type].append(handler)
+        if self.handlers is not None:
+            self.resolve()
+
+    def subscribe_all(self, handler):
+        '''Adds a handler for every message type.
+
+        Args:
+            handler (callable): Function called with each message.
+        '''
+        for t in MsgType:
+            self.subscribe(t, handler)
+
+    def unsubscribe(self, type, handler):
+        '''Removes a handler for a message type.
+
+        Args:
+            type (:obj:`MsgType`): Type of message handled.
+            handler (callable): The handler to remove.
+        '''
+        self.subscribers[type].remove(handler)
+        if self.handlers is not None:
+            self.resolve()
+
+    def resolve(self):
+        '''Builds the dispatch table, a tuple of handlers per message type indexed by its value.
+        Done once before handling messages, and again only if subscriptions change afterwards.
+        '''
+        self.handlers = [tuple(self.subscribers[t]) for t in MsgType]
+
+    def put(self, msg):
+        '''Queues a message for the handlers.
+
+        Args:
+            msg (:obj:`Message`): The message.
+
+        Raises:
+            :obj:`Full`: If the channel is full and the message was rejected.
+        '''
+        self.queue.put(msg)
+        if self.wakeup is not None:
+            self.wakeup()
+
+    def publish(self, type, action = None, params = None):
+        '''Builds and queues a message.
+
+        Args:
+            type (:obj:`MsgType`): Type of message.
+            action (:obj:`str`, optional): Action to be executed. Defaults to None.
+            params (:obj:`dict`, optional): Parameters of the action. Defaults to None.
+        '''
+        self.put(Message(type, action, params))
+
+    def get(self, block = True, timeout = None):
+        '''Takes the next pending message.
+
+        Args:
+            block (bool, optional): Whether to wait for a message. Defaults to True.
+            timeout (float, optional): Max seconds to wait. Defaults to None, waiting forever.
+
+        Returns:
+            :obj:`Message`: The message.
+        '''
+        return self.queue.get(block, timeout)
+
+    def qsize(self):
+        '''Gets the approximate number of pending messages.
+
+        Returns:
+            int: Pending messages.
+        '''
+        return self.queue.qsize()
+
+    def get_stats(self):
+        '''Gets the counters of the channel, if it keeps any.
+
+        Returns:
+            :obj:`dict`: The channel counters, i.e. per lane wait times.
+        '''
+        get_stats = getattr(self.queue, 'get_stats', None)
+        return {} if get_stats is None else get_stats()
+
+    def dispatch(self, msg):
+        '''Runs every handler subscribed to the type of a message. A failing handler doesn't
+        prevent the others from running.
+
+        Args:
+            msg (:obj:`Message`): The message.
+        '''
+        metrics = self.metrics
+        if metrics is not None:
+            # depth the message left behind, before handlers get to put more.
+            depth = self.queue.qsize()
+            started = time.monotonic()
+
+        handlers = self.handlers[msg.type]
+        if not handlers:
+            print('unrecognized message.')
+        for handler in handlers:
+            try:
+                handler(msg)
+            except Exception as e:
+                print('Exception at EventBus.dispatch ({})'.format(msg.type.name))
+                print(type(e))
+                print(e)
+                traceback.print_tb(e.__traceback__)
+
+        if metrics is not None:
+            metrics.record(msg.type, depth, msg.created, started, time.monotonic())
+
+    def run(self):
+        '''The main loop that dispatches messages until an EXIT message is handled.
+        '''
+        if self.handlers is None:
+            self.resolve()
+
+        msg_type = None
+        while msg_type != MsgType.EXIT:
+            msg = self.get()
+            msg_type = msg.type
+            self.dispatch(msg)
+
+class RequestBroker():
+    '''Serves as a request/response facility on top of the bus. Every request gets its own
+    correlation id and future, so concurrent callers always receive their own answer, and waits
+    are bounded by a timeout after which a fallback answer is returned. Read-only requests can be
+    shared, so concurrent callers asking the same thing wait on a single message.'''
+
+    def __init__(self, bus, timeout = 2.0):
+        '''Args:
+            bus (:obj:`EventBus`): Bus carrying the requests to the main thread.
+            timeout (float, optional): Default seconds to wait for an answer. Defaults to 2.
+        '''
+        self.bus = bus
+        self.timeout = timeout
+        self.ids = count(1)
+        # futures of the unanswered requests, per correlation id.
+        self.pending = {}
+        # correlation id of the shared request in flight, per action.
+        self.shared = {}
+        self.lock = Lock()
+
+        # counters exposed through get_stats.
+        self.answered = 0
+        self.timeouts = 0
+        self.late = 0
+
+    def request(self, type, action, params = None, timeout = None, fallback = None,
+                shared = False):
+        '''Sends a request and waits for its answer.
+
+        Args:
+            type (:obj:`MsgType`): Type of the request message.
+            action (:obj:`str`): Action requested.
+            params (:obj:`dict`, optional): Parameters of the action. Defaults to an empty dict.
+            timeout (float, optional): Max seconds to wait. Defaults to the broker timeout.
+            fallback (object, optional): Answer returned if none arrives in time. Defaults to
+                None.
+            shared (bool, optional): Whether to wait on a request of the same action already in
+                flight instead of sending a new one. Only for read-only actions. Defaults to
+                False.
+
+        Returns:
+            object: The answer, or the fallback.
+
+        Raises:
+            :obj:`Full`: If the bus rejected the request.
+        '''
+        with self.lock:
+            corr_id = self.shared.get(action) if shared else None
+            send = corr_id is None
+            if send:
+                corr_id = next(self.ids)
+                self.pending[corr_id] = (Future(), action)
+                if shared:
+                    self.shared[action] = corr_id
+            future = self.pending[corr_id][0]
+
+        if send:
+            try:
+                self.bus.put(Message(type, action, {} if params is None else params, corr_id))
+            except Full:
+                with self.lock:
+                    self.forget(corr_id)
+                # callers sharing the request are told right away too.
+                future.set_exception(Full())
+                raise
+
+        try:
+            return future.result(self.timeout if timeout is None else timeout)
+        except TimeoutError:
+            with self.lock:
+                self.timeouts += 1
+                # the sender gives up on the request, a late answer will be dropped.
+                if send:
+                    self.forget(corr_id)
+            return fallback
+
+    def forget(self, corr_id):
+        '''Helper method to drop a pending request. Must be called holding the lock.
+
+        Args:
+            corr_id (int): Correlation id of the request.
+
+        Returns:
+            :obj:`Future`: The future of the request, or None if it wasn't pending.
+        '''
+        entry = self.pending.pop(corr_id, None)
+        if entry is None:
+            return None
+        if self.shared.get(entry[1]) == corr_id:
+            del self.shared[entry[1]]
+        return entry[0]
+
+    def resolve(self, corr_id, answer):
+        '''Answers a request. Answers to requests nobody waits for anymore are dropped.
+
+        Args:
+            corr_id (int): Correlation id of the request message.
+            answer (object): The answer.
+        '''
+        with self.lock:
+            future = self.forget(corr_id)
+            if future is None:
+                self.late += 1
+                return
+            self.answered += 1
+        future.set_result(answer)
+
+    def get_stats(self):
+        '''Gets the broker counters.
+
+        Returns:
+            :obj:`dict`: Pending requests, answered ones, timeouts and answers arriving too late.
+        '''
+        with self.lock:
+            return {
+                'pending': len(self.pending),
+                'answered': self.answered,
+                'timeouts': self.timeouts,
+                'late': self.late,
+            }
@@ -0,0 +1,197 @@
+import os
+import glob
+import json
+import time
+import struct
+import zlib
+from datetime import date, timedelta
+from threading import Lock
+from .eventBus import MsgType
+
+# Written once at the start of every journal file.
+MAGIC = b'SCJ1'
+
+# Record header: payload length, wall clock time of the message and its type. The payload (JSON
+# action, params and state) follows, then the CRC32 of header and payload.
+HEADER = struct.Struct('<IdB')
+CRC = struct.Struct('<I')
+
+def read_journal(path):
+    '''Streams the records of a journal file. A torn or corrupted tail, as left by a power cut
+    in the middle of a write, ends the stream.
+
+    Args:
+        path (:obj:`str`): Path to the journal file.
+
+    Yields:
+        :obj:`tuple`: Wall clock time, message type, action, params and state of every message.
+    '''
+    with open(path, 'rb') as f:
+        if f.read(len(MAGIC)) != MAGIC:
+            raise ValueError('{} is not a message journal'.format(path))
+
+        while True:
+            header = f.read(HEADER.size)
+            if len(header) < HEADER.size:
+                return
+            length, tstamp, msg_type = HEADER.unpack(header)
+            payload = f.read(length)
+            crc = f.read(CRC.size)
+            if len(crc) < CRC.size or CRC.unpack(crc)[0] != zlib.crc32(header + payload):
+                print('{}: journal ends with a torn record, stopping there.'.format(path))
+                return
+
+            action, params, state = json.loads(payload.decode('utf-8'))
+            yield (tstamp, MsgType(msg_type), action, params, state)
+
+def valid_length(path):
+    '''Helper method to get the length of a journal file up to its last complete record.
+
+    Args:
+        path (:obj:`str`): Path to the journal file.
+
+    Returns:
+        int: Length in bytes, 0 if it's not a journal.
+    '''
+    with open(path, 'rb') as f:
+        if f.read(len(MAGIC)) != MAGIC:
+            return 0
+        good = f.tell()
+        while True:
+            header = f.read(HEADER.size)
+            if len(header) < HEADER.size:
+                return good
+            payload = f.read(HEADER.unpack(header)[0])
+            crc = f.read(CRC.size)
+            if len(crc) < CRC.size or CRC.unpack(crc)[0] != zlib.crc32(header + payload):
+                return good
+            good = f.tell()
+
+class MessageJournal():
+    '''Serves as an append-only journal of every message handled by the SmartCoil class, along
+    with the state it was handled against: sensor readings, user settings and weather values.
+    One file per day, each record framed with its length and a CRC so a torn tail is detected.
+    Writes are buffered and fsync'd periodically, not on every message. Files older than the
+    days to keep are removed as a new day starts.'''
+
+    def __init__(self, path = None, fsync_interval = 5, keep_days = 14, enabled = False):
+        '''Args:
+            path (:obj:`str`, optional): Directory of the journal files. Defaults to
+                '/assets/db/journal'.
+            fsync_interval (float, optional): Max seconds between fsyncs. Defaults to 5.
+            keep_days (int, optional): Days of journal files kept, today's included. 0 keeps
+                them all. Defaults to 14.
+            enabled (bool, optional): Whether messages should be journaled. Defaults to False.
+        '''
+        if path is None:
+            dirname = os.path.dirname(__file__)
+            path = os.path.join(dirname, '../../assets/db/journal')
+
+        self.path = path
+        self.fsync_interval = fsync_interval
+        self.keep_days = keep_days
+        self.enabled = enabled
+        self.file = None
+        self.day = None
+        self.last_sync = 0
+        self.records = 0
+        self.lock = Lock()
+
+    def file_for(self, day):
+        '''Gets the journal file of a day.
+
+        Args:
+            day (:obj:`date`): The day.
+
+        Returns:
+            :obj:`str`: The file path.
+        '''
+        return os.path.join(self.path, 'journal-{}.bin'.format(day.isoformat()))
+
+    def files(self):
+        '''Gets every journal file, oldest first.
+
+        Returns:
+            :obj:`list`: The file paths.
+        '''
+        return sorted(glob.glob(os.path.join(self.path, 'journal-*.bin')))
+
+    def open_day(self, day):
+        '''Helper method to switch to the journal file of a new day. A torn record left at the
+        end of an existing file is cut off first, so new records stay readable. Must be called
+        holding the lock.
+
+        Args:
+            day (:obj:`date`): The day.
+        '''
+        self.sync_and_close()
+        os.makedirs(self.path, exist_ok=True)
+        fpath = self.file_for(day)
+        length = valid_length(fpath) if os.path.exists(fpath) else 0
+        self.file = open(fpath, 'ab')
+        self.file.truncate(length)
+        if length == 0:
+            self.file.write(MAGIC)
+        self.day = day
+        self.prune(day)
+
+    def prune(self, today):
+        '''Helper method to remove the journal files older than the days to keep.
+
+        Args:
+            today (:obj:`date`): The current day.
+        '''
+        if not self.keep_days:
+            return
+
+        oldest = self.file_for(today - timedelta(days=self.keep_days - 1))
+        for fpath in self.files():
+            # file names sort by day.
+            if fpath >= oldest:
+                break
+            os.remove(fpath)
+
+    def record(self, msg, state):
+        '''Appends a message to the journal.
+
+        Args:
+            msg (:obj:`Message`): The message.
+            state (:obj:`dict`): JSON serializable state the message was handled against.
+        '''
+        now = time.time()
+        payload = json.dumps([msg.action, msg.params, state], separators=(',', ':'),
+                             default=str).encode('utf-8')
+        header = HEADER.pack(len(payload), now, msg.type)
+
+        with self.lock:
+            today = date.today()
+            if today != self.day:
+                self.open_day(today)
+
+            self.file.write(header + payload + CRC.pack(zlib.crc32(header + payload)))
+            self.records += 1
+            if now - self.last_sync >= self.fsync_interval:
+                self.sync()
+
+    def sync(self):
+        '''Helper method to flush the journal file to disk. Must be called holding the lock.
+        '''
+        self.file.flush()
+        os.fsync(self.file.fileno())
+        self.last_sync = time.time()
+
+    def sync_and_close(self):
+        '''Helper method to flush and close the current journal file, if any. Must be called
+        holding the lock.
+        '''
+        if self.file is not None:
+            self.sync()
+            self.file.close()
+            self.file = None
+            self.day = None
+
+    def close(self):
+        '''Flushes and closes the journal. Use it before leaving the app.
+        '''
+        with self.lock:
+            self.sync_and_close()
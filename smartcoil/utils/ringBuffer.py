@@ -0,0 +1,149 @@
+from array import array
+
+class RingBuffer():
+    '''Serves as a fixed size, columnar buffer of the most recent samples of a source (sensor or
+    weather API). Every column is a preallocated typed array, so memory use never grows.
+    A single thread writes samples, any number of threads can read them without locks: readers
+    check the write counter again after copying and retry if the samples they copied got
+    overwritten in the meantime.'''
+
+    def __init__(self, columns, capacity, typecode = 'd'):
+        '''Args:
+            columns (:obj:`list`): Column names, the first one being the timestamp in seconds
+                since the epoch.
+            capacity (int): Number of samples kept.
+            typecode (:obj:`str`, optional): Array typecode of every column. Defaults to 'd'
+                (double precision floats).
+        '''
+        self.columns = list(columns)
+        self.capacity = capacity
+        # one spare slot, the one a write in progress may be touching while readers copy.
+        self.size = capacity + 1
+        self.index = {name: i for i, name in enumerate(self.columns)}
+        self.data = [array(typecode, bytes(array(typecode).itemsize * self.size))
+                     for _ in self.columns]
+        # total samples written so far. Only updated once a sample is completely written.
+        self.count = 0
+
+    def __len__(self):
+        '''Gets the number of samples currently available.
+
+        Returns:
+            int: The number of samples, capped at the buffer capacity.
+        '''
+        return min(self.count, self.capacity)
+
+    def nbytes(self):
+        '''Gets the memory used by the buffer columns.
+
+        Returns:
+            int: Size in bytes of all the preallocated columns.
+        '''
+        return sum(col.itemsize * len(col) for col in self.data)
+
+    def append(self, values):
+        '''Writes a new sample, overwriting the oldest one once the buffer is full. Must always be
+        called from the same thread.
+
+        Args:
+            values (:obj:`list`): One value per column, in column order.
+        '''
+        slot = self.count % self.size
+        for col, val in zip(self.data, values):
+            col[slot] = val
+        self.count += 1
+
+    def read(self, start, end):
+        '''Helper method to copy the samples written between two counter values.
+
+        Args:
+            start (int): Counter value of the first sample.
+            end (int): Counter value after the last sample.
+
+        Returns:
+            :obj:`list`: The samples as lists of values, oldest first.
+        '''
+        return [[col[i % self.size] for col in self.data] for i in range(start, end)]
+
+    def last(self):
+        '''Gets the most recent sample.
+
+        Returns:
+            :obj:`list`: One value per column, or None if nothing was written yet.
+        '''
+        rows = self.window(1)
+        return rows[0] if rows else None
+
+    def window(self, k):
+        '''Gets the k most recent samples.
+
+        Args:
+            k (int): Number of samples wanted.
+
+        Returns:
+            :obj:`list`: Up to k samples as lists of values, oldest first.
+        '''
+        while True:
+            end = self.count
+            n = min(k, end, self.capacity)
+            rows = self.read(end - n, end)
+            # the oldest copied sample is overwritten by the write number (end - n + size).
+            if self.count < end - n + self.size:
+                return rows
+
+    def since(self, tstamp):
+        '''Gets the samples written at or after a given time, found with a binary search over the
+        timestamp column.
+
+        Args:
+            tstamp (float): Seconds since the epoch.
+
+        Returns:
+            :obj:`list`: The samples as lists of values, oldest first.
+        '''
+        while True:
+            end = self.count
+            n = min(end, self.capacity)
+            times = self.data[0]
+            lo, hi = end - n, end
+            while lo < hi:
+                mid = (lo + hi) // 2
+                if times[mid % self.size] < tstamp:
+                    lo = mid + 1
+                else:
+                    hi = mid
+            first = lo - (end - n)
+            rows = self.read(end - n + first, end)
+            if self.count < end - n + first + self.size:
+                return rows
+
+    def column(self, name, k):
+        '''Gets the k most recent values of a single column.
+
+        Args:
+            name (:obj:`str`): Column name.
+            k (int): Number of values wanted.
+
+        Returns:
+            :obj:`list`: Up to k values, oldest first.
+        '''
+        col = self.data[self.index[name]]
+        while True:
+            end = self.count
+            n = min(k, end, self.capacity)
+            values = [col[i % self.size] for i in range(end - n, end)]
+            if self.count < end - n + self.size:
+                return values
+
+    def get_stats(self):
+        '''Gets the buffer counters.
+
+        Returns:
+            :obj:`dict`: Samples written, samples available, capacity and bytes used.
+        '''
+        return {
+            'written': self.count,
+            'available': len(self),
+            'capacity': self.capacity,
+            'bytes': self.nbytes(),
+        }
@@ -0,0 +1,120 @@
+import math
+import struct
+from time import sleep
+from threading import Lock
+from multiprocessing import shared_memory
+
+# Write sequence (odd while a write is in progress), then FIELDS: the AppState fields, with
+# the id of the last GUI command applied next to the version. Numbers unknown yet are NaN,
+# texts unknown yet are empty.
+LAYOUT = struct.Struct('<IIIhBB?4sdd8sd256s')
+SEQ = struct.Struct('<I')
+
+FIELDS = ('version', 'ack', 'setpoint', 'speed', 'last_speed', 'fancoil_running', 'mode',
+          'temperature', 'humidity', 'air_quality', 'outdoor_temp', 'weather_icon')
+NUMBERS = ('temperature', 'humidity', 'outdoor_temp')
+TEXTS = ('mode', 'air_quality', 'weather_icon')
+
+class SharedState():
+    '''Serves as the state block shared by the control core and the GUI process, a fixed layout
+    in shared memory mirroring the app state store. The core is the only writer; every write
+    bumps a sequence number twice, so readers never block it and simply retry if they catch a
+    write halfway (seqlock).'''
+
+    def __init__(self, name = None):
+        '''Args:
+            name (:obj:`str`, optional): Name of an existing block to attach to. Defaults to None,
+                creating a new one.
+        '''
+        self.owner = name is None
+        self.shm = shared_memory.SharedMemory(name=name, create=self.owner, size=LAYOUT.size)
+        self.name = self.shm.name
+        self.seq = 0
+        self.values = dict.fromkeys(FIELDS)
+        self.values.update(version=0, ack=0, setpoint=75, speed=1, last_speed=1,
+                           fancoil_running=False)
+        # core threads writing at once would break the sequence.
+        self.lock = Lock()
+        if self.owner:
+            with self.lock:
+                self.publish()
+
+    def update(self, **fields):
+        '''Writes new values to the block. Core process only.
+
+        Args:
+            **fields: Values to change, out of FIELDS.
+        '''
+        with self.lock:
+            self.values.update(fields)
+            self.publish()
+
+    def publish(self):
+        '''Helper method to write every value to the block. Must be called holding the lock.
+        '''
+        packed = []
+        for f in FIELDS:
+            v = self.values[f]
+            if f in NUMBERS:
+                v = math.nan if v is None else v
+            elif f in TEXTS:
+                # struct truncates texts longer than their field.
+                v = b'' if v is None else str(v).encode('utf-8')
+            packed.append(v)
+
+        buf = self.shm.buf
+        self.seq += 1
+        SEQ.pack_into(buf, 0, self.seq)
+        LAYOUT.pack_into(buf, 0, self.seq, *packed)
+        self.seq += 1
+        SEQ.pack_into(buf, 0, self.seq)
+
+    def read(self, retries = 100):
+        '''Reads a consistent copy of the block.
+
+        Args:
+            retries (int, optional): Max attempts while the core is writing. Defaults to 100.
+
+        Returns:
+            :obj:`tuple`: Sequence number and values as a dict, or (None, None) if every attempt
+            caught a write.
+        '''
+        buf = self.shm.buf
+        for _ in range(retries):
+            seq = SEQ.unpack_from(buf)[0]
+            if seq % 2 == 0:
+                values = LAYOUT.unpack_from(buf)
+                # a write that started meanwhile has bumped the sequence again.
+                if values[0] == seq and SEQ.unpack_from(buf)[0] == seq:
+                    return seq, self.decode(values[1:])
+            sleep(0)
+        return None, None
+
+    def decode(self, values):
+        '''Helper method to turn the raw values of the block back into FIELDS.
+
+        Args:
+            values (:obj:`tuple`): Values as unpacked, without the sequence.
+
+        Returns:
+            :obj:`dict`: The values, None where unknown.
+        '''
+        state = dict(zip(FIELDS, values))
+        for f in NUMBERS:
+            if math.isnan(state[f]):
+                state[f] = None
+        for f in TEXTS:
+            state[f] = state[f].rstrip(b'\0').decode('utf-8', 'ignore') or None
+        # air quality is a number, or a text while the sensor can't tell.
+        try:
+            state['air_quality'] = float(state['air_quality'])
+        except (TypeError, ValueError):
+            pass
+        return state
+
+    def close(self):
+        '''Detaches from the block, removing it if this process created it.
+        '''
+        self.shm.close()
+        if self.owner:
+            self.shm.unlink()
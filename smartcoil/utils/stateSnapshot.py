@@ -0,0 +1,85 @@
+import os
+import json
+import time
+from threading import Lock
+
+class StateSnapshot():
+    '''Serves as a small JSON file holding the last known state of the app: user setpoint, fan
+    speed, mode, relay state, last sensor readings and last weather values. It's read first at
+    startup, so the GUI and relays are restored without waiting for the DB or the network. Every
+    write goes to a temporary file that replaces the snapshot atomically, so a power cut leaves
+    either the old or the new snapshot, never a torn one.'''
+
+    def __init__(self, path = None, min_interval = 60):
+        '''Args:
+            path (:obj:`str`, optional): Path to the snapshot file. Defaults to
+                '/assets/db/state_snapshot.json'.
+            min_interval (int, optional): Min seconds between writes caused by readings only, so
+                the SD card isn't written every second. User and relay changes are always written
+                right away. Defaults to 60.
+        '''
+        if path is None:
+            dirname = os.path.dirname(__file__)
+            path = os.path.join(dirname, '../../assets/db/state_snapshot.json')
+
+        self.path = path
+        self.min_interval = min_interval
+        self.state = {}
+        self.last_write = 0
+        self.dirty = False
+        self.lock = Lock()
+
+    def load(self):
+        '''Reads the snapshot file.
+
+        Returns:
+            :obj:`dict`: The last saved state, empty if there is no snapshot or it can't be read.
+        '''
+        try:
+            with open(self.path) as f:
+                state = json.load(f)
+        except (OSError, ValueError) as e:
+            if os.path.exists(self.path):
+                print('unable to read state snapshot: {}'.format(e))
+            state = {}
+
+        with self.lock:
+            self.state = state
+        return dict(state)
+
+    def update(self, urgent = True, **fields):
+        '''Updates some fields of the state, writing the snapshot if anything changed.
+
+        Args:
+            urgent (bool, optional): Whether to write right away. Non urgent changes, such as new
+                readings, are written at most once per min_interval. Defaults to True.
+            **fields: State fields to update, i.e. setpoint=72.
+        '''
+        with self.lock:
+            changed = any(self.state.get(k) != v for k, v in fields.items())
+            self.state.update(fields)
+            self.dirty = self.dirty or changed
+
+            if self.dirty and (urgent or time.time() - self.last_write >= self.min_interval):
+                self.write()
+
+    def write(self):
+        '''Helper method to replace the snapshot file with the current state. Must be called
+        holding the lock.
+        '''
+        tmp_path = self.path + '.tmp'
+        with open(tmp_path, 'w') as f:
+            json.dump(self.state, f)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, self.path)
+
+        self.last_write = time.time()
+        self.dirty = False
+
+    def flush(self):
+        '''Writes any pending change. Use it before leaving the app.
+        '''
+        with self.lock:
+            if self.dirty:
+                self.write()
@@ -0,0 +1,116 @@
+import traceback
+from collections import namedtuple
+from threading import Lock
+
+class AppState(namedtuple('AppState', ['version', 'setpoint', 'speed', 'last_speed', 'mode',
+                                       'fancoil_running', 'temperature', 'humidity',
+                                       'air_quality', 'outdoor_temp', 'weather_icon'])):
+    '''Serves as an immutable snapshot of the app state: user settings (target temperature, fan
+    speed and last speed other than off), mode, whether the fancoil is running, and the latest
+    indoor readings and weather values shown on screen. Readings are None until first known.'''
+    __slots__ = ()
+
+    def report(self):
+        '''Gets the state reported to Amazon Alexa.
+
+        Returns:
+            :obj:`dict`: Mode ('OFF' if turned off), fan speed, current and target temperature,
+            or None if there are no indoor readings yet.
+        '''
+        if self.temperature is None:
+            return None
+        return {'state': 'OFF' if self.speed == 0 else self.mode, 'speed': self.last_speed,
+                'cur_temp': round(self.temperature), 'usr_temp': self.setpoint}
+
+class StateStore():
+    '''Serves as the authoritative copy of the app state, shared by the control logic, the GUI
+    and the server. Every change makes a new AppState with the next version number, so reading
+    the state is a single attribute access and what's read never changes under the reader.
+    Subscribers are called with each new state, from the thread that made the change.'''
+
+    def __init__(self, **fields):
+        '''Args:
+            **fields: Initial values, out of the AppState fields. User settings default to the GUI
+                defaults, readings to None.
+        '''
+        initial = dict(version=0, setpoint=75, speed=1, last_speed=1, mode=None,
+                       fancoil_running=False, temperature=None, humidity=None,
+                       air_quality=None, outdoor_temp=None, weather_icon=None)
+        initial.update(fields)
+        self.state = AppState(**initial)
+        self.subscribers = []
+        self.lock = Lock()
+
+    def get(self):
+        '''Gets the current state.
+
+        Returns:
+            :obj:`AppState`: The state, never modified afterwards.
+        '''
+        return self.state
+
+    def update(self, **fields):
+        '''Changes some values of the state. Values equal to the current ones don't make a new
+        version.
+
+        Args:
+            **fields: New values, out of the AppState fields but 'version'.
+
+        Returns:
+            :obj:`AppState`: The resulting state.
+        '''
+        with self.lock:
+            state = self.state
+            if all(getattr(state, k) == v for k, v in fields.items()):
+                return state
+            state = state._replace(version=state.version + 1, **fields)
+            self.state = state
+
+        self.notify(state)
+        return state
+
+    def set_user_speed(self, speed):
+        '''Changes the fan speed, keeping track of the last speed other than off.
+
+        Args:
+            speed (int): A value from 0 to 3 for off, low, medium or high speed.
+
+        Returns:
+            :obj:`AppState`: The resulting state.
+        '''
+        if speed > 0:
+            return self.update(speed=speed, last_speed=speed)
+        return self.update(speed=speed)
+
+    def subscribe(self, handler):
+        '''Adds a function to call on every change.
+
+        Args:
+            handler (callable): Function called with the new state.
+        '''
+        self.subscribers = self.subscribers + [handler]
+
+    def unsubscribe(self, handler):
+        '''Removes a function added with subscribe.
+
+        Args:
+            handler (callable): The function.
+        '''
+        self.subscribers = [h for h in self.subscribers if h is not handler]
+
+    def notify(self, state):
+        '''Helper method to call the subscribers with a new state. Changes made meanwhile by
+        other threads are notified on their own, so a subscriber may be called with a state
+        older than the current one; those that only need the latest should read it with get().
+
+        Args:
+            state (:obj:`AppState`): The new state.
+        '''
+        for handler in self.subscribers:
+            try:
+                handler(state)
+            except Exception as e:
+                print('Exception at StateStore.notify')
+                print(type(e))
+                print(e)
+                traceback.print_tb(e.__traceback__)
@@ -1,3 +1,7 @@
+import os
+import json
+from shutil import copyfile
+
 def c_to_f(celcius):
     '''Utility method to convert Celcius degrees to Fahrenheit degrees.
 
@@ -6,18 +10,30 @@ def c_to_f(celcius):
     '''
     return celcius * 9 / 5 + 32
 
-class Message():
-    def __init__(self, type, action = None, params = None):
-        '''Utility class to represent messages being used in queue communication between thread
-        queues.
-
-        Params:
-            type (:obj:`str`): String identifier for the type of message.
-            action (:obj:`str`, optional): String identifier for the action to be executed. Thought
-                as a type subcategory. Defaults to None.
-            params (:obj:`dict`, optional): Dictionary of parameters to be used when executing the
-                corresponding action. Defaults to None.
-        '''
-        self.type = type
-        self.action = action
-        self.params = params
+def load_config(section):
+    '''Utility method to load a section of the app configuration. Notice that this method loads
+    config info from '/assets/config/app_config.json' file, if the document is not found the
+    template is copied in place. Values missing from the config file fall back to the ones found
+    in the template.
+
+    Params:
+        section (:obj:`str`): Name of the configuration section to load, i.e. 'db_writer'.
+
+    Returns:
+        :obj:`dict`: The configuration values for the given section.
+    '''
+    dirname = os.path.dirname(__file__)
+    config_path = os.path.join(dirname, '../../assets/config/app_config.json')
+
+    # Verify the app config file exists. If not, copy the template.
+    if not os.path.exists(config_path):
+        print('initializing app config from template...')
+        copyfile(config_path + '_template', config_path)
+
+    with open(config_path + '_template', 'r') as f:
+        conf = json.load(f).get(section, {})
+
+    with open(config_path, 'r') as f:
+        conf.update(json.load(f).get(section, {}))
+
+    return conf
@@ -0,0 +1,6 @@
+import os
+import sys
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+# scripts run by hand against the whole app, not tests.
+collect_ignore = ['context.py', 'main_test.py', 'servermock.py']
@@ -5,11 +5,11 @@ from threading import Thread
 sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
 
 from smartcoil.server.Manager import ServerManager
-from smartcoil.utils.utils import Message
+from smartcoil.utils.eventBus import MsgType, RequestBroker
 
 iq = Queue()
-oq = Queue()
-srv = ServerManager(iq, oq);
+broker = RequestBroker(iq)
+srv = ServerManager(iq, broker);
 
 def run_server():
     srv.run()
@@ -28,7 +28,7 @@ while True:
     action = msg.action
     info = msg.params
 
-    if not (type == 'SRVMSG' and action == 'SCOIL_STATE'):
+    if not (type == MsgType.SRVMSG and action == 'SCOIL_STATE'):
         print('*LISTENING MOCK*')
         continue
 
@@ -37,4 +37,4 @@ while True:
     cur_temp = 100
     usr_temp = 69
     info = {'state': state, 'speed': speed, 'cur_temp': cur_temp, 'usr_temp': usr_temp}
-    oq.put(Message('APPMSG', 'SCOIL_STATE-R', info))
+    broker.resolve(msg.corr_id, info)
@@ -0,0 +1,101 @@
+import sqlite3
+from datetime import date, datetime, timedelta
+
+import pytest
+
+from smartcoil.database.backup import BackupManager, LOGGED_TABLES
+from smartcoil.database.migrations import SchemaMigrator
+from smartcoil.database.storage import StorageCodec, convert_to_v2
+
+START = datetime(2026, 3, 1)
+
+@pytest.fixture(params=['v1', 'v2'])
+def dbase(request, tmp_path):
+    path = str(tmp_path / 'SmartCoilDB.db')
+    SchemaMigrator(path).migrate()
+    if request.param == 'v2':
+        convert_to_v2(path)
+    conn = sqlite3.connect(path)
+    yield path, conn
+    conn.close()
+
+def insert(conn, table, row):
+    codec = StorageCodec.load(conn)
+    crsr = conn.cursor()
+    row = codec.encode_row(crsr, table, row)
+    crsr.execute('INSERT INTO {} VALUES ({})'.format(table, ', '.join('?' * len(row))), row)
+
+def sensor(conn, minute):
+    insert(conn, 'SENSOR_BME680_DATA',
+           [START + timedelta(minutes=minute), 20.5, 50, 1000, 1, 50, 1])
+
+def dump(conn, table):
+    return sorted(map(repr, conn.execute('SELECT * FROM {}'.format(table)).fetchall()))
+
+def test_restore_matches_the_db(dbase, tmp_path):
+    path, conn = dbase
+    for i in range(10):
+        sensor(conn, i)
+    conn.execute('INSERT INTO FANCOIL_RUNS (start_time, end_time, speed, mode) VALUES (?,?,?,?)',
+                 (START, None, 1, 'COOL'))
+    conn.commit()
+
+    backups = BackupManager(path, backup_dir=str(tmp_path / 'backups'))
+    backups.full_backup()
+
+    for i in range(10, 20):
+        sensor(conn, i)
+    # rows loaded late, older than the ones already backed up.
+    sensor(conn, -100)
+    conn.execute('UPDATE FANCOIL_RUNS SET end_time = ? WHERE start_time = ?',
+                 (START + timedelta(hours=1), START))
+    insert(conn, 'YR_WEATHER_API_DATA',
+           [START, 1.1, 2.2, 10, 50, 1000, 'rain', 3, 4, 'N', 10, 0.5])
+    conn.commit()
+    first = backups.incremental_backup()
+    assert first['rows']['SENSOR_BME680_DATA'] == 11
+    assert first['rows']['FANCOIL_RUNS'] == 1
+
+    # a second increment right away must not overwrite the first one.
+    conn.execute('INSERT INTO DAILY_SUMMARY (day, indoor_min, finalized_at) VALUES (?,?,?)',
+                 (date(2026, 3, 1), 20.0, datetime.now()))
+    sensor(conn, -200)
+    conn.commit()
+    second = backups.incremental_backup()
+    assert second['rows']['SENSOR_BME680_DATA'] == 1
+    assert conn.execute('SELECT count(*) FROM CHANGE_LOG').fetchone() == (0,)
+
+    target = str(tmp_path / 'restored.db')
+    restored = backups.restore(target)
+    assert restored['SENSOR_BME680_DATA'] == 12
+
+    rconn = sqlite3.connect(target)
+    try:
+        for table in LOGGED_TABLES:
+            assert dump(rconn, table) == dump(conn, table), table
+        assert rconn.execute('SELECT count(*) FROM CHANGE_LOG').fetchone() == (0,)
+    finally:
+        rconn.close()
+
+def test_incremental_without_full_takes_a_full(dbase, tmp_path):
+    path, conn = dbase
+    sensor(conn, 0)
+    conn.commit()
+
+    backups = BackupManager(path, backup_dir=str(tmp_path / 'backups'))
+    assert backups.incremental_backup()['rows'] == {}
+    manifest = backups.read_manifest()
+    assert manifest['increments'] == []
+
+    target = str(tmp_path / 'restored.db')
+    backups.restore(target)
+    rconn = sqlite3.connect(target)
+    try:
+        assert dump(rconn, 'SENSOR_BME680_DATA') == dump(conn, 'SENSOR_BME680_DATA')
+    finally:
+        rconn.close()
+
+def test_restore_without_backup_fails(tmp_path):
+    backups = BackupManager(str(tmp_path / 'SmartCoilDB.db'), backup_dir=str(tmp_path))
+    with pytest.raises(FileNotFoundError):
+        backups.restore(str(tmp_path / 'restored.db'))
@@ -0,0 +1,74 @@
+import sqlite3
+from datetime import datetime, timedelta
+
+import pytest
+
+from smartcoil.database.columnar import ColumnarArchive
+from smartcoil.database.migrations import SchemaMigrator
+
+START = datetime(2026, 3, 1)
+
+@pytest.fixture
+def archive(tmp_path):
+    path = str(tmp_path / 'SmartCoilDB.db')
+    SchemaMigrator(path).migrate()
+    sensor(path, range(100))
+    return ColumnarArchive(path, root=str(tmp_path / 'columnar'))
+
+def sensor(path, minutes):
+    conn = sqlite3.connect(path)
+    conn.executemany('INSERT INTO SENSOR_BME680_DATA VALUES (?,?,?,?,?,?,?)',
+                     [(START + timedelta(minutes=m), 20 + m / 100, 50, 1013, 150000, 60, m % 2)
+                      for m in minutes])
+    conn.commit()
+    conn.close()
+
+def timestamps(archive):
+    table = archive.open('SENSOR_BME680_DATA')
+    try:
+        return [int(t) for t in table.column('timestamp')]
+    finally:
+        table.close()
+
+def minutes(archive):
+    start = START.timestamp() * 1000
+    return [round((t - start) / 60000) for t in timestamps(archive)]
+
+def test_append_skips_older_rows(archive):
+    assert archive.run_once()['SENSOR_BME680_DATA'] == 100
+    sensor(archive.dbase_path, [-10, 150])
+
+    # the late row is left out, the archive only moves forward.
+    assert archive.run_once()['SENSOR_BME680_DATA'] == 1
+    assert minutes(archive) == list(range(100)) + [150]
+
+def test_rebuild_since_copies_late_rows(archive):
+    archive.run_once()
+    sensor(archive.dbase_path, [49.5, 200])
+
+    appended = archive.rebuild(START + timedelta(minutes=40))
+    assert appended['SENSOR_BME680_DATA'] == 62
+    stamps = timestamps(archive)
+    assert stamps == sorted(stamps) and len(stamps) == 102
+    assert START.timestamp() * 1000 + 49.5 * 60000 in stamps
+
+    table = archive.open('SENSOR_BME680_DATA')
+    try:
+        lo, hi = table.search(START + timedelta(minutes=49), START + timedelta(minutes=51))
+        assert hi - lo == 3
+        assert [int(v) for v in table.column('fancoil_running')[lo:hi]] == [1, 1, 0]
+    finally:
+        table.close()
+
+def test_full_rebuild(archive):
+    archive.run_once()
+    sensor(archive.dbase_path, [-30])
+
+    assert archive.rebuild()['SENSOR_BME680_DATA'] == 101
+    assert minutes(archive) == [-30] + list(range(100))
+    # nothing new, the next sync appends nothing.
+    assert archive.run_once()['SENSOR_BME680_DATA'] == 0
+
+def test_rebuild_of_an_empty_archive(archive):
+    assert archive.rebuild(START)['SENSOR_BME680_DATA'] == 100
+    assert minutes(archive) == list(range(100))
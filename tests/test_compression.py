@@ -0,0 +1,85 @@
+import math
+import random
+from datetime import datetime, timedelta
+
+from smartcoil.database.compression import SwingingDoorCompressor
+from smartcoil.database.storage import TABLES
+
+COLUMNS = TABLES['SENSOR_BME680_DATA']
+TOLERANCES = {'temperature': 0.25, 'humidity': 0.5, 'pressure': 0.5, 'gas_resistance': 2000,
+              'air_quality': 2}
+START = datetime(2026, 3, 1)
+
+def readings(count, running = lambda i: 0):
+    '''Noisy sensor readings, one per second.'''
+    rnd = random.Random(6)
+    for i in range(count):
+        yield [START + timedelta(seconds=i),
+               22 + 2 * math.sin(i / 600) + rnd.uniform(-0.05, 0.05),
+               50 + 5 * math.sin(i / 900) + rnd.uniform(-0.1, 0.1),
+               1013 + rnd.uniform(-0.1, 0.1),
+               150000 + 20000 * math.sin(i / 300),
+               60 + rnd.uniform(-0.5, 0.5),
+               running(i)]
+
+def compress(compressor, rows):
+    stored = []
+    for row in rows:
+        stored.extend(compressor.add(row))
+    stored.extend(compressor.flush())
+    return stored
+
+def test_reconstruct_is_within_tolerance():
+    compressor = SwingingDoorCompressor(COLUMNS, TOLERANCES, enabled=True)
+    rows = list(readings(3600))
+    stored = compress(compressor, rows)
+
+    assert len(stored) < len(rows) / 5
+    assert stored[0] == rows[0] and stored[-1] == rows[-1]
+
+    rebuilt = list(compressor.reconstruct(stored, (r[0] for r in rows)))
+    assert len(rebuilt) == len(rows)
+    for orig, row in zip(rows, rebuilt):
+        assert row[0] == orig[0]
+        for col, a, b in zip(COLUMNS[1:], orig[1:], row[1:]):
+            assert abs(a - b) <= TOLERANCES.get(col, 0) + 1e-9, (orig[0], col)
+
+def test_steps_keep_both_sides():
+    compressor = SwingingDoorCompressor(COLUMNS, TOLERANCES, enabled=True)
+    rows = list(readings(600, running=lambda i: int(i >= 300)))
+    stored = compress(compressor, rows)
+
+    stamps = [r[0] for r in stored]
+    assert rows[299][0] in stamps and rows[300][0] in stamps
+
+    rebuilt = list(compressor.reconstruct(stored, (r[0] for r in rows)))
+    assert [r[-1] for r in rebuilt] == [r[-1] for r in rows]
+
+def test_max_interval_bounds_the_gap():
+    compressor = SwingingDoorCompressor(COLUMNS, TOLERANCES, max_interval=60, enabled=True)
+    rows = [[START + timedelta(seconds=i), 22, 50, 1013, 150000, 60, 0] for i in range(600)]
+    stored = compress(compressor, rows)
+
+    gaps = [(b[0] - a[0]).total_seconds() for a, b in zip(stored, stored[1:])]
+    assert max(gaps) <= 61
+    assert compressor.get_stats()['rows_in'] == 600
+
+def test_disabled_stores_every_row():
+    compressor = SwingingDoorCompressor(COLUMNS, TOLERANCES, enabled=False)
+    rows = list(readings(100))
+    assert compress(compressor, rows) == rows
+    assert compressor.get_stats()['ratio'] == 1
+
+def test_reconstruct_leaves_long_gaps_empty():
+    compressor = SwingingDoorCompressor(COLUMNS, TOLERANCES, enabled=True)
+    stored = [[START, 20, 50, 1013, 150000, 60, 0],
+              [START + timedelta(seconds=60), 21, 50, 1013, 150000, 60, 0],
+              [START + timedelta(seconds=3660), 25, 50, 1013, 150000, 60, 0]]
+    grid = (START + timedelta(seconds=30 * i) for i in range(10 ** 6))
+
+    rebuilt = list(compressor.reconstruct(stored, grid, max_gap=600))
+    stamps = [r[0] for r in rebuilt]
+    assert stamps[:3] == [START + timedelta(seconds=s) for s in (0, 30, 60)]
+    assert rebuilt[1][1] == 20.5
+    # nothing rebuilt between the 2nd and 3rd rows, the endless grid stops at the last one.
+    assert stamps[3:] == [stored[2][0]]
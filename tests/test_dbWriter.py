@@ -0,0 +1,132 @@
+import sqlite3
+import threading
+from datetime import datetime, timedelta
+
+import pytest
+
+from smartcoil.database.dbWriter import DBWriter
+from smartcoil.database.migrations import SchemaMigrator
+
+START = datetime(2026, 3, 1)
+INSERT = 'INSERT INTO USER_DATA VALUES (?,?,?)'
+
+@pytest.fixture
+def dbase(tmp_path):
+    path = str(tmp_path / 'SmartCoilDB.db')
+    SchemaMigrator(path).migrate()
+    return path
+
+@pytest.fixture
+def writer(dbase):
+    writer = DBWriter(dbase, max_retries=8, retry_delay=0.02)
+    writer.connect()
+    # fail fast on a held lock, the retries are what's under test.
+    writer.conn.execute('PRAGMA busy_timeout = 10')
+    yield writer
+    writer.conn.close()
+
+@pytest.fixture
+def lock(dbase):
+    '''A second connection holding the write lock until released.'''
+    conn = sqlite3.connect(dbase, isolation_level=None, check_same_thread=False)
+    conn.execute('PRAGMA journal_mode=WAL')
+    conn.execute('BEGIN IMMEDIATE')
+    yield conn
+    if conn.in_transaction:
+        conn.execute('COMMIT')
+    conn.close()
+
+def batch(count):
+    return [(INSERT, [START + timedelta(seconds=i), 75, 1]) for i in range(count)]
+
+def stored(path):
+    conn = sqlite3.connect(path)
+    try:
+        return conn.execute('SELECT count(*) FROM USER_DATA').fetchone()[0]
+    finally:
+        conn.close()
+
+class TxnCounter():
+    '''Counts rows seen by an INSERT hook, the way RollupManager stages its state.'''
+
+    def __init__(self, writer, table = 'USER_DATA'):
+        self.staged = 0
+        self.committed = 0
+        self.commits = 0
+        self.rollbacks = 0
+        writer.add_hook(table, self.hook)
+        writer.add_transaction_hook(self.commit, self.rollback)
+
+    def hook(self, crsr, params):
+        self.staged += 1
+
+    def commit(self):
+        self.committed += self.staged
+        self.staged = 0
+        self.commits += 1
+
+    def rollback(self):
+        self.staged = 0
+        self.rollbacks += 1
+
+def test_batch_is_retried_until_the_lock_is_released(dbase, writer, lock):
+    counter = TxnCounter(writer)
+    release = threading.Timer(0.15, lock.execute, ['COMMIT'])
+    release.start()
+    writer.commit_batch(batch(5))
+    release.join()
+
+    stats = writer.get_stats()
+    assert stats['retries'] >= 1
+    assert (stats['rows_committed'], stats['rows_failed'], stats['transactions']) == (5, 0, 1)
+    assert (counter.committed, counter.commits) == (5, 1)
+    assert counter.rollbacks == stats['retries']
+    assert stored(dbase) == 5
+
+def test_batch_is_dropped_after_max_retries(dbase, writer, lock):
+    writer.max_retries = 2
+    counter = TxnCounter(writer)
+    writer.commit_batch(batch(5))
+
+    stats = writer.get_stats()
+    assert (stats['retries'], stats['rows_failed'], stats['rows_committed']) == (2, 5, 0)
+    assert (counter.rollbacks, counter.commits, counter.committed) == (3, 0, 0)
+
+    lock.execute('COMMIT')
+    assert stored(dbase) == 0
+
+def test_rolled_back_hook_work_is_not_counted_twice(dbase, writer):
+    counter = TxnCounter(writer)
+    calls = []
+
+    def busy_once(crsr, params):
+        # the lock is lost halfway through the batch, after some hooks already ran.
+        calls.append(params)
+        if len(calls) == 3:
+            raise sqlite3.OperationalError('database is locked')
+
+    writer.add_hook('USER_DATA', busy_once)
+    writer.commit_batch(batch(5))
+
+    assert writer.get_stats()['retries'] == 1
+    assert (counter.rollbacks, counter.commits, counter.committed) == (1, 1, 5)
+    assert stored(dbase) == 5
+
+def test_failing_statement_is_skipped(dbase):
+    writer = DBWriter(dbase, flush_interval=0.01)
+    thread = threading.Thread(target=writer.run)
+    thread.start()
+    try:
+        for sql, params in batch(2):
+            writer.submit(sql, params)
+        writer.submit('INSERT INTO NO_SUCH_TABLE VALUES (?)', [1])
+        writer.submit(INSERT, [START + timedelta(hours=1), 70, 2])
+        assert writer.flush(5)
+    finally:
+        writer.close()
+        thread.join(5)
+
+    stats = writer.get_stats()
+    assert (stats['rows_committed'], stats['rows_failed'], stats['retries']) == (3, 1, 0)
+    assert stored(dbase) == 3
+    assert not thread.is_alive()
@@ -0,0 +1,223 @@
+import time
+import threading
+from queue import Empty, Full
+
+import pytest
+
+from smartcoil.utils.eventBus import EventBus, Message, MsgType, PriorityChannel, RequestBroker
+
+def test_lanes_are_served_by_priority():
+    channel = PriorityChannel()
+    channel.put(Message(MsgType.WTHMSG))
+    channel.put(Message(MsgType.SNSMSG))
+    channel.put(Message(MsgType.GUIMSG))
+
+    assert [channel.get().type for _ in range(3)] == [MsgType.GUIMSG, MsgType.SNSMSG,
+                                                      MsgType.WTHMSG]
+    with pytest.raises(Empty):
+        channel.get(block=False)
+
+def test_drop_oldest_makes_room_in_a_full_lane():
+    # the app sends a single source, this takes senders with several of them to fill the lane.
+    channel = PriorityChannel(max_pending={'SENSOR': 2})
+    for source in ('a', 'b', 'c'):
+        channel.put(Message(MsgType.SNSMSG, source))
+
+    assert channel.qsize() == 2
+    assert [channel.get().action for _ in range(2)] == ['b', 'c']
+    assert channel.get_stats()['dropped'] == {'SNSMSG': 1}
+
+    # the dropped source is no longer pending, so it's queued again instead of coalesced.
+    channel.put(Message(MsgType.SNSMSG, 'a'))
+    assert channel.get().action == 'a'
+
+def test_app_notifications_never_fill_their_lane():
+    channel = PriorityChannel(max_pending={'SENSOR': 2, 'BOOKKEEPING': 2})
+    for _ in range(10):
+        channel.put(Message(MsgType.SNSMSG))
+        channel.put(Message(MsgType.WTHMSG))
+
+    assert channel.qsize() == 2
+    assert channel.get_stats()['dropped'] == {}
+
+def test_block_rejects_once_the_timeout_expires():
+    channel = PriorityChannel(max_pending={'CONTROL': 1}, block_timeout=0.05)
+    channel.put(Message(MsgType.GUIMSG))
+
+    start = time.monotonic()
+    with pytest.raises(Full):
+        channel.put(Message(MsgType.GUIMSG))
+    assert time.monotonic() - start >= 0.05
+
+    stats = channel.get_stats()
+    assert stats['blocked'] == {'GUIMSG': 1}
+    assert stats['rejected'] == {'GUIMSG': 1}
+    assert channel.qsize() == 1
+
+def test_block_waits_for_room():
+    channel = PriorityChannel(max_pending={'CONTROL': 1}, block_timeout=5)
+    channel.put(Message(MsgType.GUIMSG, 'first'))
+
+    taker = threading.Timer(0.05, channel.get)
+    taker.start()
+    channel.put(Message(MsgType.GUIMSG, 'second'))
+    taker.join()
+
+    assert channel.get(timeout=1).action == 'second'
+    assert channel.get_stats()['rejected'] == {}
+
+def test_reject_fails_right_away():
+    channel = PriorityChannel(max_pending={'CONTROL': 1}, block_timeout=5)
+    channel.put(Message(MsgType.GUIMSG))
+
+    start = time.monotonic()
+    with pytest.raises(Full):
+        channel.put(Message(MsgType.SRVMSG, 'SCOIL_SWTCH'))
+    assert time.monotonic() - start < 1
+    assert channel.get_stats()['rejected'] == {'SRVMSG': 1}
+
+def test_rejected_server_request_answers_503():
+    flask = pytest.importorskip('flask')
+    from smartcoil.server.Manager import Endpoint, ServerManager
+
+    bus = EventBus(max_pending={'CONTROL': 1})
+    bus.put(Message(MsgType.GUIMSG))
+    # built without its constructor, so no tunnel config is loaded.
+    server = ServerManager.__new__(ServerManager)
+    server.outbound_queue = bus
+    server.acces_token = 'token'
+
+    app = flask.Flask(__name__)
+    body = {'token': 'token', 'switch': 'ON', 'request': {}}
+    with app.test_request_context(json=body):
+        response = Endpoint(server.turn_smartcoil)()
+
+    assert response.status_code == 503
+    assert bus.qsize() == 1
+
+def test_exit_is_forced_past_the_bound():
+    channel = PriorityChannel(max_pending={'CONTROL': 1})
+    channel.put(Message(MsgType.GUIMSG))
+    channel.put(Message(MsgType.EXIT))
+
+    assert channel.qsize() == 2
+    assert channel.get_stats()['CONTROL']['pending'] == 2
+    assert [channel.get().type for _ in range(2)] == [MsgType.GUIMSG, MsgType.EXIT]
+
+def test_notifications_are_coalesced_per_source():
+    channel = PriorityChannel()
+    for _ in range(3):
+        channel.put(Message(MsgType.SNSMSG, 'bme680'))
+    channel.put(Message(MsgType.SNSMSG, 'other'))
+    channel.put(Message(MsgType.WTHMSG, 'bme680'))
+
+    assert channel.qsize() == 3
+    assert channel.get_stats()['coalesced'] == {'SNSMSG': 2, 'WTHMSG': 0}
+
+    assert channel.get().action == 'bme680'
+    # once taken, the next notification of the source is queued again.
+    channel.put(Message(MsgType.SNSMSG, 'bme680'))
+    assert channel.qsize() == 3
+
+def test_commands_are_never_coalesced():
+    channel = PriorityChannel()
+    for _ in range(3):
+        channel.put(Message(MsgType.GUIMSG))
+    assert channel.qsize() == 3
+
+def test_starved_lane_is_served_after_max_skips():
+    channel = PriorityChannel(max_skips=2)
+    channel.put(Message(MsgType.WTHMSG))
+    channel.put(Message(MsgType.SNSMSG))
+    for i in range(6):
+        channel.put(Message(MsgType.GUIMSG, i))
+
+    order = [channel.get() for _ in range(8)]
+    types = [msg.type for msg in order]
+    assert types[:3] == [MsgType.GUIMSG, MsgType.GUIMSG, MsgType.SNSMSG]
+    assert types[3] == MsgType.WTHMSG
+    # commands keep their order around the lower lanes.
+    assert [msg.action for msg in order if msg.type == MsgType.GUIMSG] == list(range(6))
+
+def answer(bus, broker, reply, count = 1):
+    '''Stands for the main thread, answering the next requests put on the bus.'''
+    def run():
+        for _ in range(count):
+            msg = bus.get(timeout=5)
+            broker.resolve(msg.corr_id, reply(msg))
+    thread = threading.Thread(target=run)
+    thread.start()
+    return thread
+
+def test_request_gets_its_answer():
+    bus = EventBus()
+    broker = RequestBroker(bus)
+    responder = answer(bus, broker, lambda msg: (msg.action, msg.params))
+    assert broker.request(MsgType.SRVMSG, 'SCOIL_STATE', {'x': 1}) == ('SCOIL_STATE', {'x': 1})
+    responder.join()
+    assert broker.get_stats() == {'pending': 0, 'answered': 1, 'timeouts': 0, 'late': 0}
+
+def test_concurrent_requests_get_their_own_answers():
+    bus = EventBus()
+    broker = RequestBroker(bus)
+    answers = {}
+
+    def ask(n):
+        answers[n] = broker.request(MsgType.SRVMSG, 'SCOIL_TEMP', {'value': n})
+
+    callers = [threading.Thread(target=ask, args=(n,)) for n in range(5)]
+    for caller in callers:
+        caller.start()
+    responder = answer(bus, broker, lambda msg: msg.params['value'] * 10, count=5)
+    for caller in callers:
+        caller.join()
+    responder.join()
+
+    assert answers == {n: n * 10 for n in range(5)}
+    assert broker.get_stats()['answered'] == 5
+
+def test_timeout_returns_the_fallback_and_drops_late_answers():
+    bus = EventBus()
+    broker = RequestBroker(bus, timeout=0.05)
+    assert broker.request(MsgType.SRVMSG, 'SCOIL_STATE', fallback='last known') == 'last known'
+    assert broker.get_stats() == {'pending': 0, 'answered': 0, 'timeouts': 1, 'late': 0}
+
+    # the main thread gets to the request after the caller gave up.
+    msg = bus.get(block=False)
+    broker.resolve(msg.corr_id, 'too late')
+    assert broker.get_stats() == {'pending': 0, 'answered': 0, 'timeouts': 1, 'late': 1}
+
+    # a new request gets a new correlation id, it's never answered with the late one.
+    responder = answer(bus, broker, lambda msg: msg.corr_id)
+    assert broker.request(MsgType.SRVMSG, 'SCOIL_STATE', timeout=5) == msg.corr_id + 1
+    responder.join()
+
+def test_shared_requests_wait_on_a_single_message():
+    bus = EventBus()
+    broker = RequestBroker(bus)
+    answers = []
+
+    def ask():
+        answers.append(broker.request(MsgType.SRVMSG, 'SCOIL_STATE', shared=True))
+
+    callers = [threading.Thread(target=ask) for _ in range(3)]
+    for caller in callers:
+        caller.start()
+    time.sleep(0.1)
+    assert bus.qsize() == 1
+    assert broker.get_stats()['pending'] == 1
+
+    msg = bus.get(block=False)
+    broker.resolve(msg.corr_id, 'state')
+    for caller in callers:
+        caller.join()
+    assert answers == ['state'] * 3
+    assert broker.get_stats()['answered'] == 1
+
+def test_rejected_request_is_not_left_pending():
+    bus = EventBus(max_pending={'CONTROL': 1})
+    bus.put(Message(MsgType.GUIMSG))
+    broker = RequestBroker(bus)
+    with pytest.raises(Full):
+        broker.request(MsgType.SRVMSG, 'SCOIL_SWTCH', {'value': 'on'})
+    assert broker.get_stats()['pending'] == 0
@@ -0,0 +1,119 @@
+import csv
+import os
+import sqlite3
+import subprocess
+import sys
+from datetime import datetime, timedelta
+
+import pytest
+
+from smartcoil.database.importer import BulkImporter
+from smartcoil.database.migrations import SchemaMigrator
+from smartcoil.database.storage import StorageCodec, TABLES, convert_to_v2
+
+ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+START = datetime(2026, 3, 1)
+INDEX = 'IDX_SENSOR_BME680_DATA_TIMESTAMP'
+
+@pytest.fixture(params=['v1', 'v2'])
+def dbase(request, tmp_path):
+    path = str(tmp_path / 'SmartCoilDB.db')
+    SchemaMigrator(path).migrate()
+    if request.param == 'v2':
+        convert_to_v2(path)
+    conn = sqlite3.connect(path)
+    codec = StorageCodec.load(conn)
+    crsr = conn.cursor()
+    for m in range(0, 10):
+        crsr.execute('INSERT INTO SENSOR_BME680_DATA VALUES (?,?,?,?,?,?,?)',
+                     codec.encode_row(crsr, 'SENSOR_BME680_DATA', sensor_row(m)))
+    conn.commit()
+    conn.close()
+    return path
+
+def sensor_row(minute):
+    return [START + timedelta(minutes=minute), 21.5, 50.25, 1013.5, 150000, 60, 0]
+
+def write_csv(path, minutes):
+    with open(path, 'w', newline='') as f:
+        writer = csv.writer(f)
+        writer.writerow(TABLES['SENSOR_BME680_DATA'])
+        for m in minutes:
+            row = sensor_row(m)
+            writer.writerow([row[0].isoformat()] + row[1:])
+    return str(path)
+
+def stored(path):
+    conn = sqlite3.connect(path)
+    try:
+        codec = StorageCodec.load(conn)
+        return [codec.decode_row(conn, 'SENSOR_BME680_DATA', r) for r in
+                conn.execute('SELECT * FROM SENSOR_BME680_DATA ORDER BY timestamp')]
+    finally:
+        conn.close()
+
+def indexes(path):
+    conn = sqlite3.connect(path)
+    try:
+        return {n for n, in conn.execute("SELECT name FROM sqlite_master WHERE type = 'index'")}
+    finally:
+        conn.close()
+
+@pytest.mark.parametrize('defer_indexes', [False, True])
+def test_duplicate_timestamps_are_skipped(dbase, tmp_path, defer_indexes):
+    # 5 to 9 are stored already, 12 is repeated within the file.
+    fpath = write_csv(tmp_path / 'history.csv', [-5, 5, 6, 7, 8, 9, 10, 11, 12, 12, -4])
+    before = indexes(dbase)
+
+    importer = BulkImporter(dbase, txn_rows=4, pause=0, defer_indexes=defer_indexes)
+    stats = importer.import_file(fpath, 'SENSOR_BME680_DATA')
+
+    assert (stats['read'], stats['inserted'], stats['skipped']) == (11, 5, 6)
+    assert stats['first'] == START - timedelta(minutes=5)
+    assert stats['last'] == START + timedelta(minutes=12)
+    assert [r[0] for r in stored(dbase)] == [START + timedelta(minutes=m)
+                                             for m in [-5, -4] + list(range(13))]
+    assert stored(dbase)[0] == sensor_row(-5)
+    # the deferred index is back once the load is done.
+    assert indexes(dbase) == before
+
+def test_deferred_index_is_dropped_during_the_load(dbase, tmp_path, monkeypatch):
+    fpath = write_csv(tmp_path / 'history.csv', range(20, 30))
+    seen = []
+    insert_chunk = BulkImporter.insert_chunk
+
+    def spy(self, conn, *args):
+        seen.append({n for n, in conn.execute("SELECT name FROM sqlite_master "
+                                              + "WHERE type = 'index'")})
+        return insert_chunk(self, conn, *args)
+
+    monkeypatch.setattr(BulkImporter, 'insert_chunk', spy)
+    BulkImporter(dbase, txn_rows=5, pause=0, defer_indexes=True).import_file(
+        fpath, 'SENSOR_BME680_DATA')
+
+    assert len(seen) == 2
+    conn = sqlite3.connect(dbase)
+    try:
+        v1 = StorageCodec.load(conn).format == 'v1'
+    finally:
+        conn.close()
+    assert all(INDEX not in names for names in seen)
+    # v2 tables are clustered on their timestamp, they have no index to rebuild.
+    assert (INDEX in indexes(dbase)) == v1
+
+def test_nothing_new_reports_no_range(dbase, tmp_path):
+    fpath = write_csv(tmp_path / 'history.csv', range(10))
+    stats = BulkImporter(dbase, pause=0).import_file(fpath, 'SENSOR_BME680_DATA')
+    assert (stats['inserted'], stats['first'], stats['last']) == (0, None, None)
+
+def test_import_command_lists_the_follow_ups(dbase, tmp_path):
+    fpath = write_csv(tmp_path / 'history.csv', [-60, 30])
+    env = dict(os.environ, PYTHONPATH=ROOT)
+    out = subprocess.run([sys.executable, os.path.join(ROOT, 'bin', 'smartcoil'), 'import',
+                          '--db', dbase, '--table', 'SENSOR_BME680_DATA', '--pause', '0', fpath],
+                         env=env, capture_output=True, text=True, check=True).stdout
+
+    assert '2 inserted, 0 duplicates skipped' in out
+    assert 'smartcoil rebuild-rollups' in out
+    assert 'smartcoil summary --backfill --start 2026-02-28 --end 2026-03-01' in out
+    assert 'smartcoil columnar-sync --since 2026-02-28T23:00:00' in out
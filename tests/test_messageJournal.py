@@ -0,0 +1,118 @@
+import os
+import types
+from datetime import date, datetime, timedelta
+
+import pytest
+
+from smartcoil.utils import messageJournal
+from smartcoil.utils.eventBus import Message, MsgType
+from smartcoil.utils.messageJournal import MessageJournal, read_journal, valid_length
+
+START = datetime(2026, 3, 1, 12)
+
+# Messages as the app journaled them: sensor readings (temperature, pressure, humidity, gas,
+# air quality) with the cooling setpoint at 75 and the fancoil control state at that time.
+SESSION = [
+    (MsgType.SNSMSG, [80, 1013, 45, 150000, 60], [75, 2, 2], [False, 0, False]),
+    (MsgType.SNSMSG, [76, 1013, 45, 150000, 60], [75, 2, 2], [False, 2, True]),
+    (MsgType.SNSMSG, [72, 1013, 45, 150000, 60], [75, 2, 2], [False, 2, True]),
+    (MsgType.SNSMSG, [76, 1013, 45, 150000, 60], [75, 2, 2], [True, 0, False]),
+    (MsgType.SNSMSG, [78, 1013, 45, 150000, 60], [75, 2, 2], [True, 0, False]),
+    (MsgType.GUIMSG, [78, 1013, 45, 150000, 60], [75, 3, 3], [False, 2, True]),
+]
+
+# Relay switches the session above must always replay to, as (minutes after START, speed).
+SWITCHES = [(0, 2), (2, 0), (4, 2), (5, 3)]
+
+@pytest.fixture
+def clock(monkeypatch):
+    '''Clock of the journal, set to the minutes after START a record is written at.'''
+    clock = types.SimpleNamespace(minute=0)
+    clock.time = lambda: (START + timedelta(minutes=clock.minute)).timestamp()
+    monkeypatch.setattr(messageJournal, 'time', clock)
+    return clock
+
+def write_session(path, clock, messages = SESSION, first = 0):
+    journal = MessageJournal(str(path), fsync_interval=0, enabled=True)
+    for minute, (msg_type, sensor, user, control) in enumerate(messages, first):
+        clock.minute = minute
+        journal.record(Message(msg_type), {'mode': 'COOL', 'sensor': sensor, 'user': user,
+                                           'control': control})
+    journal.close()
+    return journal.file_for(date.today())
+
+def test_records_read_back(tmp_path, clock):
+    fpath = write_session(tmp_path, clock)
+
+    records = list(read_journal(fpath))
+    assert len(records) == len(SESSION)
+    tstamp, msg_type, action, params, state = records[-1]
+    assert datetime.fromtimestamp(tstamp) == START + timedelta(minutes=5)
+    assert (msg_type, action, params) == (MsgType.GUIMSG, None, None)
+    assert state['user'] == [75, 3, 3]
+    assert valid_length(fpath) == os.path.getsize(fpath)
+
+@pytest.mark.parametrize('damage', ['torn', 'corrupted'])
+def test_damaged_tail_is_dropped(tmp_path, clock, damage):
+    fpath = write_session(tmp_path, clock, SESSION[:-1])
+    good = os.path.getsize(fpath)
+    write_session(tmp_path, clock, SESSION[-1:], len(SESSION) - 1)
+    size = os.path.getsize(fpath)
+
+    with open(fpath, 'r+b') as f:
+        if damage == 'torn':
+            # power cut halfway through the last write.
+            f.truncate((good + size) // 2)
+        else:
+            f.seek(size - 6)
+            f.write(b'\xff')
+
+    assert valid_length(fpath) == good
+    assert len(list(read_journal(fpath))) == len(SESSION) - 1
+
+def test_reopening_cuts_the_damaged_tail(tmp_path, clock):
+    fpath = write_session(tmp_path, clock)
+    size = os.path.getsize(fpath)
+    with open(fpath, 'r+b') as f:
+        f.truncate(size - 3)
+
+    write_session(tmp_path, clock, SESSION[-1:], len(SESSION))
+    records = list(read_journal(fpath))
+    # the torn record is gone and the new one is readable right after the last good one.
+    assert len(records) == len(SESSION)
+    assert valid_length(fpath) == os.path.getsize(fpath)
+    assert datetime.fromtimestamp(records[-1][0]) == START + timedelta(minutes=6)
+
+def test_not_a_journal(tmp_path):
+    fpath = tmp_path / 'journal-2026-03-01.bin'
+    fpath.write_bytes(b'nope')
+    assert valid_length(str(fpath)) == 0
+    with pytest.raises(ValueError):
+        list(read_journal(str(fpath)))
+
+@pytest.mark.parametrize('keep_days, kept', [(3, 3), (0, 6)])
+def test_old_days_are_pruned(tmp_path, keep_days, kept):
+    journal = MessageJournal(str(tmp_path), keep_days=keep_days, enabled=True)
+    today = date(2026, 3, 10)
+    for days in range(1, 6):
+        open(journal.file_for(today - timedelta(days=days)), 'wb').close()
+
+    journal.open_day(today)
+    journal.close()
+    assert journal.files() == [journal.file_for(today - timedelta(days=d))
+                               for d in reversed(range(kept))]
+
+def test_replay_is_deterministic(tmp_path, clock):
+    replay = pytest.importorskip('smartcoil.JournalReplay')
+    fpath = write_session(tmp_path, clock)
+    # a torn record left at the end is not replayed.
+    with open(fpath, 'ab') as f:
+        f.write(b'\x10\x00\x00')
+
+    expected = [(START + timedelta(minutes=m), speed) for m, speed in SWITCHES]
+    for _ in range(2):
+        stats = replay.JournalReplay([fpath]).run()
+        assert stats['messages'] == len(SESSION)
+        assert stats['relay_switches'] == expected
+        assert stats['rows']['SENSOR_BME680_DATA'] >= 1
+        assert stats['rows']['USER_DATA'] == 1
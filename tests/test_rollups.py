@@ -0,0 +1,149 @@
+import os
+import shutil
+import sqlite3
+import threading
+from datetime import datetime, timedelta
+
+import pytest
+
+from smartcoil.database.dbWriter import DBWriter
+from smartcoil.database.migrations import SchemaMigrator
+from smartcoil.database.rollups import GRANULARITIES, RollupManager, SOURCES
+from smartcoil.database.storage import StorageCodec, convert_to_v2
+
+START = datetime(2026, 3, 1, 22)
+SENSOR = 'INSERT INTO SENSOR_BME680_DATA VALUES (?,?,?,?,?,?,?)'
+WEATHER = 'INSERT INTO YR_WEATHER_API_DATA VALUES (?,?,?,?,?,?,?,?,?,?,?,?)'
+MIGRATIONS = os.path.join(os.path.dirname(__file__), '../assets/db/migrations')
+
+@pytest.fixture(params=['v1', 'v2'])
+def dbase(request, tmp_path):
+    path = str(tmp_path / 'SmartCoilDB.db')
+    SchemaMigrator(path).migrate()
+    if request.param == 'v2':
+        convert_to_v2(path)
+    return path
+
+# readings with 2 decimals at most, stored as they are by v2 fixed-point columns.
+def sensor_row(secs, running):
+    return [START + timedelta(seconds=secs), round(20 + secs // 36 / 100, 2), 45.5, 1013.25,
+            150000, '-' if secs < 60 else 60 + secs % 7, running]
+
+def weather_row(secs):
+    return [START + timedelta(seconds=secs), 40.4, -3.7, round(10 + secs // 72 / 100, 2), 80,
+            1000, 'rain', 3, 4.5, 'N', 10, 0.5]
+
+def readings():
+    '''Sensor rows every 20 s for 4 hours past midnight, the fancoil switching every 10 minutes,
+    with a 15 minutes gap where the app was down; weather rows every 5 minutes.'''
+    for secs in range(0, 4 * 3600, 20):
+        if 3600 <= secs < 3600 + 900:
+            continue
+        yield 'SENSOR_BME680_DATA', sensor_row(secs, (secs // 600) % 2)
+        if secs % 300 == 0:
+            yield 'YR_WEATHER_API_DATA', weather_row(secs)
+
+def rollups(path):
+    conn = sqlite3.connect(path)
+    try:
+        return {(prefix, gran): conn.execute('SELECT * FROM {}_ROLLUP_{} ORDER BY bucket'
+                                             .format(prefix, gran)).fetchall()
+                for prefix, _, _ in SOURCES.values() for gran in GRANULARITIES}
+    finally:
+        conn.close()
+
+def write_through(path, rows):
+    '''Writes rows the way SmartCoil does: sensor rollups observe every reading.'''
+    manager = RollupManager(max_gap=600)
+    writer = DBWriter(path, flush_interval=0.01)
+    writer.add_observer('SENSOR_BME680_DATA', manager.hook_for('SENSOR_BME680_DATA'))
+    writer.add_hook('YR_WEATHER_API_DATA', manager.hook_for('YR_WEATHER_API_DATA'))
+    writer.add_transaction_hook(manager.commit, manager.rollback)
+    thread = threading.Thread(target=writer.run)
+    thread.start()
+    for table, row in rows:
+        if table == 'SENSOR_BME680_DATA':
+            writer.observe(table, row)
+            writer.submit(SENSOR, row)
+        else:
+            writer.submit(WEATHER, row)
+    writer.close()
+    thread.join(10)
+    assert writer.get_stats()['rows_failed'] == 0
+
+def fan(path, gran, bucket):
+    conn = sqlite3.connect(path)
+    try:
+        return conn.execute('SELECT fan_on_secs, covered_secs FROM SENSOR_ROLLUP_{} '
+                            'WHERE bucket = ?'.format(gran), [bucket]).fetchone()
+    finally:
+        conn.close()
+
+def test_fan_duty_is_time_weighted(dbase):
+    write_through(dbase, [('SENSOR_BME680_DATA', sensor_row(s, r))
+                          for s, r in [(0, 1), (30, 0), (90, 1), (120, 1), (900, 1), (960, 0)]])
+
+    # 0-30 s on, 30-90 s off across the minute boundary, 90-120 s on.
+    assert fan(dbase, 'MINUTE', START) == (30, 60)
+    assert fan(dbase, 'MINUTE', START + timedelta(minutes=1)) == (30, 60)
+    # the 780 s gap is longer than max_gap, it isn't credited.
+    assert fan(dbase, 'MINUTE', START + timedelta(minutes=2)) == (None, None)
+    assert fan(dbase, 'MINUTE', START + timedelta(minutes=15)) == (60, 60)
+    assert fan(dbase, 'HOUR', START) == (120, 180)
+
+def test_duty_is_split_across_days(dbase):
+    write_through(dbase, [('SENSOR_BME680_DATA', sensor_row(s, 1)) for s in (7170, 7230)])
+    assert fan(dbase, 'DAY', START.replace(hour=0)) == (30, 30)
+    assert fan(dbase, 'DAY', START.replace(hour=0) + timedelta(days=1)) == (30, 30)
+
+def test_incremental_rollups_match_a_rebuild(dbase):
+    write_through(dbase, readings())
+    incremental = rollups(dbase)
+    assert len(incremental[('SENSOR', 'DAY')]) == 2
+
+    RollupManager(max_gap=600).rebuild(dbase)
+    assert rollups(dbase) == incremental
+
+def test_rebuild_keeps_rollups_of_archived_days(dbase):
+    write_through(dbase, readings())
+    before = rollups(dbase)
+
+    # retention moved the raw rows of the first day out of the DB.
+    conn = sqlite3.connect(dbase)
+    codec = StorageCodec.load(conn)
+    midnight = codec.encode_time(START.replace(hour=0) + timedelta(days=1))
+    for table in SOURCES:
+        conn.execute('DELETE FROM {} WHERE timestamp < ?'.format(table), [midnight])
+    conn.commit()
+    conn.close()
+
+    RollupManager(max_gap=600).rebuild(dbase)
+    assert rollups(dbase) == before
+
+def test_migration_swaps_humidity_and_pressure_back(tmp_path):
+    path = str(tmp_path / 'SmartCoilDB.db')
+    older = tmp_path / 'migrations'
+    older.mkdir()
+    for name in sorted(os.listdir(MIGRATIONS)):
+        if name < '0007':
+            shutil.copy(os.path.join(MIGRATIONS, name), str(older))
+    assert SchemaMigrator(path, str(older)).migrate() == 6
+
+    conn = sqlite3.connect(path)
+    rows = [(START, 21.0, 1013.5, 45.5, 150000, 60, 0),       # written before the fix
+            (START + timedelta(seconds=1), 21.0, 45.5, 1013.5, 150000, 60, 0),
+            (START + timedelta(seconds=2), 21.0, None, 1013.5, 150000, 60, 0),
+            (START + timedelta(seconds=3), 21.0, 1012.0, 46.0, 150000, 60, 1)]
+    conn.executemany(SENSOR, rows)
+    conn.commit()
+
+    assert SchemaMigrator(path).migrate() >= 7
+    fixed = conn.execute('SELECT humidity, pressure FROM SENSOR_BME680_DATA '
+                         'ORDER BY timestamp').fetchall()
+    assert fixed == [(45.5, 1013.5), (45.5, 1013.5), (None, 1013.5), (46.0, 1012.0)]
+
+    # applied once, and a second run would find nothing to swap anyway.
+    conn.executescript(open(os.path.join(MIGRATIONS, '0007_sensor_humidity_pressure.sql')).read())
+    assert conn.execute('SELECT humidity, pressure FROM SENSOR_BME680_DATA '
+                        'ORDER BY timestamp').fetchall() == fixed
+    conn.close()
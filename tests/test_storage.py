@@ -0,0 +1,102 @@
+import sqlite3
+from datetime import datetime, timedelta
+
+import pytest
+
+from smartcoil.database.migrations import SchemaMigrator
+from smartcoil.database.storage import (StorageCodec, TABLES, V1, V2, V2_TABLES, convert_to_v2,
+                                        get_storage_format)
+
+START = datetime(2026, 3, 1)
+
+@pytest.fixture
+def dbase(tmp_path):
+    path = str(tmp_path / 'SmartCoilDB.db')
+    SchemaMigrator(path).migrate()
+    conn = sqlite3.connect(path)
+    conn.executemany('INSERT INTO SENSOR_BME680_DATA VALUES (?,?,?,?,?,?,?)',
+                     [(START + timedelta(minutes=i), 20.5, 50.25, 1013.5, 150000, 60, i % 2)
+                      for i in range(100)])
+    conn.executemany('INSERT INTO YR_WEATHER_API_DATA VALUES (?,?,?,?,?,?,?,?,?,?,?,?)',
+                     [(START + timedelta(minutes=5 * i), 40.41678, -3.70379, 10.5, 50, 1000,
+                       'rain', 3, 4.2, 'N', 10, 0.5) for i in range(20)])
+    conn.execute('INSERT INTO USER_DATA VALUES (?,?,?)', (START, 75, 2))
+    conn.commit()
+    conn.close()
+    return path
+
+def read_rows(path):
+    conn = sqlite3.connect(path)
+    try:
+        codec = StorageCodec.load(conn)
+        return {table: [codec.decode_row(conn, table, r) for r in
+                        conn.execute('SELECT * FROM {} ORDER BY timestamp'.format(table))]
+                for table in TABLES}
+    finally:
+        conn.close()
+
+def tables(path):
+    conn = sqlite3.connect(path)
+    try:
+        return {r[0] for r in conn.execute("SELECT name FROM sqlite_master WHERE type = 'table'")}
+    finally:
+        conn.close()
+
+def test_conversion_keeps_the_rows(dbase):
+    before = read_rows(dbase)
+    converted = convert_to_v2(dbase)
+
+    assert converted == {table: len(rows) for table, rows in before.items()}
+    assert read_rows(dbase) == before
+    conn = sqlite3.connect(dbase)
+    try:
+        assert get_storage_format(conn) == V2
+    finally:
+        conn.close()
+    assert convert_to_v2(dbase) == {}
+
+def test_rows_of_the_same_millisecond_are_skipped(dbase, capsys):
+    conn = sqlite3.connect(dbase)
+    conn.execute('INSERT INTO USER_DATA VALUES (?,?,?)', (START + timedelta(microseconds=10), 70, 1))
+    conn.commit()
+    conn.close()
+
+    assert convert_to_v2(dbase)['USER_DATA'] == 1
+    assert 'USER_DATA: 1 rows skipped' in capsys.readouterr().out
+
+def test_interrupted_conversion_can_run_again(dbase, monkeypatch):
+    before = read_rows(dbase)
+    encode_row = StorageCodec.encode_row
+
+    def failing(self, crsr, table, row):
+        if table == 'YR_WEATHER_API_DATA':
+            raise OSError('power cut')
+        return encode_row(self, crsr, table, row)
+
+    monkeypatch.setattr(StorageCodec, 'encode_row', failing)
+    with pytest.raises(OSError):
+        convert_to_v2(dbase)
+    monkeypatch.setattr(StorageCodec, 'encode_row', encode_row)
+
+    # nothing of the conversion was committed.
+    assert not any(t.endswith('_V2') for t in tables(dbase))
+    conn = sqlite3.connect(dbase)
+    try:
+        assert get_storage_format(conn) == V1
+    finally:
+        conn.close()
+    assert read_rows(dbase) == before
+
+    convert_to_v2(dbase)
+    assert read_rows(dbase) == before
+
+def test_leftover_v2_table_is_replaced(dbase):
+    before = read_rows(dbase)
+    conn = sqlite3.connect(dbase)
+    conn.execute(V2_TABLES['SENSOR_BME680_DATA'].format('SENSOR_BME680_DATA_V2'))
+    conn.execute('INSERT INTO SENSOR_BME680_DATA_V2 VALUES (1, 2, 3, 4, 5, 6, 7)')
+    conn.commit()
+    conn.close()
+
+    convert_to_v2(dbase)
+    assert read_rows(dbase) == before